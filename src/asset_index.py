@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import time
+
+ASSET_INDEX_FILE = os.getenv("ASSET_INDEX_FILE", "data/asset_index.sqlite")
+# Asset flags rarely change, refresh the index once a day
+ASSET_INDEX_MAX_AGE = float(os.getenv("ASSET_INDEX_MAX_AGE", str(24 * 60 * 60)))
+
+ASSET_FIELDS = ["tradable", "fractionable", "easy_to_borrow", "shortable", "status"]
+
+
+def asset_to_row(asset):
+    """
+    The asset_to_row function reads the fields we index from an Alpaca asset.
+    Works with assets from both alpaca_trade_api and alpaca-py.
+
+    :param asset: An Alpaca asset
+    :return: A tuple of symbol followed by ASSET_FIELDS
+    """
+    status = getattr(asset, "status", None)
+    return (
+        asset.symbol,
+        bool(asset.tradable),
+        bool(asset.fractionable),
+        bool(asset.easy_to_borrow),
+        bool(asset.shortable),
+        getattr(status, "value", status),
+    )
+
+
+def list_tradable_assets(api):
+    """
+    The list_tradable_assets function lists the active US equities, the listing every refresh of the index uses.
+    A refresh removes the symbols missing from its listing, so all callers must ask for the same assets.
+    Works with both alpaca_trade_api's REST client and alpaca-py's TradingClient.
+
+    :param api: An Alpaca client
+    :return: A list of Alpaca assets
+    """
+    if hasattr(api, "get_all_assets"):
+        from alpaca.trading.enums import AssetClass, AssetStatus
+        from alpaca.trading.requests import GetAssetsRequest
+
+        return api.get_all_assets(
+            GetAssetsRequest(status=AssetStatus.ACTIVE, asset_class=AssetClass.US_EQUITY)
+        )
+    return api.list_assets(status="active", asset_class="us_equity")
+
+
+class AssetIndex:
+    """
+    The AssetIndex class keeps Alpaca asset flags in a SQLite file and in a dictionary for O(1) lookups.
+    It is filled from one bulk asset listing and refreshed by diffing the listing against the stored snapshot.
+    """
+
+    def __init__(self, path: str = ASSET_INDEX_FILE):
+        """
+        :param path: str: The SQLite file
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS assets (symbol TEXT PRIMARY KEY, "
+            "tradable INTEGER, fractionable INTEGER, easy_to_borrow INTEGER, shortable INTEGER, status TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value REAL)"
+        )
+        self.connection.commit()
+        self.assets = {}
+        for row in self.connection.execute(
+            "SELECT symbol, tradable, fractionable, easy_to_borrow, shortable, status FROM assets"
+        ):
+            self.assets[row[0]] = (row[0], *(bool(v) for v in row[1:5]), row[5])
+
+    def refreshed_at(self):
+        """
+        The refreshed_at function returns when the index was last refreshed.
+
+        :return: A unix timestamp, 0 if never refreshed
+        """
+        row = self.connection.execute(
+            "SELECT value FROM metadata WHERE key = 'refreshed_at'"
+        ).fetchone()
+        return row[0] if row else 0.0
+
+    def is_stale(self, max_age: float = ASSET_INDEX_MAX_AGE):
+        return time.time() - self.refreshed_at() > max_age
+
+    def refresh(self, assets: list):
+        """
+        The refresh function updates the index from a bulk asset listing.
+        Only symbols that were added, removed or changed since the previous snapshot are written.
+
+        :param assets: list: Alpaca assets from list_tradable_assets
+        :return: A dictionary with the number of added, removed and changed symbols
+        """
+        rows = {row[0]: row for row in map(asset_to_row, assets)}
+
+        added = [row for symbol, row in rows.items() if symbol not in self.assets]
+        changed = [
+            row
+            for symbol, row in rows.items()
+            if symbol in self.assets and self.assets[symbol] != row
+        ]
+        removed = [symbol for symbol in self.assets if symbol not in rows]
+
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?)", added + changed
+        )
+        self.connection.executemany(
+            "DELETE FROM assets WHERE symbol = ?", [(symbol,) for symbol in removed]
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO metadata VALUES ('refreshed_at', ?)", (time.time(),)
+        )
+        self.connection.commit()
+        self.assets = rows
+
+        return {"added": len(added), "removed": len(removed), "changed": len(changed)}
+
+    def get(self, symbol: str):
+        """
+        The get function looks up the indexed flags of a symbol.
+
+        :param symbol: str: The ticker to look up
+        :return: A dictionary of ASSET_FIELDS, or None if the symbol is not in the index
+        """
+        row = self.assets.get(symbol)
+        return dict(zip(ASSET_FIELDS, row[1:])) if row else None
+
+    def __contains__(self, symbol: str):
+        return symbol in self.assets
+
+    def __len__(self):
+        return len(self.assets)
+
+
+def load_asset_index(
+    list_assets, path: str = ASSET_INDEX_FILE, max_age: float = ASSET_INDEX_MAX_AGE
+):
+    """
+    The load_asset_index function opens the asset index and refreshes it if it is older than max_age.
+
+    :param list_assets: A function returning every Alpaca asset, only called when a refresh is due
+    :param path: str: The SQLite file
+    :param max_age: float: Seconds before the index is refreshed
+    :return: An AssetIndex
+    """
+    index = AssetIndex(path)
+    if index.is_stale(max_age):
+        diff = index.refresh(list_assets())
+        print(
+            f"Refreshed asset index: {diff['added']} added, {diff['removed']} removed, {diff['changed']} changed"
+        )
+    return index
@@ -0,0 +1,507 @@
+import os
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from columnar_store import ColumnarStore, bar_store, headline_store
+from generate_trades import SENTIMENT_THRESHOLD, after_hours, during_market, pre_market, recommendation_key
+from headline_matcher import KeywordMatcher
+from llm_cache import RecommendationCache, get_cache
+from market_time import MORNING_CUTOFF, category_boundaries, epochs_to_eastern
+from trading_calendar import get_calendar
+
+# Offline backtest of the generate_trades strategy. Stored headlines are matched, scored from the
+# recommendation cache, averaged per ticker and trading category and handed to the same trade writers
+# as a live run. The trades are then filled against stored price bars, all windows and tickers at once:
+#   morning trades enter at the morning window and exit at the afternoon window of the same day,
+#   afternoon trades enter at the afternoon window and exit at the next day's afternoon window,
+# which is when the afternoon rebalance would trade them out again.
+# Run python src/backtest.py to replay a synthetic year.
+
+# Scores kept for backtests, without the live cache's expiry
+BACKTEST_SCORES_FILE = os.getenv("BACKTEST_SCORES_FILE", "data/backtest_scores.sqlite")
+# A bar older than this is not used as the price of a moment
+MAX_PRICE_AGE = 60 * 60
+
+SESSION_OF_CATEGORY = {1: "morning", 2: "afternoon", 3: "morning"}
+WRITERS = {1: pre_market, 2: during_market, 3: after_hours}
+ALLOCATIONS = ["equal", "sentiment"]
+AGGREGATIONS = ["mean", "median", "sum", "last"]
+
+
+class TradeRecorder:
+    """
+    The TradeRecorder class stands in for the trade store of the writers, keeping what they append in memory.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def append(self, df: pd.DataFrame):
+        self.frames.append(df)
+        return len(df)
+
+    def trades(self):
+        if not self.frames:
+            return pd.DataFrame(columns=["ticker", "recommendation", "side", "session"])
+        return pd.concat(self.frames)
+
+
+def get_backtest_scores():
+    """
+    The get_backtest_scores function opens the backtest score cache, whose entries do not expire.
+    """
+    return RecommendationCache(BACKTEST_SCORES_FILE, ttl=float("inf"), max_entries=2**62)
+
+
+def load_headlines(store: ColumnarStore, start_day: date, end_day: date, stocks: pd.DataFrame = None):
+    """
+    The load_headlines function reads the stored headlines of a range of days.
+    Headlines stored without a ticker are matched against the stocks' keywords.
+
+    :param store: ColumnarStore: The headline store
+    :param start_day: date: The first day
+    :param end_day: date: The last day
+    :param stocks: pd.DataFrame: Stocks with ticker, company and keywords columns, for unmatched headlines
+    :return: A dataframe with the following columns: ticker, company, headline, datetime (epoch seconds)
+    """
+    days = [day.strftime("%Y-%m-%d") for day in pd.date_range(start_day, end_day, freq="D")]
+    df = store.read({"date": days}, columns=["ticker", "company", "headline", "datetime"])
+    df = df.astype({"ticker": object, "company": object})
+    unmatched = df["ticker"].isna() | (df["ticker"] == "")
+    if unmatched.any() and stocks is not None:
+        matched = KeywordMatcher(stocks).match(
+            df.loc[unmatched, ["headline", "datetime"]].reset_index(drop=True)
+        )
+        df = pd.concat([df[~unmatched], matched[df.columns]], ignore_index=True)
+    else:
+        df = df[~unmatched]
+    return df.sort_values("datetime", kind="stable", ignore_index=True)
+
+
+def cached_scores(df: pd.DataFrame, cache: RecommendationCache, scorer=None):
+    """
+    The cached_scores function looks up the recommendation of every headline, first in the backtest cache,
+    then in the live cache, and finally with the scorer if one is given. Found scores are kept in the backtest cache.
+
+    :param df: pd.DataFrame: Headlines with headline and company columns
+    :param cache: RecommendationCache: The backtest cache
+    :param scorer: A function scoring a dataframe of headlines, e.g. generate_trades.score_headlines
+    :return: A float array of recommendations, NaN where none was found
+    """
+    keys = [
+        recommendation_key(headline, company, "short")
+        for headline, company in zip(df["headline"], df["company"])
+    ]
+    scores = cache.get_many(keys, max_age=float("inf"))
+    missing = [key for key in dict.fromkeys(keys) if key not in scores]
+    if missing:
+        found = get_cache().get_many(missing)
+        missing = [key for key in missing if key not in found]
+        if missing and scorer is not None:
+            wanted = set(missing)
+            rows = df[[key in wanted for key in keys]].drop_duplicates(subset=["headline", "company"])
+            row_keys = [recommendation_key(h, c, "short") for h, c in zip(rows["headline"], rows["company"])]
+            found.update(zip(row_keys, scorer(rows)))
+        if found:
+            cache.put_many(found)
+            scores.update(found)
+    return np.array([scores.get(key, np.nan) for key in keys], dtype=float)
+
+
+def execution_windows(first_day: date, last_day: date):
+    """
+    The execution_windows function lists the start of every morning and afternoon execution window of a range,
+    plus those of the following year so trades near the end of the range still have an exit.
+
+    :return: A dictionary of session name to a sorted array of window starts in epoch seconds
+    """
+    calendar = get_calendar()
+    calendar.ensure_years(*range(first_day.year, last_day.year + 2))
+    starts = np.asarray(calendar.window_starts)
+    names = np.asarray(calendar.window_names)
+    return {session: starts[names == session].astype(np.int64) for session in ["morning", "afternoon"]}
+
+
+def generate_backtest_trades(
+    headlines: pd.DataFrame,
+    windows: dict,
+    threshold: float = SENTIMENT_THRESHOLD,
+    aggregation: str = "mean",
+    morning_cutoff: pd.Timedelta = MORNING_CUTOFF,
+):
+    """
+    The generate_backtest_trades function runs the trade writers of generate_trades on every trading category
+    of the headlines. Each category's headlines go to the next execution window of its session, and headlines
+    published after that window opened are left out, as a live run would not have seen them yet.
+
+    :param headlines: pd.DataFrame: Scored headlines with ticker, datetime (epoch seconds) and recommendation columns
+    :param windows: dict: From execution_windows
+    :param threshold: float: The sentiment a ticker must exceed to be traded
+    :param aggregation: str: How a ticker's sentiments in a category are combined, one of AGGREGATIONS
+    :param morning_cutoff: pd.Timedelta: When the pre-market category ends
+    :return: A dataframe with the following columns: ticker, recommendation, side, session, window (index into
+        windows[session]), one row per window and ticker, later categories overriding earlier ones like the
+        trade store's deduplication does
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {aggregation}, expected one of {', '.join(AGGREGATIONS)}")
+    if headlines.empty:
+        return TradeRecorder().trades().assign(window=pd.Series(dtype=np.int64))
+    epochs = headlines["datetime"].to_numpy(dtype=np.int64)
+    first = epochs_to_eastern(pd.Series([epochs.min()])).dt.date[0]
+    last = epochs_to_eastern(pd.Series([epochs.max()])).dt.date[0]
+    boundaries, categories = category_boundaries(first, last + pd.Timedelta(days=1), "s", morning_cutoff)
+    segment = np.searchsorted(boundaries, epochs, side="right") - 1
+    category = categories[segment]
+    session = np.array([None, *SESSION_OF_CATEGORY.values()], dtype=object)[category]
+
+    window = np.full(len(headlines), -1, dtype=np.int64)
+    for name, starts in windows.items():
+        in_session = np.flatnonzero(session == name)
+        next_window = np.searchsorted(starts, boundaries[segment[in_session]], side="left")
+        # the last window has no exit, and headlines published once the window opened came too late for it
+        on_time = next_window < len(starts) - 1
+        on_time[on_time] = epochs[in_session[on_time]] < starts[next_window[on_time]]
+        window[in_session[on_time]] = next_window[on_time]
+
+    usable = (window >= 0) & headlines["recommendation"].notna().to_numpy()
+    scored = headlines[usable].assign(segment=segment[usable], category=category[usable], window=window[usable])
+    means = (
+        scored.groupby(["segment", "category", "window", "ticker"], sort=True)["recommendation"]
+        .agg(aggregation)
+        .reset_index()
+    )
+    # one call per writer: the writers keep the index of the rows they turn into trades,
+    # which leads back to each trade's category and window
+    recorder = TradeRecorder()
+    for category_id, writer in WRITERS.items():
+        writer(means.loc[means["category"] == category_id, ["ticker", "recommendation"]], recorder, threshold)
+
+    trades = recorder.trades().join(means[["segment", "window"]])
+    trades = trades.sort_values("segment", kind="stable").drop_duplicates(
+        subset=["session", "window", "ticker"], keep="last"
+    )
+    return trades[["ticker", "recommendation", "side", "session", "window"]].reset_index(drop=True)
+
+
+class PriceIndex:
+    """
+    The PriceIndex class keeps price bars sorted by one int64 key over ticker and time, so the price of
+    many (ticker, moment) pairs is one searchsorted. The arrays can be memory mapped and shared between processes.
+    """
+
+    def __init__(self, keys: np.ndarray, closes: np.ndarray, universe: pd.Index):
+        """
+        :param keys: np.ndarray: Sorted ticker code << 32 | bar start in epoch seconds
+        :param closes: np.ndarray: The close of every bar, in key order
+        :param universe: pd.Index: The tickers, a ticker's code is its position
+        """
+        self.keys = keys
+        self.closes = closes
+        self.universe = universe
+
+    @classmethod
+    def from_bars(cls, bars: pd.DataFrame, tickers=()):
+        """
+        The from_bars function builds the index of bars with ticker, datetime (epoch seconds) and close columns.
+
+        :param tickers: Tickers to give a code even if they have no bars
+        """
+        names = bars["ticker"]
+        if not isinstance(names.dtype, pd.CategoricalDtype):
+            names = names.astype("category")
+        universe = names.cat.categories.astype(str).append(pd.Index(np.asarray(tickers, dtype=str))).unique()
+        bar_codes = universe.get_indexer(names.cat.categories.astype(str))[names.cat.codes.to_numpy()]
+        keys = (bar_codes.astype(np.int64) << 32) + bars["datetime"].to_numpy(dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        return cls(keys[order], bars["close"].to_numpy(dtype=float)[order], universe)
+
+    def codes(self, tickers: np.ndarray):
+        """
+        The codes function returns the codes of tickers, -1 for tickers not in the universe. Integer arrays are already codes.
+        """
+        tickers = np.asarray(tickers)
+        if np.issubdtype(tickers.dtype, np.integer):
+            return tickers.astype(np.int64)
+        return self.universe.get_indexer(tickers.astype(str)).astype(np.int64)
+
+    def prices_at(self, tickers: np.ndarray, times: np.ndarray, max_age: int = MAX_PRICE_AGE):
+        """
+        The prices_at function returns the close of the last bar starting before each moment, if it is recent enough.
+
+        :param tickers: np.ndarray: The tickers, or their codes
+        :param times: np.ndarray: The moments, epoch seconds
+        :param max_age: int: Bars starting longer ago than this are not used
+        :return: A float array of prices, NaN where there is no recent bar
+        """
+        codes = self.codes(tickers)
+        times = np.asarray(times, dtype=np.int64)
+        position = np.searchsorted(self.keys, (codes << 32) + times, side="left") - 1
+        found = (position >= 0) & (codes >= 0)
+        position = np.where(found, position, 0)
+        found &= (self.keys[position] >> 32) == codes
+        found &= times - (self.keys[position] & 0xFFFFFFFF) <= max_age
+        return np.where(found, self.closes[position], np.nan)
+
+
+def prices_at(bars: pd.DataFrame, tickers: np.ndarray, times: np.ndarray, max_age: int = MAX_PRICE_AGE):
+    """
+    The prices_at function finds the price of many (ticker, moment) pairs in a dataframe of bars, see PriceIndex.
+    """
+    return PriceIndex.from_bars(bars, tickers).prices_at(tickers, times, max_age)
+
+
+def simulate_fills(
+    trades: pd.DataFrame,
+    prices: PriceIndex,
+    windows: dict,
+    buying_power: float,
+    allocation: str = "equal",
+    cost_bps: float = 0.0,
+):
+    """
+    The simulate_fills function prices every trade at its entry and exit and computes its P&L.
+    Each window's buying power is spread over its filled trades, equally or by the strength of the recommendation.
+
+    :param trades: pd.DataFrame: From generate_backtest_trades
+    :param prices: PriceIndex: The price bars
+    :param windows: dict: From execution_windows
+    :param buying_power: float: The budget of every window
+    :param allocation: str: equal or sentiment
+    :param cost_bps: float: Trading cost per side, in basis points of the notional
+    :return: The trades with entry_time, exit_time, entry_price, exit_price, filled, notional and pnl columns
+    """
+    if allocation not in ALLOCATIONS:
+        raise ValueError(f"Unknown allocation {allocation}, expected one of {', '.join(ALLOCATIONS)}")
+    window = trades["window"].to_numpy(dtype=np.int64)
+    morning = (trades["session"] == "morning").to_numpy()
+    entry = np.where(
+        morning,
+        windows["morning"][np.where(morning, window, 0)],
+        windows["afternoon"][np.where(morning, 0, window)],
+    )
+    # morning positions are traded out by the same day's afternoon rebalance, afternoon ones by the next day's
+    exit_index = np.where(
+        morning,
+        np.searchsorted(windows["afternoon"], entry, side="right"),
+        window + 1,
+    )
+    has_exit = exit_index < len(windows["afternoon"])
+    exit_time = windows["afternoon"][np.minimum(exit_index, len(windows["afternoon"]) - 1)]
+
+    tickers = trades["ticker"].to_numpy()
+    found = prices.prices_at(np.concatenate([tickers, tickers]), np.concatenate([entry, exit_time]))
+    entry_price, exit_price = found[: len(trades)], found[len(trades) :]
+    filled = has_exit & np.isfinite(entry_price) & np.isfinite(exit_price)
+
+    weight = np.abs(trades["recommendation"].to_numpy(dtype=float)) if allocation == "sentiment" else np.ones(len(trades))
+    weight = np.where(filled, weight, 0.0)
+    # one budget per (session, window)
+    budget_id = np.where(morning, 2 * window, 2 * window + 1)
+    totals = np.bincount(budget_id, weights=weight, minlength=budget_id.max() + 1 if len(budget_id) else 0)
+    notional = np.divide(
+        buying_power * weight, totals[budget_id], out=np.zeros(len(trades)), where=totals[budget_id] > 0
+    )
+
+    side = np.where(trades["side"].to_numpy() == "buy", 1.0, -1.0)
+    returns = np.divide(exit_price, entry_price, out=np.zeros(len(trades)), where=filled) - 1.0
+    pnl = np.where(filled, side * notional * returns - 2 * notional * cost_bps / 1e4, 0.0)
+    return trades.assign(
+        entry_time=entry,
+        exit_time=exit_time,
+        entry_price=entry_price,
+        exit_price=exit_price,
+        filled=filled,
+        notional=notional,
+        pnl=pnl,
+    )
+
+
+def summarize_backtest(fills: pd.DataFrame, buying_power: float):
+    """
+    The summarize_backtest function reports P&L, turnover and hit rate per session and overall.
+    Turnover is the notional bought and sold per window as a multiple of the buying power, and the hit rate
+    is the share of filled trades with a positive P&L.
+
+    :return: A dataframe indexed by session (morning, afternoon, all)
+    """
+    rows = {}
+    for name, group in [*fills.groupby("session", sort=True), ("all", fills)]:
+        filled = group[group["filled"]]
+        windows = filled.groupby(["session", "window"]).ngroups
+        rows[name] = {
+            "windows": windows,
+            "trades": len(group),
+            "filled": len(filled),
+            "pnl": filled["pnl"].sum(),
+            "return_per_window": filled["pnl"].sum() / (buying_power * windows) if windows else 0.0,
+            "turnover": 2 * filled["notional"].sum() / (buying_power * windows) if windows else 0.0,
+            "hit_rate": (filled["pnl"] > 0).mean() if len(filled) else 0.0,
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def download_bars(tickers: list, start_day: date, end_day: date, timeframe: str = "15Min", store: ColumnarStore = None):
+    """
+    The download_bars function fetches historical bars from Alpaca into the bar store,
+    one request per MAX_SYMBOLS_PER_REQUEST tickers.
+
+    :param tickers: list: The tickers to download
+    :param start_day: date: The first day
+    :param end_day: date: The last day
+    :param timeframe: str: The bar length, e.g. 15Min or 1Hour
+    :param store: ColumnarStore: The bar store, defaults to the one in BARS_DIR
+    :return: The number of bars stored
+    """
+    from columnar_store import eastern_dates
+    from execute_trades import MAX_SYMBOLS_PER_REQUEST, get_api
+
+    store = store or bar_store()
+    stored = 0
+    for chunk_start in range(0, len(tickers), MAX_SYMBOLS_PER_REQUEST):
+        chunk = tickers[chunk_start : chunk_start + MAX_SYMBOLS_PER_REQUEST]
+        bars = get_api().get_bars(chunk, timeframe, start=start_day.isoformat(), end=end_day.isoformat()).df
+        if bars.empty:
+            continue
+        bars = bars.reset_index().rename(columns={"symbol": "ticker"})
+        bars["datetime"] = (bars["timestamp"] - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+        bars["date"] = eastern_dates(bars["datetime"])
+        stored += store.append(bars)
+        print(f"{stored} bars stored")
+    store.compact()
+    return stored
+
+
+def run_backtest(
+    start_day: date,
+    end_day: date,
+    headlines: ColumnarStore = None,
+    bars: ColumnarStore = None,
+    stocks: pd.DataFrame = None,
+    cache: RecommendationCache = None,
+    scorer=None,
+    buying_power: float = 1000.0,
+    allocation: str = "equal",
+    cost_bps: float = 0.0,
+    threshold: float = SENTIMENT_THRESHOLD,
+    aggregation: str = "mean",
+    morning_cutoff: pd.Timedelta = MORNING_CUTOFF,
+):
+    """
+    The run_backtest function replays the stored headlines of a range of days and simulates the resulting trades.
+
+    :param start_day: date: The first day of headlines
+    :param end_day: date: The last day of headlines
+    :param headlines: ColumnarStore: The headline store, defaults to the one in HEADLINES_DIR
+    :param bars: ColumnarStore: The bar store, defaults to the one in BARS_DIR
+    :param stocks: pd.DataFrame: Stocks to match headlines stored without a ticker against
+    :param cache: RecommendationCache: The backtest score cache, defaults to the one in BACKTEST_SCORES_FILE
+    :param scorer: Scores headlines missing from both caches, by default they are left out
+    :param buying_power: float: The budget of every execution window
+    :param allocation: str: equal or sentiment
+    :param cost_bps: float: Trading cost per side, in basis points
+    :param threshold: float: The sentiment a ticker must exceed to be traded
+    :param aggregation: str: How a ticker's sentiments in a category are combined, one of AGGREGATIONS
+    :param morning_cutoff: pd.Timedelta: When the pre-market category ends
+    :return: The summary from summarize_backtest and the simulated trades
+    """
+    timings = {}
+    start_time = time.perf_counter()
+    df = load_headlines(headlines or headline_store(), start_day, end_day, stocks)
+    timings["load"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    df["recommendation"] = cached_scores(df, cache or get_backtest_scores(), scorer)
+    timings["score"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    windows = execution_windows(start_day, end_day)
+    trades = generate_backtest_trades(df, windows, threshold, aggregation, morning_cutoff)
+    timings["trades"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    # the last exits can be a few days past the range
+    days = [day.strftime("%Y-%m-%d") for day in pd.date_range(start_day, end_day + pd.Timedelta(days=7), freq="D")]
+    price_bars = (bars or bar_store()).read({"date": days}, columns=["ticker", "datetime", "close"])
+    fills = simulate_fills(trades, PriceIndex.from_bars(price_bars), windows, buying_power, allocation, cost_bps)
+    timings["fills"] = time.perf_counter() - start_time
+
+    print(
+        f"{len(df)} headlines, {int(df['recommendation'].notna().sum())} scored, {len(trades)} trades: "
+        + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items())
+    )
+    return summarize_backtest(fills, buying_power), fills
+
+
+def synthetic_replay(root: str, num_tickers: int = 300, seed: int = 0):
+    """
+    The synthetic_replay function writes a year of made-up headlines and 15-minute bars for the demos, with
+    60 headlines a day whose sentiment slightly predicts returns, and caches the sentiment of every headline.
+
+    :param root: str: The directory of the headline and bar stores
+    :return: The headline store, the bar store and the score cache
+    """
+    from columnar_store import eastern_dates
+
+    rng = np.random.default_rng(seed)
+    tickers = np.array([f"T{i:03d}" for i in range(num_tickers)])
+    calendar = get_calendar()
+    calendar.ensure_years(2024, 2025)
+    sessions = [(day, *calendar.session(date.fromisoformat(day))) for day in calendar.days if day.startswith("2024")]
+    sessions += [(day, *calendar.session(date.fromisoformat(day))) for day in calendar.days if day.startswith("2025-01")]
+
+    bar_times = np.concatenate([np.arange(open_, close, 15 * 60) for _, open_, close in sessions]).astype(np.int64)
+    drift = np.zeros((len(bar_times), len(tickers)))
+    headline_rows = []
+    day_of_bar = np.concatenate([np.full(len(range(int(o), int(c), 15 * 60)), i) for i, (_, o, c) in enumerate(sessions)])
+    for i, (day, open_, close) in enumerate(sessions):
+        chosen = rng.choice(len(tickers), 60)
+        sentiment = rng.choice([-1, 0, 1], 60)
+        published = rng.integers(int(open_) - 6 * 3600, int(close) + 4 * 3600, 60)
+        for t, s, p in zip(chosen, sentiment, published):
+            headline_rows.append((tickers[t], f"Company {tickers[t]}", f"{tickers[t]} news {i}-{p}", p, s))
+            drift[(bar_times > p) & (day_of_bar <= i + 1), t] += s * 0.0005
+    returns = rng.normal(0, 0.003, drift.shape) + drift
+    closes = 50 * np.exp(np.cumsum(returns, axis=0))
+
+    bars_df = pd.DataFrame(
+        {
+            "ticker": np.tile(tickers, len(bar_times)),
+            "datetime": np.repeat(bar_times, len(tickers)),
+            "close": closes.ravel(),
+        }
+    )
+    bars_df = bars_df.assign(open=bars_df["close"], high=bars_df["close"], low=bars_df["close"], volume=1000.0)
+    bars_df["date"] = eastern_dates(bars_df["datetime"])
+    headlines_df = pd.DataFrame(headline_rows, columns=["ticker", "company", "headline", "datetime", "score"])
+    headlines_df["date"] = eastern_dates(headlines_df["datetime"])
+    headlines_df["source"] = "Finnhub"
+
+    headline_root, bar_root = headline_store(os.path.join(root, "headlines")), bar_store(os.path.join(root, "bars"))
+    headline_root.append(headlines_df)
+    bar_root.append(bars_df)
+    cache = RecommendationCache(":memory:", ttl=float("inf"), max_entries=2**62)
+    cache.put_many(
+        {
+            recommendation_key(h, c, "short"): int(s)
+            for h, c, s in zip(headlines_df["headline"], headlines_df["company"], headlines_df["score"])
+        }
+    )
+    print(f"{len(headlines_df)} headlines and {len(bars_df)} bars written")
+    return headline_root, bar_root, cache
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    headline_root, bar_root, cache = synthetic_replay(tempfile.mkdtemp())
+
+    start_time = time.perf_counter()
+    summary, fills = run_backtest(
+        date(2024, 1, 1), date(2024, 12, 31), headline_root, bar_root, cache=cache, buying_power=1000.0
+    )
+    print(f"replayed a year in {time.perf_counter() - start_time:.1f} seconds")
+    print(summary.round(4).to_string())
@@ -0,0 +1,248 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Single entry point for the cron jobs:
+#   python src/cli.py generate-trades
+#   python src/cli.py execute-trades
+#   python src/cli.py finnhub-headlines
+#   python src/cli.py stock-list
+#   python src/cli.py stream [--replay recorded.csv ...]
+#   python src/cli.py download-bars --start 2024-01-01 --end 2024-12-31
+#   python src/cli.py backtest --start 2024-01-01 --end 2024-12-31
+#   python src/cli.py sweep --start 2024-01-01 --end 2024-12-31 --threshold 0 0.5 --aggregation mean last
+#   python src/cli.py startup-benchmark
+# Each command imports its module only once it runs, so a launch that has nothing to do never pays for
+# pandas, alpaca_trade_api, openai or pandas_market_calendars.
+
+# A no-op execute-trades launch must finish within this many seconds
+STARTUP_BUDGET_SECONDS = 0.5
+# Modules a no-op execute-trades launch must not import
+HEAVY_MODULES = ["pandas", "alpaca_trade_api", "openai", "pandas_market_calendars", "pyarrow"]
+# A Saturday, so execute-trades exits without trading
+NO_OP_MOMENT = "2024-01-06T12:00:00-05:00"
+
+
+def generate_trades_command(args):
+    from generate_trades import generate_trades
+
+    print("welcome to generate_trades!")
+    start_time = time.time()
+    generate_trades(args.stocks)
+    print(f"total time: {round(time.time() - start_time, 1)} seconds")
+
+
+def execute_trades_command(args):
+    from datetime import datetime
+
+    from trading_calendar import get_calendar
+
+    now = datetime.fromisoformat(args.at).timestamp() if args.at else time.time()
+    calendar = get_calendar()
+    window = calendar.current_window(now)
+    if window is None:
+        name, start, _ = calendar.next_window(now)
+        print(f"Not in an execution window, next is the {name} window at {start:%Y-%m-%d %H:%M}")
+        return
+    if args.at:
+        print(f"In the {window} window, not trading for a moment other than now")
+        return
+
+    from execute_trades import execute_trades
+
+    try:
+        execute_trades()
+    except Exception as e:
+        print(f"Error executing trades: {str(e)}")
+
+
+def finnhub_headlines_command(args):
+    from finnhub_headlines import main
+
+    main(args.stocks)
+
+
+def stock_list_command(args):
+    from generate_stock_list import main
+
+    main()
+
+
+def stream_command(args):
+    from headline_stream import main
+
+    main(args.stream_args)
+
+
+def download_bars_command(args):
+    from datetime import date
+
+    import pandas as pd
+
+    from backtest import download_bars
+
+    tickers = pd.read_csv(args.stocks)["ticker"].tolist()
+    download_bars(tickers, date.fromisoformat(args.start), date.fromisoformat(args.end), args.timeframe)
+
+
+def backtest_command(args):
+    from datetime import date
+
+    import pandas as pd
+
+    from backtest import run_backtest
+
+    summary, _ = run_backtest(
+        date.fromisoformat(args.start),
+        date.fromisoformat(args.end),
+        stocks=pd.read_csv(args.stocks),
+        buying_power=args.buying_power,
+        allocation=args.allocation,
+        cost_bps=args.cost_bps,
+    )
+    print(summary.round(4).to_string())
+
+
+def sweep_command(args):
+    from datetime import date
+
+    import pandas as pd
+
+    from sweep import parameter_grid, sweep
+
+    grid = parameter_grid(
+        morning_cutoff=args.morning_cutoff,
+        threshold=args.threshold,
+        aggregation=args.aggregation,
+        allocation=args.allocation,
+        buying_power=args.buying_power,
+    )
+    summary = sweep(
+        date.fromisoformat(args.start),
+        date.fromisoformat(args.end),
+        grid,
+        stocks=pd.read_csv(args.stocks),
+        **{name: value for name, value in [("workers", args.workers), ("results_file", args.results)] if value},
+    )
+    print(summary.sort_values("pnl", ascending=False).head(args.top).round(4).to_string())
+
+
+def parse_importtime(stderr: str):
+    """
+    The parse_importtime function reads the output of python -X importtime.
+
+    :param stderr: str: The standard error of the run
+    :return: A dictionary of module name, indented by nesting level, to cumulative import time in seconds
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            # nested imports are indented by two spaces per level
+            modules[name[1:]] = int(cumulative) / 1e6
+    return modules
+
+
+def startup_benchmark_command(args):
+    """
+    The startup_benchmark_command function times a no-op execute-trades launch under python -X importtime
+    and fails if it is over budget or imports a heavy module.
+    """
+    command = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "execute-trades", "--at", NO_OP_MOMENT]
+    # the first launch may have to fill the trading calendar cache
+    subprocess.run(command, capture_output=True, text=True)
+
+    start_time = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start_time
+
+    modules = parse_importtime(result.stderr)
+    top_level = {name: seconds for name, seconds in modules.items() if not name.startswith(" ")}
+    print(result.stdout.strip())
+    print(f"no-op execute-trades: {elapsed:.3f} seconds wall, {sum(top_level.values()):.3f} seconds importing")
+    for name, seconds in sorted(top_level.items(), key=lambda item: -item[1])[: args.top]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    imported = {name.strip() for name in modules}
+    heavy = [name for name in HEAVY_MODULES if name in imported]
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        sys.exit("no-op execute-trades failed")
+    if heavy:
+        sys.exit(f"no-op execute-trades imported {', '.join(heavy)}")
+    if elapsed > args.budget:
+        sys.exit(f"no-op execute-trades took {elapsed:.3f} seconds, budget is {args.budget} seconds")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="llm_trader", description="llm_trader cron entry points")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("generate-trades", help="score today's headlines and write trades")
+    command.add_argument("--stocks", default="data/stocks_info_3.csv")
+    command.set_defaults(run=generate_trades_command)
+
+    command = commands.add_parser("execute-trades", help="execute the trades of the current window")
+    command.add_argument("--at", help="only report the window at this ISO datetime (with offset), never trades")
+    command.set_defaults(run=execute_trades_command)
+
+    command = commands.add_parser("finnhub-headlines", help="fetch today's Finnhub headlines")
+    command.add_argument("--stocks", default="data/stocks_info_3.csv")
+    command.set_defaults(run=finnhub_headlines_command)
+
+    command = commands.add_parser("stock-list", help="rebuild the stock universe")
+    command.set_defaults(run=stock_list_command)
+
+    # every option of the stream command is headline_stream's own, including --help
+    command = commands.add_parser("stream", help="run the streaming mode, see headline_stream.py --help", add_help=False)
+    command.set_defaults(run=stream_command)
+
+    command = commands.add_parser("download-bars", help="store historical price bars for backtests")
+    command.add_argument("--stocks", default="data/stocks_info_3.csv")
+    command.add_argument("--start", required=True, help="first day, e.g. 2024-01-01")
+    command.add_argument("--end", required=True, help="last day")
+    command.add_argument("--timeframe", default="15Min")
+    command.set_defaults(run=download_bars_command)
+
+    command = commands.add_parser("backtest", help="replay stored headlines against stored bars")
+    command.add_argument("--stocks", default="data/stocks_info_3.csv")
+    command.add_argument("--start", required=True, help="first day, e.g. 2024-01-01")
+    command.add_argument("--end", required=True, help="last day")
+    command.add_argument("--buying-power", type=float, default=1000.0)
+    command.add_argument("--allocation", choices=["equal", "sentiment"], default="equal")
+    command.add_argument("--cost-bps", type=float, default=0.0, help="trading cost per side in basis points")
+    command.set_defaults(run=backtest_command)
+
+    command = commands.add_parser("sweep", help="backtest every combination of some knobs in parallel")
+    command.add_argument("--stocks", default="data/stocks_info_3.csv")
+    command.add_argument("--start", required=True, help="first day, e.g. 2024-01-01")
+    command.add_argument("--end", required=True, help="last day")
+    command.add_argument("--morning-cutoff", nargs="+", default=["11:30"], help="end of the pre-market category")
+    command.add_argument("--threshold", nargs="+", type=float, default=[0.0])
+    command.add_argument("--aggregation", nargs="+", choices=["mean", "median", "sum", "last"], default=["mean"])
+    command.add_argument("--allocation", nargs="+", choices=["equal", "sentiment"], default=["equal"])
+    command.add_argument("--buying-power", nargs="+", type=float, default=[1000.0])
+    command.add_argument("--workers", type=int, help="worker processes, defaults to SWEEP_WORKERS")
+    command.add_argument("--results", help="results CSV, defaults to SWEEP_RESULTS_FILE")
+    command.add_argument("--top", type=int, default=10, help="number of best combinations to list")
+    command.set_defaults(run=sweep_command)
+
+    command = commands.add_parser("startup-benchmark", help="time a no-op execute-trades launch")
+    command.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS)
+    command.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    command.set_defaults(run=startup_benchmark_command)
+
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "stream":
+        args.stream_args = extra
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import fcntl
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from market_time import epochs_to_eastern
+
+# Partitioned Arrow IPC storage for headlines and trades, laid out hive style:
+#   <root>/date=2024-01-02/source=Finnhub/part-<time>-<id>.arrow
+# Every append writes a new part file, so nothing is rewritten or re-parsed. Reads memory map the
+# part files of the matching partitions only.
+
+HEADLINES_DIR = os.getenv("HEADLINES_DIR", "data/headlines")
+TRADES_DIR = os.getenv("TRADES_DIR", "data/trades")
+BARS_DIR = os.getenv("BARS_DIR", "data/bars")
+
+# A partition with at least this many part files is merged into one by compact()
+COMPACT_MIN_PARTS = 8
+
+HEADLINE_SCHEMA = pa.schema(
+    [
+        ("ticker", pa.dictionary(pa.int32(), pa.string())),
+        ("company", pa.dictionary(pa.int32(), pa.string())),
+        ("headline", pa.string()),
+        # unix epoch seconds, as Finnhub reports them
+        ("datetime", pa.int64()),
+    ]
+)
+
+TRADE_SCHEMA = pa.schema(
+    [
+        ("ticker", pa.dictionary(pa.int32(), pa.string())),
+        ("side", pa.dictionary(pa.int32(), pa.string())),
+        ("recommendation", pa.float64()),
+        # unix epoch seconds the trade was generated at
+        ("datetime", pa.int64()),
+    ]
+)
+
+# Side of a ticker whose sentiment no longer clears the threshold. It replaces the ticker's earlier trade of the
+# session and is not executed.
+HOLD_SIDE = "hold"
+
+BAR_SCHEMA = pa.schema(
+    [
+        ("ticker", pa.dictionary(pa.int32(), pa.string())),
+        # unix epoch seconds the bar starts at
+        ("datetime", pa.int64()),
+        ("open", pa.float64()),
+        ("high", pa.float64()),
+        ("low", pa.float64()),
+        ("close", pa.float64()),
+        ("volume", pa.float64()),
+    ]
+)
+
+
+class ColumnarStore:
+    """
+    The ColumnarStore class keeps a typed table in Arrow IPC part files, partitioned by string columns.
+    Appends and compactions are atomic: part files are written under a temporary name and renamed
+    into place, and a lock file keeps readers from seeing a compaction half done.
+    """
+
+    def __init__(self, root: str, schema: pa.Schema, partitions: list):
+        """
+        :param root: str: The store directory
+        :param schema: pa.Schema: The schema of the stored columns, without the partition columns
+        :param partitions: list: The names of the partition columns, outermost first
+        """
+        self.root = root
+        self.schema = schema
+        self.partitions = partitions
+        self.partitioning = ds.partitioning(
+            pa.schema([(name, pa.string()) for name in partitions]), flavor="hive"
+        )
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def lock(self, exclusive: bool = False):
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def partition_dir(self, values: tuple):
+        return os.path.join(
+            self.root, *(f"{name}={value}" for name, value in zip(self.partitions, values))
+        )
+
+    def write_part(self, table: pa.Table, directory: str):
+        """
+        The write_part function writes a table to a new part file, renaming it into place once complete.
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.arrow"
+        temporary = os.path.join(directory, f".{name}.tmp")
+        # the IPC file format allows a single dictionary per column
+        table = table.unify_dictionaries().combine_chunks()
+        try:
+            with pa.OSFile(temporary, "wb") as sink:
+                with pa.ipc.new_file(sink, self.schema) as writer:
+                    writer.write_table(table)
+            os.replace(temporary, os.path.join(directory, name))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+    def append(self, df: pd.DataFrame):
+        """
+        The append function adds rows to the store, one new part file per partition.
+
+        :param df: pd.DataFrame: Rows with the schema columns and the partition columns
+        :return: The number of rows written
+        """
+        if df.empty:
+            return 0
+        with self.lock():
+            for values, group in df.groupby(self.partitions, sort=False):
+                values = values if isinstance(values, tuple) else (values,)
+                table = pa.Table.from_pandas(
+                    group[self.schema.names], schema=self.schema, preserve_index=False
+                )
+                self.write_part(table, self.partition_dir(values))
+        return len(df)
+
+    def dataset(self):
+        return ds.dataset(
+            self.root,
+            schema=pa.unify_schemas([self.schema, self.partitioning.schema]),
+            format="ipc",
+            partitioning=self.partitioning,
+            filesystem=fs.LocalFileSystem(use_mmap=True),
+            exclude_invalid_files=False,
+            ignore_prefixes=[".", "_"],
+        )
+
+    def read(self, where: dict = None, start: int = None, end: int = None, columns: list = None):
+        """
+        The read function loads the rows of the matching partitions and time window.
+        Partition filters prune whole directories, the time window is applied to the memory mapped columns.
+
+        :param where: dict: Partition column to a value or list of values, e.g. {"date": "2024-01-02"}
+        :param start: int: Only rows with datetime >= start (epoch seconds)
+        :param end: int: Only rows with datetime <= end (epoch seconds)
+        :param columns: list: The columns to load, defaults to all including the partition columns
+        :return: A dataframe, ticker-like dictionary columns come back as categoricals
+        """
+        expression = None
+        for name, value in (where or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            term = ds.field(name).isin([str(v) for v in values])
+            expression = term if expression is None else expression & term
+        if start is not None:
+            term = ds.field("datetime") >= start
+            expression = term if expression is None else expression & term
+        if end is not None:
+            term = ds.field("datetime") <= end
+            expression = term if expression is None else expression & term
+
+        with self.lock():
+            table = self.dataset().to_table(columns=columns, filter=expression)
+        return table.to_pandas()
+
+    def partition_dirs(self, where: dict = None):
+        """
+        The partition_dirs function lists the leaf partition directories, optionally only those matching where.
+        """
+        found = []
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories[:] = sorted(d for d in subdirectories if not d.startswith("."))
+            relative = os.path.relpath(directory, self.root)
+            if relative == "." or relative.count(os.sep) + 1 != len(self.partitions):
+                continue
+            values = dict(part.split("=", 1) for part in relative.split(os.sep))
+            if all(
+                values.get(name)
+                in [str(v) for v in (value if isinstance(value, (list, tuple, set)) else [value])]
+                for name, value in (where or {}).items()
+            ):
+                found.append(directory)
+        return found
+
+    def values(self, name: str):
+        """
+        The values function lists the distinct values of a partition column.
+        """
+        position = self.partitions.index(name)
+        return sorted(
+            {
+                os.path.relpath(directory, self.root).split(os.sep)[position].split("=", 1)[1]
+                for directory in self.partition_dirs()
+            }
+        )
+
+    def compact(self, where: dict = None, min_parts: int = COMPACT_MIN_PARTS):
+        """
+        The compact function merges the part files of each partition with at least min_parts of them into one.
+
+        :return: The number of partitions compacted
+        """
+        compacted = 0
+        with self.lock(exclusive=True):
+            for directory in self.partition_dirs(where):
+                parts = sorted(p for p in os.listdir(directory) if p.endswith(".arrow"))
+                if len(parts) < min_parts:
+                    continue
+                tables = []
+                for part in parts:
+                    with pa.memory_map(os.path.join(directory, part)) as source:
+                        tables.append(pa.ipc.open_file(source).read_all())
+                self.write_part(pa.concat_tables(tables), directory)
+                for part in parts:
+                    os.remove(os.path.join(directory, part))
+                compacted += 1
+        return compacted
+
+    def clear(self, where: dict = None):
+        """
+        The clear function deletes the matching partitions, or every partition if where is not given.
+
+        :return: The number of partitions deleted
+        """
+        with self.lock(exclusive=True):
+            directories = self.partition_dirs(where)
+            for directory in directories:
+                shutil.rmtree(directory)
+                # drop the parent partition directories left empty, the root keeps its lock file
+                try:
+                    os.removedirs(os.path.dirname(directory))
+                except OSError:
+                    pass
+        return len(directories)
+
+
+def headline_store(root: str = HEADLINES_DIR):
+    """
+    The headline_store function opens the headline store, partitioned by publication date and source.
+    """
+    return ColumnarStore(root, HEADLINE_SCHEMA, ["date", "source"])
+
+
+def trade_store(root: str = TRADES_DIR):
+    """
+    The trade_store function opens the trade store, partitioned by trading session (morning or afternoon) and date.
+    """
+    return ColumnarStore(root, TRADE_SCHEMA, ["session", "date"])
+
+
+def bar_store(root: str = BARS_DIR):
+    """
+    The bar_store function opens the historical price bar store, partitioned by New York date.
+    """
+    return ColumnarStore(root, BAR_SCHEMA, ["date"])
+
+
+def eastern_dates(epochs: pd.Series):
+    """
+    The eastern_dates function turns epoch seconds into the New York date partition values.
+    """
+    return epochs_to_eastern(epochs).dt.strftime("%Y-%m-%d")
@@ -1,28 +1,50 @@
 import os
 from datetime import datetime
 
-import alpaca_trade_api as tradeapi
 import pandas as pd
-import pandas_market_calendars as mcal
 from pytz import timezone
 
+from asset_index import list_tradable_assets, load_asset_index
+from columnar_store import HOLD_SIDE, trade_store
+from order_executor import OrderExecutor, summarize
+from position_sizer import POSITION_SIZING, size_positions
+from rebalancer import rebalance, save_report
+from trading_calendar import get_calendar
+
 
-TRADES_MORNING_FILE = "data/trades_morning.csv"
-TRADES_AFTERNOON_FILE = "data/trades_afternoon.csv"
 TRADES_TEST_FILE = "data/trades_morning_test.csv"
 BUYING_POWER = 1000.0
+# Daily returns the volatility allocation measures over
+VOLATILITY_DAYS = 20
+
+# Symbols per multi-symbol market data request, keeps the query string a sane length
+MAX_SYMBOLS_PER_REQUEST = 200
+# Last trades older than this are reported as stale
+STALE_PRICE_SECONDS = 15 * 60
+
+# Local copy of the Alpaca asset flags, loaded on first use
+ASSET_INDEX = None
+
+# Alpaca API connection, created on first use
+API = None
 
-# Set Alpaca API key and secret
-API_KEY = os.getenv("ALPACA_API_KEY")
-API_SECRET = os.getenv("ALPACA_SECRET_KEY")
 
-# Create an Alpaca API connection
-API = tradeapi.REST(
-    API_KEY,
-    API_SECRET,
-    base_url="https://paper-api.alpaca.markets",
-    api_version="v2",
-)
+def get_api():
+    """
+    The get_api function returns the shared Alpaca API connection, creating it on first use.
+    Credentials are read from ALPACA_API_KEY and ALPACA_SECRET_KEY, and APCA_API_BASE_URL can point it elsewhere.
+    """
+    global API
+    if API is None:
+        import alpaca_trade_api as tradeapi
+
+        API = tradeapi.REST(
+            os.getenv("ALPACA_API_KEY"),
+            os.getenv("ALPACA_SECRET_KEY"),
+            base_url=os.getenv("APCA_API_BASE_URL", "https://paper-api.alpaca.markets"),
+            api_version="v2",
+        )
+    return API
 
 
 # Orders on Alpaca: https://docs.alpaca.markets/docs/orders-at-alpaca
@@ -36,23 +58,8 @@ def is_weekend_or_holiday():
 
     :return: A boolean value - true if today is weekend or holiday
     """
-
-    # Calendar:'XNYS', or New York Stock Exchange
-    calendar_name = "XNYS"
-
-    # Get the market calendar
-    calendar = mcal.get_calendar(calendar_name)
-
-    # Get today's date
-    tz = timezone("America/New_York")
-    today = datetime.now(tz).date()
-
-    # Check if today is a weekend or a holiday
-    is_weekend = today.weekday() >= 5  # Saturday (5) or Sunday (6)
-    # Check if today is a holiday
-    valid_days = calendar.valid_days(start_date=today, end_date=today)
-    is_holiday = len(valid_days) == 0
-    return is_weekend or is_holiday
+    today = datetime.now(timezone("America/New_York")).date()
+    return not get_calendar().is_trading_day(today)
 
 
 def execute_trade(ticker: str, side: str, num_shares: float):
@@ -69,7 +76,7 @@ def execute_trade(ticker: str, side: str, num_shares: float):
     # Execute the trade
     try:
         # Submit the order
-        API.submit_order(
+        get_api().submit_order(
             symbol=ticker,
             qty=num_shares,
             side=side,
@@ -92,8 +99,7 @@ def get_last_trade_price(ticker: str):
 
     try:
         # Get the last trade information
-        last_trade = API.get_latest_trade(ticker)
-        API.get_asset(ticker).fractionable
+        last_trade = get_api().get_latest_trade(ticker)
 
         # Extract the last trade price
         last_trade_price = last_trade.price
@@ -105,6 +111,19 @@ def get_last_trade_price(ticker: str):
         return None
 
 
+def get_asset_index():
+    """
+    The get_asset_index function returns the local asset index, refreshing it from one
+    asset listing when it is older than ASSET_INDEX_MAX_AGE.
+
+    :return: An AssetIndex
+    """
+    global ASSET_INDEX
+    if ASSET_INDEX is None:
+        ASSET_INDEX = load_asset_index(lambda: list_tradable_assets(get_api()))
+    return ASSET_INDEX
+
+
 def fractionable(ticker: str):
     """
     The fractionable function takes a ticker symbol as an argument and returns whether or not the asset is fractionable.
@@ -114,148 +133,240 @@ def fractionable(ticker: str):
     :return: A boolean value, true or false
     """
 
-    # print(ticker, API.get_asset(ticker).fractionable)
-    try:
-        return API.get_asset(ticker).fractionable
-    except:
-        return None
+    asset = get_asset_index().get(ticker)
+    return asset["fractionable"] if asset else None
 
 
-def get_num_shares(trades_df: pd.DataFrame):
+def get_asset_metadata(tickers: list):
     """
-    The get_num_shares function takes in a trades_df and returns the same dataframe with an additional column, num_shares.
-    The num_shares column is calculated by first splitting the trades into buy and sell orders. The buying power per share is then calculated as BUYING_POWER / number of shares to be bought (len(trades)).
-    For each sell order, we check if it's last trade price is less than or equal to our buying power per share. If so, we add that stock to our list of stocks that can be sold for cash. We then update our total buying power by subtracting the sum
+    The get_asset_metadata function looks up the Alpaca asset flags of many tickers in the local asset index.
 
-    :param trades_df:Pass in a dataframe of trades
-    :return: A dataframe with the number of shares to buy or sell for each ticker
+    :param tickers: list: The tickers to look up
+    :return: A dataframe with columns ticker, tradable, fractionable, indexed like tickers; unknown tickers are NaN
     """
-    global BUYING_POWER
-
-    buying_power_per_share = BUYING_POWER / len(trades_df)
-
-    trades_df["fractionable"] = trades_df.ticker.apply(fractionable)
-    trades_df.dropna(axis=1, how="all")
+    index = get_asset_index()
+    assets = pd.DataFrame(
+        [
+            {
+                "ticker": ticker,
+                "tradable": asset["tradable"],
+                "fractionable": asset["fractionable"],
+            }
+            for ticker, asset in ((t, index.get(t)) for t in dict.fromkeys(tickers))
+            if asset is not None
+        ],
+        columns=["ticker", "tradable", "fractionable"],
+    )
+    return pd.DataFrame({"ticker": tickers}).merge(assets, on="ticker", how="left")
 
-    # split into buy and sell df
-    trades_df_non_fractionable = trades_df[
-        (trades_df.side == "sell") | (trades_df.fractionable == False)
-    ]
-    trades_df_fractionable = trades_df[
-        (trades_df.side == "buy") & (trades_df.fractionable)
-    ]
 
-    # get cost of a share and subset sell df to shares we can afford
+def get_latest_trades(tickers: list, now: pd.Timestamp = None):
+    """
+    The get_latest_trades function fetches the last trade of many tickers through the multi-symbol latest trades endpoint.
+    Each ticker's price age is reported, and prices older than STALE_PRICE_SECONDS are flagged as stale.
 
-    trades_df_non_fractionable["last_trade_price"] = (
-        trades_df_non_fractionable.ticker.apply(get_last_trade_price)
-    )
-    trades_df_non_fractionable = trades_df_non_fractionable[
-        trades_df_non_fractionable.last_trade_price <= buying_power_per_share
-    ]
-
-    # update buying power for fractionable orders
-    BUYING_POWER = BUYING_POWER - trades_df_non_fractionable.last_trade_price.sum()
-    buying_power_per_share = BUYING_POWER / (len(trades_df_fractionable))
-    print(
-        f"Buying power after sell orders: {BUYING_POWER:.2f}, ${buying_power_per_share:.2f} per share"
+    :param tickers: list: The tickers to look up
+    :param now: pd.Timestamp: The time to measure price age against, defaults to now
+    :return: A dataframe with columns ticker, last_trade_price, last_trade_time, price_age_seconds, stale
+    """
+    now = now if now is not None else pd.Timestamp.now(tz="UTC")
+    unique_tickers = list(dict.fromkeys(tickers))
+
+    rows = []
+    for start in range(0, len(unique_tickers), MAX_SYMBOLS_PER_REQUEST):
+        chunk = unique_tickers[start : start + MAX_SYMBOLS_PER_REQUEST]
+        try:
+            latest_trades = get_api().get_latest_trades(chunk)
+        except Exception as e:
+            print(f"Error getting latest trades for {', '.join(chunk)}: {str(e)}")
+            continue
+        for ticker, trade in latest_trades.items():
+            if trade is None:
+                continue
+            rows.append(
+                {
+                    "ticker": ticker,
+                    "last_trade_price": float(trade.price),
+                    "last_trade_time": pd.Timestamp(trade.timestamp),
+                }
+            )
+
+    latest = pd.DataFrame(
+        rows, columns=["ticker", "last_trade_price", "last_trade_time"]
     )
+    latest = pd.DataFrame({"ticker": tickers}).merge(latest, on="ticker", how="left")
+    latest["last_trade_time"] = pd.to_datetime(latest["last_trade_time"], utc=True)
+    latest["price_age_seconds"] = (now - latest["last_trade_time"]).dt.total_seconds()
+    latest["stale"] = ~(latest["price_age_seconds"] <= STALE_PRICE_SECONDS)
+
+    for row in latest[latest["stale"]].itertuples():
+        if pd.isna(row.price_age_seconds):
+            print(f"No last trade price for {row.ticker}")
+        else:
+            print(
+                f"Stale last trade price for {row.ticker}: {row.price_age_seconds:.0f} seconds old"
+            )
+    return latest
+
+
+def get_market_data(tickers: list):
+    """
+    The get_market_data function joins asset metadata and latest trades for a basket of tickers,
+    reading the metadata from the local asset index and making one request per MAX_SYMBOLS_PER_REQUEST tickers for prices.
 
-    # drop last trade price column
-    trades_df_non_fractionable = trades_df_non_fractionable.drop(
-        ["last_trade_price"], axis=1
+    :param tickers: list: The tickers to look up
+    :return: A dataframe with one row per ticker: metadata columns from get_asset_metadata and price columns from get_latest_trades
+    """
+    tickers = list(dict.fromkeys(tickers))
+    return get_asset_metadata(tickers).merge(
+        get_latest_trades(tickers), on="ticker", how="left"
     )
 
-    # set num_shares for all remaining non fractional orders to 1
-    trades_df_non_fractionable["num_shares"] = 1
 
-    # compute num shares for remaining orders
-    trades_df_fractionable["last_trade_price"] = trades_df_fractionable.ticker.apply(
-        get_last_trade_price
-    )
-    trades_df_fractionable["num_shares"] = trades_df_fractionable.apply(
-        lambda x: buying_power_per_share / x.last_trade_price, axis=1
-    )
-    trades_df_fractionable = trades_df_fractionable.drop(["last_trade_price"], axis=1)
+def get_daily_volatility(tickers: list, days: int = VOLATILITY_DAYS):
+    """
+    The get_daily_volatility function measures the standard deviation of daily returns of many tickers
+    from their daily bars, one request per MAX_SYMBOLS_PER_REQUEST tickers.
+
+    :param tickers: list: The tickers to look up
+    :param days: int: The number of daily returns to measure over
+    :return: A series of daily volatilities indexed by ticker, NaN for tickers without bars
+    """
+    start = (datetime.now(timezone("America/New_York")).date() - pd.Timedelta(days=2 * days)).isoformat()
+    unique_tickers = list(dict.fromkeys(tickers))
+    volatility = {}
+    for chunk_start in range(0, len(unique_tickers), MAX_SYMBOLS_PER_REQUEST):
+        chunk = unique_tickers[chunk_start : chunk_start + MAX_SYMBOLS_PER_REQUEST]
+        try:
+            bars = get_api().get_bars(chunk, "1Day", start=start).df
+        except Exception as e:
+            print(f"Error getting daily bars for {', '.join(chunk)}: {str(e)}")
+            continue
+        if bars.empty:
+            continue
+        returns = bars.groupby("symbol")["close"].pct_change()
+        volatility.update(returns.groupby(bars["symbol"]).apply(lambda r: r.tail(days).std()).to_dict())
+    return pd.Series(volatility, dtype=float).reindex(tickers)
+
+
+def get_num_shares(trades_df: pd.DataFrame, buying_power: float = BUYING_POWER, model: str = POSITION_SIZING):
+    """
+    The get_num_shares function takes in a trades_df and returns the same dataframe with an additional column, num_shares.
+    Prices and asset flags for the whole basket are fetched up front in bulk, then position_sizer.size_positions
+    gives sells and non-fractionable buys one share each and spreads the rest of the buying power over the
+    fractionable buys according to the allocation model.
 
-    return pd.concat(
-        [trades_df_non_fractionable, trades_df_fractionable], ignore_index=True
+    :param trades_df:Pass in a dataframe of trades
+    :param buying_power: float: The budget of the trades
+    :param model: str: The allocation model: equal, sentiment or volatility
+    :return: A dataframe with the number of shares to buy or sell for each ticker
+    """
+    market_df = get_market_data(trades_df["ticker"].tolist())
+    trades_df = trades_df.merge(
+        market_df[["ticker", "fractionable", "last_trade_price"]],
+        on="ticker",
+        how="left",
+    )
+    volatility = None
+    if model == "volatility":
+        volatility = get_daily_volatility(trades_df["ticker"].tolist()).to_numpy()
+
+    sized_df = size_positions(
+        trades_df.drop(columns="last_trade_price"),
+        trades_df["last_trade_price"].to_numpy(),
+        buying_power,
+        model,
+        volatility,
     )
+    print(f"Sized {len(sized_df)} of {len(trades_df)} trades with {model} allocation of ${buying_power:.2f}")
+    return sized_df
 
 
-def execute_trades_handler(trades_file: str):
+def execute_trades_handler(session: str, store=None, rebalance_positions: bool = False):
     """
-    The execute_trades_handler function takes in a trades_file, which is a csv file containing the following columns:
+    The execute_trades_handler function executes the trades of a session of the trade store, then clears the session.
+    Trades have the following columns:
         ticker - The stock symbol of the security to be traded.
-        side - The trading side to be used for this trade.  Currently supported strategies are 'buy' and 'sell'.
-    :param trades_file: Read the trades from the file and execute them
+        side - The trading side to be used for this trade.  Currently supported strategies are 'buy' and 'sell';
+            a 'hold' (HOLD_SIDE) cancels the ticker's earlier trades of the session.
+    :param session: str: The trading session to execute, morning or afternoon
+    :param store: ColumnarStore: The trade store, defaults to the one in TRADES_DIR
+    :param rebalance_positions: bool: Make the trades the only positions, trading only the difference to the current ones
+    :return: The execution report of order_executor.OrderExecutor, or the diff of rebalancer.rebalance
+        when rebalancing; None if there was nothing to execute
     """
-
-    trades_df = pd.read_csv(trades_file).drop_duplicates(
-        subset="ticker", keep="last"
+    store = store or trade_store()
+
+    trades_df = store.read({"session": session}, columns=["ticker", "side", "recommendation", "datetime"])
+    trades_df = (
+        trades_df.astype({"ticker": str, "side": str})
+        .sort_values("datetime", kind="stable")
+        .drop_duplicates(subset="ticker", keep="last")[["ticker", "side", "recommendation"]]
+        .reset_index(drop=True)
     )  # drop duplicate recommendations keeping latest
+    # a ticker whose latest recommendation is a hold is not traded
+    trades_df = trades_df[trades_df["side"] != HOLD_SIDE].reset_index(drop=True)
+    if trades_df.empty and not rebalance_positions:
+        print(f"No {session} trades to execute")
+        return
+
+    # without trades a rebalance closes every position
+    trades_df = get_num_shares(trades_df) if not trades_df.empty else trades_df.assign(num_shares=0.0)
+    day = datetime.now(timezone("America/New_York")).date().isoformat()
 
-    trades_df = get_num_shares(trades_df)
+    if rebalance_positions:
+        diff = rebalance(get_api(), trades_df, session, day)
+        print(f"Rebalance report: {save_report(diff, session, day)}")
+        store.clear({"session": session})
+        return diff
 
-    # execute trades
-    trades_df.apply(lambda x: execute_trade(x.ticker, x.side, x.num_shares), axis=1)
+    # execute trades concurrently, the client order ids make a re-run of the session skip placed orders
+    report = OrderExecutor(get_api()).execute(trades_df, session, day)
+    for row in report[report["order_id"].isna()].itertuples():
+        print(f"Error executing the {row.side} order for {row.ticker}: {row.error}")
+    print(summarize(report))
 
-    # clear out trades df
-    pd.DataFrame(
-        columns=[
-            "ticker",
-            "side",
-        ]
-    ).to_csv(trades_file, index=False)
+    # clear out executed trades
+    store.clear({"session": session})
+    return report
 
 
 def execute_trades():
     """
     The execute_trades function is responsible for executing trades based on the
-    trades file that is passed in. The function will read in the trades file, and then
-    execute each trade by calling the execute_trade function. After all of the trades have been executed,
+    trade store session of the current window. The function will read in the session's trades, and then
+    submit them concurrently through the order executor. After all of the trades have been executed,
     the positions will be updated to reflect any changes made during execution.
     """
 
     tz = timezone("America/New_York")
-    current_time = datetime.now(tz).time()
+    now = datetime.now(tz)
 
-    print(current_time.strftime("%H:%M:%S"))
+    print(now.strftime("%H:%M:%S"))
 
     if is_weekend_or_holiday():
         raise Exception("Cannot trade on weekend or holiday")
 
-    # if current execution time is in window #1, read in morning trades file
-    if (current_time >= datetime.strptime("11:10:00", "%H:%M:%S").time()) & (
-        current_time <= datetime.strptime("11:40:00", "%H:%M:%S").time()
-    ):
-        print("time window 1")
-        execute_trades_handler(TRADES_MORNING_FILE)
+    # the execution windows come from the trading calendar, the afternoon one ends at the close
+    window = get_calendar().current_window(now)
 
-        # Clear out finnhub headlines
-        pd.DataFrame(columns=["ticker", "company", "headline", "datetime"]).to_csv(
-            "data/finnhub_headlines.csv", index=False
-        )
+    # if current execution time is in window #1, execute the morning trades
+    if window == "morning":
+        print("time window 1")
+        execute_trades_handler("morning")
 
-    # if current execution time is in window #2, read in afternoon trades file
-    elif (current_time >= datetime.strptime("15:40:00", "%H:%M:%S").time()) & (
-        current_time <= datetime.strptime("16:00:00", "%H:%M:%S").time()
-    ):
+    # if current execution time is in window #2, execute the afternoon trades
+    elif window == "afternoon":
         print("time window 2")
 
-        # Close all open positions
-        API.close_all_positions()
-
-        # Execute afternoon trades
-        execute_trades_handler(TRADES_AFTERNOON_FILE)
-
-        # Clear out finnhub headlines
-        pd.DataFrame(columns=["ticker", "company", "headline", "datetime"]).to_csv(
-            "data/finnhub_headlines.csv", index=False
-        )
+        # Trade from the open positions to the afternoon trades, only sending the difference per ticker
+        execute_trades_handler("afternoon", rebalance_positions=True)
 
     else:
-        raise Exception("Execution time not in morning or afternoon window")
+        name, start, end = get_calendar().next_window(now)
+        raise Exception(
+            f"Execution time not in morning or afternoon window, next is the {name} window at {start:%Y-%m-%d %H:%M}"
+        )
 
 
 if __name__ == "__main__":
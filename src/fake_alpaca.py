@@ -0,0 +1,389 @@
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the Alpaca trading and market data REST APIs.
+# Point alpaca_trade_api at it with APCA_API_BASE_URL and APCA_API_DATA_URL set to server.base_url,
+# or run python src/fake_alpaca.py to size the test trades file against it and to compare serial and
+# concurrent order submission.
+
+
+def isoformat(timestamp: datetime):
+    return timestamp.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakeAlpacaHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        state = self.server.state
+        self.server.record("GET", url.path)
+
+        if url.path == "/v2/assets":
+            self.send_json(200, list(state["assets"].values()))
+        elif url.path.startswith("/v2/assets/"):
+            symbol = url.path.rsplit("/", 1)[-1]
+            if symbol in state["assets"]:
+                self.send_json(200, state["assets"][symbol])
+            else:
+                self.send_json(404, {"code": 40410000, "message": "asset not found"})
+        elif url.path == "/v2/stocks/trades/latest":
+            symbols = query.get("symbols", [""])[0].split(",")
+            trades = {
+                symbol: self.server.trade(symbol)
+                for symbol in symbols
+                if symbol in state["prices"]
+            }
+            self.send_json(200, {"trades": trades})
+        elif url.path == "/v2/orders:by_client_order_id":
+            order = self.server.find_order(query.get("client_order_id", [""])[0])
+            if order:
+                self.send_json(200, self.server.order_view(order))
+            else:
+                self.send_json(404, {"code": 40410000, "message": "order not found"})
+        elif url.path == "/v2/orders":
+            after = query.get("after", [None])[0]
+            with self.server.lock:
+                orders = list(state["orders"].values())
+            if after:
+                after = datetime.fromisoformat(after.replace("Z", "+00:00"))
+                orders = [order for order in orders if order["submitted"] >= after.timestamp()]
+            limit = int(query.get("limit", ["50"])[0])
+            self.send_json(200, [self.server.order_view(order) for order in orders[:limit]])
+        elif url.path.startswith("/v2/orders/"):
+            order = state["orders"].get(url.path.rsplit("/", 1)[-1])
+            if order:
+                self.send_json(200, self.server.order_view(order))
+            else:
+                self.send_json(404, {"code": 40410000, "message": "order not found"})
+        elif url.path == "/v2/stocks/bars":
+            symbols = query.get("symbols", [""])[0].split(",")
+            bars = {
+                symbol: self.server.daily_bars(symbol)
+                for symbol in symbols
+                if symbol in state["prices"]
+            }
+            self.send_json(200, {"bars": bars, "next_page_token": None})
+        elif url.path == "/v2/positions":
+            with self.server.lock:
+                positions = dict(state["positions"])
+            self.send_json(200, [self.server.position_view(s, q) for s, q in positions.items()])
+        elif url.path.startswith("/v2/stocks/") and url.path.endswith("/trades/latest"):
+            symbol = url.path.split("/")[3]
+            if symbol in state["prices"]:
+                self.send_json(200, {"symbol": symbol, "trade": self.server.trade(symbol)})
+            else:
+                self.send_json(404, {"code": 40410000, "message": "no trade found"})
+        else:
+            self.send_json(404, {"code": 40410000, "message": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.server.record("POST", url.path)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        if url.path == "/v2/orders":
+            status, payload = self.server.place_order(body)
+            self.send_json(status, payload)
+        else:
+            self.send_json(404, {"code": 40410000, "message": "not found"})
+
+    def do_DELETE(self):
+        url = urlparse(self.path)
+        self.server.record("DELETE", url.path)
+
+        if url.path == "/v2/positions":
+            self.send_json(207, self.server.close_all_positions())
+        else:
+            self.send_json(404, {"code": 40410000, "message": "not found"})
+
+    def send_json(self, status: int, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeAlpacaServer(ThreadingHTTPServer):
+    """
+    The FakeAlpacaServer class keeps assets, prices, orders and positions in memory and counts the requests it gets per path.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        assets: dict,
+        prices: dict,
+        order_latency: float = 0.0,
+        fill_delay: float = 0.0,
+        faults: list = None,
+        positions: dict = None,
+    ):
+        super().__init__(("127.0.0.1", port), FakeAlpacaHandler)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.order_latency = order_latency
+        self.fill_delay = fill_delay
+        # consumed one per order submission: an HTTP status to answer with, or "lost_ack" to place
+        # the order and answer 500 anyway
+        self.faults = list(faults or [])
+        self.state = {
+            "assets": {
+                symbol: {
+                    "id": f"asset-{symbol}",
+                    "class": "us_equity",
+                    "exchange": "NASDAQ",
+                    "symbol": symbol,
+                    "status": "active",
+                    "tradable": True,
+                    "marginable": True,
+                    "shortable": True,
+                    "easy_to_borrow": True,
+                    "fractionable": True,
+                    **flags,
+                }
+                for symbol, flags in assets.items()
+            },
+            "prices": dict(prices),
+            "orders": {},
+            # symbol to signed quantity, negative for shorts
+            "positions": {symbol: float(qty) for symbol, qty in (positions or {}).items()},
+        }
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def record(self, method: str, path: str):
+        with self.lock:
+            key = f"{method} {path}"
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def trade(self, symbol: str):
+        """
+        The trade function returns the latest trade of a symbol in Alpaca's v2 format.
+        Prices are (price, age in seconds) tuples or plain prices traded just now.
+        """
+        price = self.state["prices"][symbol]
+        price, age = price if isinstance(price, tuple) else (price, 0)
+        timestamp = datetime.now(timezone.utc) - timedelta(seconds=age)
+        return {"t": isoformat(timestamp), "x": "V", "p": price, "s": 100, "c": ["@"], "i": 1, "z": "C"}
+
+
+    def place_order(self, body: dict):
+        """
+        The place_order function validates and records a market order the way Alpaca does.
+
+        :param body: dict: The order request
+        :return: A tuple of HTTP status and response payload
+        """
+        time.sleep(self.order_latency)
+        with self.lock:
+            fault = self.faults.pop(0) if self.faults else None
+            if isinstance(fault, int):
+                return fault, {"code": fault * 100000, "message": "injected fault"}
+            symbol = body.get("symbol")
+            asset = self.state["assets"].get(symbol)
+            if asset is None:
+                return 422, {"code": 40010001, "message": f'asset "{symbol}" not found'}
+            qty = float(body.get("qty") or 0)
+            if qty <= 0:
+                return 422, {"code": 40010001, "message": "qty must be > 0"}
+            if qty != int(qty) and not asset["fractionable"]:
+                return 422, {"code": 40310000, "message": "fractional orders are not supported for this asset"}
+            client_order_id = body.get("client_order_id") or uuid.uuid4().hex
+            if self.find_order(client_order_id):
+                return 422, {"code": 40010001, "message": "client_order_id must be unique"}
+            order = {
+                "id": str(uuid.uuid4()),
+                "client_order_id": client_order_id,
+                "symbol": symbol,
+                "qty": body.get("qty"),
+                "side": body.get("side"),
+                "type": body.get("type"),
+                "time_in_force": body.get("time_in_force"),
+                "submitted": time.time(),
+            }
+            self.state["orders"][order["id"]] = order
+            if symbol in self.state["prices"]:
+                signed = qty if order["side"] == "buy" else -qty
+                position = round(self.state["positions"].get(symbol, 0.0) + signed, 9)
+                if position:
+                    self.state["positions"][symbol] = position
+                else:
+                    self.state["positions"].pop(symbol, None)
+        if fault == "lost_ack":
+            return 500, {"code": 50000000, "message": "internal server error"}
+        return 200, self.order_view(order)
+
+    def daily_bars(self, symbol: str, days: int = 30):
+        """
+        The daily_bars function returns a month of daily bars in Alpaca's v2 format, a random walk ending at
+        the last trade price. Each symbol gets its own daily volatility between 1% and 4%.
+        """
+        price = self.state["prices"][symbol]
+        price = price[0] if isinstance(price, tuple) else price
+        rng = random.Random(zlib.crc32(symbol.encode()))
+        volatility = rng.uniform(0.01, 0.04)
+        closes = [price]
+        for _ in range(days - 1):
+            closes.append(closes[-1] / (1 + rng.gauss(0, volatility)))
+        today = datetime.now(timezone.utc).replace(hour=5, minute=0, second=0, microsecond=0)
+        return [
+            {
+                "t": isoformat(today - timedelta(days=days - i)),
+                "o": close,
+                "h": close,
+                "l": close,
+                "c": close,
+                "v": 1000,
+                "n": 10,
+                "vw": close,
+            }
+            for i, close in enumerate(reversed(closes))
+        ]
+
+    def close_all_positions(self):
+        """
+        The close_all_positions function places one market order per open position, the way DELETE /v2/positions does.
+        """
+        with self.lock:
+            positions = dict(self.state["positions"])
+        closed = []
+        for symbol, qty in positions.items():
+            side = "sell" if qty > 0 else "buy"
+            status, order = self.place_order(
+                {"symbol": symbol, "qty": str(abs(qty)), "side": side, "type": "market", "time_in_force": "day"}
+            )
+            closed.append({"symbol": symbol, "status": status, "body": order})
+        return closed
+
+    def position_view(self, symbol: str, qty: float):
+        price = self.state["prices"].get(symbol, 0.0)
+        price = price[0] if isinstance(price, tuple) else price
+        return {
+            "asset_id": f"asset-{symbol}",
+            "symbol": symbol,
+            "exchange": "NASDAQ",
+            "asset_class": "us_equity",
+            "qty": str(qty),
+            "side": "long" if qty > 0 else "short",
+            "market_value": str(qty * price),
+            "current_price": str(price),
+        }
+
+    def find_order(self, client_order_id: str):
+        return next(
+            (order for order in self.state["orders"].values() if order["client_order_id"] == client_order_id),
+            None,
+        )
+
+    def order_view(self, order: dict):
+        """
+        The order_view function returns an order in Alpaca's v2 format. Orders of symbols with a price fill
+        completely fill_delay seconds after submission, at the last trade price.
+        """
+        submitted = datetime.fromtimestamp(order["submitted"], timezone.utc)
+        price = self.state["prices"].get(order["symbol"])
+        filled = price is not None and time.time() >= order["submitted"] + self.fill_delay
+        return {
+            "id": order["id"],
+            "client_order_id": order["client_order_id"],
+            "symbol": order["symbol"],
+            "asset_class": "us_equity",
+            "qty": str(order["qty"]),
+            "side": order["side"],
+            "type": order["type"],
+            "time_in_force": order["time_in_force"],
+            "created_at": isoformat(submitted),
+            "submitted_at": isoformat(submitted),
+            "status": "filled" if filled else "new",
+            "filled_qty": str(order["qty"]) if filled else "0",
+            "filled_avg_price": str(price[0] if isinstance(price, tuple) else price) if filled else None,
+            "filled_at": isoformat(submitted + timedelta(seconds=self.fill_delay)) if filled else None,
+        }
+
+
+def start_fake_alpaca(assets: dict, prices: dict, port: int = 0, **options):
+    """
+    The start_fake_alpaca function starts a fake Alpaca server on a background thread.
+
+    :param assets: dict: Symbol to a dict of asset flags overriding the defaults, e.g. {"EAR": {"fractionable": False}}
+    :param prices: dict: Symbol to last trade price, or to a (price, age in seconds) tuple
+    :param port: int: The port to listen on, 0 picks a free one
+    :param options: order_latency, fill_delay, faults and positions, see FakeAlpacaServer
+    :return: The server
+    """
+    server = FakeAlpacaServer(port, assets, prices, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    import pandas as pd
+
+    trades_df = pd.read_csv("data/trades_morning_test.csv")
+    server = start_fake_alpaca(
+        assets={
+            ticker: {"fractionable": i % 2 == 0}
+            for i, ticker in enumerate(trades_df["ticker"])
+        },
+        prices={
+            ticker: (10.0 + i, 3600 if i == 0 else 5)
+            for i, ticker in enumerate(trades_df["ticker"])
+        },
+    )
+    os.environ["APCA_API_BASE_URL"] = server.base_url
+    os.environ["APCA_API_DATA_URL"] = server.base_url
+    os.environ.setdefault("ALPACA_API_KEY", "fake")
+    os.environ.setdefault("ALPACA_SECRET_KEY", "fake")
+    # keep the fake assets out of the real index
+    os.environ["ASSET_INDEX_FILE"] = os.path.join(tempfile.mkdtemp(), "asset_index.sqlite")
+
+    from execute_trades import get_api, get_num_shares
+    from order_executor import OrderExecutor, summarize
+
+    sized_df = get_num_shares(trades_df)
+    print(sized_df)
+    print("Requests:", server.requests)
+
+    # a basket of 60 orders, each taking 50 ms to acknowledge, with one lost acknowledgement
+    basket = pd.DataFrame(
+        {
+            "ticker": [f"T{i:03d}" for i in range(60)],
+            "side": ["buy", "sell"] * 30,
+            "num_shares": [1.0] * 60,
+        }
+    )
+    server = start_fake_alpaca(
+        assets={ticker: {} for ticker in basket["ticker"]},
+        prices={ticker: 20.0 for ticker in basket["ticker"]},
+        order_latency=0.05,
+        fill_delay=0.2,
+        faults=["lost_ack"],
+    )
+    os.environ["APCA_API_BASE_URL"] = server.base_url
+    import execute_trades
+
+    execute_trades.API = None
+    api = get_api()
+    for name, workers, day in [("serial", 1, "2024-01-02"), ("concurrent", 8, "2024-01-03")]:
+        report = OrderExecutor(api, rate=1000, max_workers=workers, poll_seconds=0.1).execute(
+            basket, "morning", day
+        )
+        print(f"{name}: {summarize(report)}")
+
+    # running the same session again finds every order already placed
+    report = OrderExecutor(api, rate=1000, poll_seconds=0.1).execute(basket, "morning", "2024-01-03")
+    print(f"re-run: {summarize(report)}, {len(server.state['orders'])} orders at the broker")
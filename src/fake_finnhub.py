@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+from finnhub_headlines import KeyPool, fetch_all_headlines
+
+# Local stand-in for the Finnhub API, used to check the fetcher's throughput and
+# key fairness offline: python src/fake_finnhub.py
+
+
+class FakeFinnhubAPIException(Exception):
+    """
+    The FakeFinnhubAPIException class mirrors finnhub.FinnhubAPIException's status_code attribute.
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def __str__(self):
+        return "FinnhubAPIException(status_code: {}): {}".format(
+            self.status_code, self.args[0]
+        )
+
+
+class FakeFinnhubServer:
+    """
+    The FakeFinnhubServer class enforces a per-key limit over a sliding one-second window,
+    answers over-limit calls with a 429 and records every call it serves.
+    """
+
+    def __init__(self, calls_per_second: float = 30, latency: float = 0.02):
+        """
+        :param calls_per_second: float: Calls allowed per key per second
+        :param latency: float: Seconds each call takes
+        """
+        self.calls_per_second = calls_per_second
+        self.latency = latency
+        self.windows = {}
+        self.served = {}
+        self.rejected = {}
+        self.lock = threading.Lock()
+
+    def company_news(self, api_key: str, symbol: str):
+        time.sleep(self.latency)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.setdefault(api_key, deque())
+            while window and now - window[0] >= 1.0:
+                window.popleft()
+            if len(window) >= self.calls_per_second:
+                self.rejected[api_key] = self.rejected.get(api_key, 0) + 1
+                raise FakeFinnhubAPIException(429, "API limit reached")
+            window.append(now)
+            self.served[api_key] = self.served.get(api_key, 0) + 1
+        return [
+            {
+                "headline": f"{symbol} headline {i}",
+                "datetime": int(time.time()),
+            }
+            for i in range(2)
+        ]
+
+
+class FakeFinnhubClient:
+    """
+    The FakeFinnhubClient class has the same company_news signature as finnhub.Client.
+    """
+
+    def __init__(self, api_key: str, server: FakeFinnhubServer):
+        self.api_key = api_key
+        self.server = server
+
+    def company_news(self, symbol: str, _from=None, to=None):
+        return self.server.company_news(self.api_key, symbol)
+
+
+if __name__ == "__main__":
+    server = FakeFinnhubServer(calls_per_second=30, latency=0.02)
+    clients = [FakeFinnhubClient(f"key_{i}", server) for i in range(4)]
+    pool = KeyPool(clients, rate=30, capacity=30)
+
+    tickers = pd.read_csv("data/stocks_info_3.csv")["ticker"].tolist()
+
+    start_time = time.time()
+    results = fetch_all_headlines(tickers, pool, max_workers=16)
+    elapsed_time = time.time() - start_time
+
+    print(f"{len(tickers)} tickers in {elapsed_time:.1f} seconds")
+    print(f"{len(tickers) / elapsed_time:.1f} tickers per second")
+    print("Served per key:", server.served)
+    print("Rejected per key:", server.rejected)
+    print("Empty results:", sum(1 for result in results if not result))
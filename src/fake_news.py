@@ -0,0 +1,158 @@
+import datetime
+import hashlib
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Google News topic pages, serving generated HTML fixtures.
+# Run python src/fake_news.py to time scrape_all_headlines against it.
+
+COMPANIES = ["Apple", "Microsoft", "Nvidia", "Tesla", "Amazon", "Alcoa", "Agilent", "Boeing"]
+EVENTS = [
+    "beats earnings estimates",
+    "misses revenue forecast",
+    "announces share buyback",
+    "faces antitrust lawsuit",
+    "to present at investor conference",
+    "raises full-year guidance",
+]
+
+
+def fixture_page(n_headlines: int, seed: int = 0, shared: int = 0):
+    """
+    The fixture_page function builds an HTML page laid out like a Google News topic page:
+    each headline is an element with class gPFEn followed by a <time class="hvbAAd" datetime=...> element.
+
+    :param n_headlines: int: Number of headlines on the page
+    :param seed: int: Seed for the generated headlines, pages with different seeds have different headlines
+    :param shared: int: Number of leading headlines that are the same on every page regardless of seed
+    :return: The page as bytes
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 2, 12, 0, 0)
+    articles = []
+    for i in range(n_headlines):
+        if i < shared:
+            headline = f"{COMPANIES[i % len(COMPANIES)]} {EVENTS[i % len(EVENTS)]} (story {i})"
+        else:
+            headline = f"{rng.choice(COMPANIES)} {rng.choice(EVENTS)} (story {seed}-{i})"
+        published = start + datetime.timedelta(minutes=7 * i)
+        articles.append(
+            '<article class="IBr9hb"><div class="m5k28"><div class="XlKvRb">'
+            f'<a class="WwrzSb" href="./articles/{seed}-{i}"></a></div>'
+            f'<div class="B6pJDd"><a class="gPFEn" href="./articles/{seed}-{i}">{headline}</a></div>'
+            '<div class="UOVeFe"><span class="vr1PYe">Source</span>'
+            f'<time class="hvbAAd" datetime="{published:%Y-%m-%dT%H:%M:%SZ}">{i} hours ago</time>'
+            "</div></div></article>"
+        )
+    return (
+        "<!DOCTYPE html><html><head><title>Topic</title></head><body><main><c-wiz>"
+        + "".join(articles)
+        + "</c-wiz></main></body></html>"
+    ).encode()
+
+
+class FakeNewsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+        page = server.pages.get(self.path)
+        time.sleep(server.latency)
+        if page is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = '"%s"' % hashlib.sha1(page).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+
+def start_fake_news(pages: dict, latency: float = 0.0, port: int = 0):
+    """
+    The start_fake_news function serves HTML pages on a background thread.
+
+    :param pages: dict: Path (e.g. "/business") to page content
+    :param latency: float: Seconds before each response
+    :param port: int: The port to listen on, 0 picks a free one
+    :return: The server; the url of a path is server.base_url + path
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeNewsHandler)
+    server.pages = pages
+    server.latency = latency
+    server.requests = []
+    server.lock = threading.Lock()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fixture_site(server, path: str, name: str = None):
+    """
+    The fixture_site function builds a SITES entry pointing at a page of the fake server.
+    """
+    return {
+        "name": name or f"Fake News {path}",
+        "url": server.base_url + path,
+        "headline_attrs": {"class": "gPFEn"},
+        "description_attrs": None,
+        "date_attrs": {"class": "hvbAAd"},
+    }
+
+
+if __name__ == "__main__":
+    from headline_scraper import (
+        ScraperState,
+        parse_headlines_bs4,
+        parse_headlines_lxml,
+        scrape_all_headlines,
+    )
+
+    paths = [f"/topic/{i}" for i in range(4)]
+    server = start_fake_news(
+        {path: fixture_page(150, seed=i, shared=20) for i, path in enumerate(paths)},
+        latency=0.5,
+    )
+    sites = [fixture_site(server, path) for path in paths]
+
+    start_time = time.time()
+    headlines = scrape_all_headlines(sites)
+    elapsed_time = time.time() - start_time
+
+    print(f"{len(sites)} sites with 0.5 seconds latency each in {elapsed_time:.2f} seconds")
+    print(f"{len(headlines)} unique headlines from {4 * 150} scraped")
+    print(headlines.head())
+
+    # scrape with state: the first run fills it, then nothing changed, then one page changed
+    state = ScraperState(tempfile.mktemp(suffix=".json"))
+    scrape_all_headlines(sites, state)
+    state.unchanged = []
+    print(f"unchanged pages: {len(scrape_all_headlines(sites, state))} new headlines, {state.unchanged} unchanged")
+    server.pages[paths[0]] = fixture_page(160, seed=0, shared=20)
+    state.unchanged = []
+    print(f"one page grew: {len(scrape_all_headlines(sites, state))} new headlines, {len(state.unchanged)} unchanged")
+
+    # compare the speed of the parser engines, tests/test_parsers.py checks that they agree
+    site = sites[0]
+    page = fixture_page(400)
+    for name, parse in [("bs4", parse_headlines_bs4), ("lxml", parse_headlines_lxml)]:
+        runs = 0
+        start_time = time.time()
+        while time.time() - start_time < 2.0:
+            parse(page, site)
+            runs += 1
+        print(f"{name}: {runs / (time.time() - start_time):.1f} pages/sec (400 headlines per page)")
@@ -0,0 +1,129 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions endpoint.
+# Start it and point llm_call at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1:
+# python src/fake_openai.py 8765
+
+POSITIVE_WORDS = ["beat", "beats", "surge", "soar", "record", "upgrade", "raise", "gain"]
+NEGATIVE_WORDS = ["miss", "misses", "plunge", "fall", "cut", "downgrade", "lawsuit", "loss"]
+
+
+def fake_answer(headline: str):
+    """
+    The fake_answer function gives a deterministic YES/NO/UNKNOWN answer from a few keywords.
+
+    :param headline: str: The headline to answer for
+    :return: YES, NO or UNKNOWN
+    """
+    words = headline.lower().split()
+    if any(word in words for word in POSITIVE_WORDS):
+        return "YES"
+    if any(word in words for word in NEGATIVE_WORDS):
+        return "NO"
+    return "UNKNOWN"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+
+        with server.lock:
+            server.requests.append(body)
+            rate_limited = server.rate_limit_every and (
+                len(server.requests) % server.rate_limit_every == 0
+            )
+        if rate_limited:
+            self.send_json(429, {"error": {"message": "Rate limit reached"}})
+            return
+
+        time.sleep(server.latency)
+        prompt = body["messages"][-1]["content"]
+
+        if body.get("response_format", {}).get("type") == "json_object":
+            # batch prompt: the items are a JSON list on the last line
+            items = json.loads(prompt.rsplit("\n", 1)[-1])
+            answers = [
+                {"id": item["id"], "answer": fake_answer(item["headline"])}
+                for item in items
+                if random.random() >= server.drop_rate
+            ]
+            content = json.dumps({"answers": answers})
+        else:
+            content = fake_answer(prompt.rsplit("Headline:", 1)[-1])
+            if body.get("max_tokens"):
+                # about three characters per token: UNKNOWN is cut to UNK
+                content = content[: 3 * body["max_tokens"]]
+
+        prompt_tokens = sum(len(m["content"].split()) for m in body["messages"])
+        completion_tokens = len(content.split())
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-fake-{len(server.requests)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_fake_openai(
+    port: int = 0,
+    latency: float = 0.05,
+    drop_rate: float = 0.0,
+    rate_limit_every: int = 0,
+):
+    """
+    The start_fake_openai function starts a fake chat completions server on a background thread.
+
+    :param port: int: The port to listen on, 0 picks a free one
+    :param latency: float: Seconds each completion takes
+    :param drop_rate: float: Fraction of batch items left out of the answer
+    :param rate_limit_every: int: Answer every n-th request with a 429, 0 never does
+    :return: The server; its base url is server.base_url and the requests it saw are in server.requests
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.latency = latency
+    server.drop_rate = drop_rate
+    server.rate_limit_every = rate_limit_every
+    server.requests = []
+    server.lock = threading.Lock()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import sys
+
+    server = start_fake_openai(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f"fake OpenAI listening on {server.base_url}")
+    threading.Event().wait()
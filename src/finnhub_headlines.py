@@ -1,92 +1,204 @@
 import os
-import finnhub
+import random
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+import finnhub
 import pandas as pd
 
 import datetime as dt
 
-FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
-FINNHUB_API_KEY_2 = os.getenv("FINNHUB_API_KEY_2")
-FINNHUB_API_KEY_3 = os.getenv("FINNHUB_API_KEY_3")
-FINNHUB_API_KEY_4 = os.getenv("FINNHUB_API_KEY_4")
+from columnar_store import eastern_dates, headline_store
+from rate_limit import TokenBucket
 
+# Finnhub free tier allows 60 calls per minute per key
+FINNHUB_CALLS_PER_SECOND = 1.0
+FINNHUB_BURST = 30
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+# Days of headlines kept in the headline store
+HEADLINE_RETENTION_DAYS = 7
 
-# Initialize the Finnhub clients with your API key
-finnhub_client = finnhub.Client(api_key=FINNHUB_API_KEY)
-finnhub_client_2 = finnhub.Client(api_key=FINNHUB_API_KEY_2)
-finnhub_client_3 = finnhub.Client(api_key=FINNHUB_API_KEY_3)
-finnhub_client_4 = finnhub.Client(api_key=FINNHUB_API_KEY_4)
-
-today = dt.datetime.today().date()
 COUNTER = 0
+COUNTER_LOCK = threading.Lock()
+
+
+def get_api_keys(environ=os.environ):
+    """
+    The get_api_keys function collects every Finnhub API key set in the environment:
+    FINNHUB_API_KEY followed by FINNHUB_API_KEY_2, FINNHUB_API_KEY_3, ... in numeric order.
+
+    :param environ: The environment to read the keys from
+    :return: A list of API keys
+    """
+    numbered = []
+    for name, value in environ.items():
+        match = re.fullmatch(r"FINNHUB_API_KEY_(\d+)", name)
+        if match and value:
+            numbered.append((int(match.group(1)), value))
+    keys = [value for _, value in sorted(numbered)]
+    if environ.get("FINNHUB_API_KEY"):
+        keys.insert(0, environ["FINNHUB_API_KEY"])
+    return keys
+
+
+class KeyPool:
+    """
+    The KeyPool class spreads requests across several Finnhub clients, one token bucket per API key.
+    Keys are tried round robin so the load stays even, and a key that gets rate limited is drained
+    so the other keys pick up its share until it recovers.
+    """
+
+    def __init__(
+        self,
+        clients: list,
+        rate: float = FINNHUB_CALLS_PER_SECOND,
+        capacity: float = FINNHUB_BURST,
+    ):
+        """
+        :param clients: list: Objects with a finnhub.Client compatible company_news method
+        :param rate: float: Calls per second allowed for each key
+        :param capacity: float: Burst size allowed for each key
+        """
+        if not clients:
+            raise ValueError("No Finnhub API keys configured")
+        self.clients = clients
+        self.buckets = [TokenBucket(rate, capacity) for _ in clients]
+        self.calls = [0] * len(clients)
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        The acquire function blocks until one of the keys has a token and returns its index.
+
+        :return: The index of the client to use
+        """
+        while True:
+            with self.lock:
+                start = self.next_index
+                for offset in range(len(self.buckets)):
+                    index = (start + offset) % len(self.buckets)
+                    if self.buckets[index].try_acquire():
+                        self.next_index = (index + 1) % len(self.buckets)
+                        self.calls[index] += 1
+                        return index
+            time.sleep(min(bucket.wait_time() for bucket in self.buckets))
+
+    def penalize(self, index: int, seconds: float):
+        """
+        The penalize function stops handing out a key for `seconds` after it was rate limited.
+
+        :param index: int: The index of the rate limited client
+        :param seconds: float: How long to back off
+        """
+        self.buckets[index].drain(seconds)
+
+
+def backoff_seconds(attempt: int):
+    """
+    The backoff_seconds function returns an exponential backoff with jitter for a retry attempt.
+
+    :param attempt: int: The number of attempts made so far
+    :return: Seconds to wait
+    """
+    return min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt) * random.uniform(0.5, 1.0)
 
 
-def get_headlines(ticker):
+def get_headlines(ticker: str, pool: KeyPool):
+    """
+    The get_headlines function fetches today's headlines for a ticker from Finnhub.
+    Rate-limit (429) responses back off the key that got them while other keys keep going,
+    other errors back off the request itself. After MAX_RETRIES failures the ticker is skipped.
+
+    :param ticker: str: The ticker to fetch news for
+    :param pool: KeyPool: The clients to fetch with
+    :return: A list of (headline, datetime) tuples
+    """
     global COUNTER
-    try:
-        # Fetch news headlines for the ticker from Finnhub API
-        news = finnhub_client.company_news(symbol=ticker, _from=today, to=today)
-        # Extract headlines from the response
-        headlines = [(article["headline"], article["datetime"]) for article in news]
-        COUNTER += 1
-        print(COUNTER)
-        return headlines
-    except:
+    today = dt.datetime.today().date()
+    for attempt in range(MAX_RETRIES + 1):
+        index = pool.acquire()
         try:
             # Fetch news headlines for the ticker from Finnhub API
-            news = finnhub_client_2.company_news(symbol=ticker, _from=today, to=today)
-            # Extract headlines from the response
-            headlines = [(article["headline"], article["datetime"]) for article in news]
+            news = pool.clients[index].company_news(symbol=ticker, _from=today, to=today)
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                pool.penalize(index, backoff_seconds(attempt))
+            else:
+                time.sleep(backoff_seconds(attempt))
+            last_error = e
+            continue
+
+        # Extract headlines from the response
+        headlines = [(article["headline"], article["datetime"]) for article in news]
+        with COUNTER_LOCK:
             COUNTER += 1
             print(COUNTER)
-            return headlines
-        except:
-            try:
-                # Fetch news headlines for the ticker from Finnhub API
-                news = finnhub_client_3.company_news(
-                    symbol=ticker, _from=today, to=today
-                )
-                # Extract headlines from the response
-                headlines = [
-                    (article["headline"], article["datetime"]) for article in news
-                ]
-                COUNTER += 1
-                print(COUNTER)
-                return headlines
-            except:
-                try:
-                    # Fetch news headlines for the ticker from Finnhub API
-                    news = finnhub_client_4.company_news(
-                        symbol=ticker, _from=today, to=today
-                    )
-                    # Extract headlines from the response
-                    headlines = [
-                        (article["headline"], article["datetime"]) for article in news
-                    ]
-                    COUNTER += 1
-                    print(COUNTER)
-                    return headlines
-                except:
-                    time.sleep(5)
-                    get_headlines(ticker)
+        return headlines
 
+    print(f"Error fetching headlines for {ticker}: {str(last_error)}")
+    return []
 
-if __name__ == "__main__":
+
+def fetch_all_headlines(
+    tickers: list, pool: KeyPool, max_workers: int = MAX_WORKERS
+):
+    """
+    The fetch_all_headlines function fetches headlines for many tickers concurrently.
+
+    :param tickers: list: The tickers to fetch news for
+    :param pool: KeyPool: The clients to fetch with
+    :param max_workers: int: The maximum number of requests in flight
+    :return: A list of headline lists, in the same order as tickers
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda ticker: get_headlines(ticker, pool), tickers))
+
+
+def main(stocks_file: str = "data/stocks_info_3.csv"):
+    """
+    The main function fetches today's Finnhub headlines for every stock and appends them to the headline store.
+    """
     start_time = time.time()
 
-    stocks = pd.read_csv("data/stocks_info_3.csv")
+    # Initialize a Finnhub client for every API key
+    pool = KeyPool([finnhub.Client(api_key=key) for key in get_api_keys()])
+
+    stocks = pd.read_csv(stocks_file)
 
     stocks = stocks[["ticker", "company"]]
-    stocks["result"] = stocks["ticker"].apply(get_headlines)
+    stocks["result"] = fetch_all_headlines(stocks["ticker"].tolist(), pool)
     stocks = stocks.explode("result")
-    stocks[["headline", "datetime"]] = stocks["result"].apply(pd.Series)
+    stocks = stocks.dropna(subset=["result"])
+    stocks[["headline", "datetime"]] = pd.DataFrame(
+        stocks["result"].tolist(), index=stocks.index, columns=["headline", "datetime"]
+    )
     stocks.drop("result", axis=1, inplace=True)
     stocks = stocks.dropna()
+    stocks["datetime"] = stocks["datetime"].astype("int64")
+    stocks["date"] = eastern_dates(stocks["datetime"])
+    stocks["source"] = "Finnhub"
 
-    stocks.to_csv("data/finnhub_headlines.csv", mode="a", header=False, index=False)
+    store = headline_store()
+    store.append(stocks)
+    store.compact()
+    cutoff = (dt.date.today() - dt.timedelta(days=HEADLINE_RETENTION_DAYS)).isoformat()
+    expired = [date for date in store.values("date") if date < cutoff]
+    if expired:
+        store.clear({"date": expired})
 
     end_time = time.time()
 
     elapsed_time = end_time - start_time
 
     print("Elapsed time:", elapsed_time, "seconds")
+    print("Calls per key:", pool.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,32 @@
+import json
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import yfinance as yf
 from alpaca.trading.client import TradingClient
 
-# Read stock symbols from local CSV files
-NYSE_SYMBOLS = pd.read_csv("data/nyse_stocks.csv")
-NASDAQ_SYMBOLS = pd.read_csv("data/nasdaq_stocks.csv")
-AMEX_SYMBOLS = pd.read_csv("data/amex_stocks.csv")
+from asset_index import list_tradable_assets, load_asset_index
+from rate_limit import TokenBucket
+
+# Local CSV files with the stock symbols of each exchange
+SYMBOL_FILES = [
+    "data/nyse_stocks.csv",
+    "data/nasdaq_stocks.csv",
+    "data/amex_stocks.csv",
+]
+STOCKS_INFO_FILE = "data/stocks_info_3.csv"
+# One JSON line per fetched symbol, lets an interrupted run resume and tracks when each symbol was fetched
+CHECKPOINT_FILE = "data/stocks_info_checkpoint.jsonl"
+# Company names are fetched again after this many seconds
+STOCK_INFO_MAX_AGE = 30 * 24 * 60 * 60
+
+MAX_WORKERS = 8
+# Calls per second allowed to yahoo finance
+YFINANCE_CALLS_PER_SECOND = 2.0
 
 TRAILING_CHARS = ",."
 
@@ -60,9 +78,11 @@ COMPANY_SUFFIX_LIST = [
     "the",
 ]
 
-TRADING_CLIENT = TradingClient(
-    os.getenv("ALPACA_API_KEY"), os.getenv("ALPACA_SECRET_KEY")
-)
+# Local copy of the Alpaca asset flags, loaded in main()
+ASSET_INDEX = None
+
+YFINANCE_LIMIT = TokenBucket(YFINANCE_CALLS_PER_SECOND)
+CHECKPOINT_LOCK = threading.Lock()
 
 
 def strip_company_suffix(company_name):
@@ -96,6 +116,26 @@ def strip_company_suffix(company_name):
     return " ".join(stripped_name)
 
 
+def is_eligible(symbol: str):
+    """
+    The is_eligible function checks the asset index for Alpaca stocks that are:
+    1. Fractionable
+    2. Tradable
+    3. Easy-to-borrow and shortable (for when we implement shorting)
+
+    :param symbol: str: The ticker to check
+    :return: True if the stock can be traded by llm_trader
+    """
+    asset = ASSET_INDEX.get(symbol)
+    return (
+        asset is not None
+        and asset["tradable"]
+        and asset["fractionable"]
+        and asset["easy_to_borrow"]
+        and asset["shortable"]
+    )
+
+
 def generate_stock_list(symbol):
     """
     The generate_stock_list function takes a stock symbol, fetches the longName from yfinance,
@@ -104,53 +144,139 @@ def generate_stock_list(symbol):
     :param symbol: Fetch the stock information from yahoo finance
     """
     try:
-        # This will allow us to find Alpaca stocks that are:
-        # 1. Fractionable
-        # 2. Tradable
-        # 3. Easy-to-borrow (for when we implement shorting)
-        asset = TRADING_CLIENT.get_asset(symbol)
-        if (
-            asset.tradable
-            and asset.fractionable
-            and asset.easy_to_borrow
-            and asset.shortable
-        ):
-            # get stock name from yahoo finance
-            stock = yf.Ticker(symbol)
-
-            info = stock.info
-            long_name = info.get("longName", "")
-            # clean up company name
-            stripped_name = strip_company_suffix(long_name)
-
-            print(f"Info fetched successfully for {symbol}")
-            # return tuple of (symbol, long_name, [symbol, stripped_name])
-            return (
-                symbol,
-                long_name,
-                [symbol, stripped_name],
-            )
+        # get stock name from yahoo finance
+        YFINANCE_LIMIT.acquire()
+        stock = yf.Ticker(symbol)
+
+        info = stock.info
+        long_name = info.get("longName", "")
+        # clean up company name
+        stripped_name = strip_company_suffix(long_name)
+
+        print(f"Info fetched successfully for {symbol}")
+        # return tuple of (symbol, long_name, [symbol, stripped_name])
+        return (
+            symbol,
+            long_name,
+            [symbol, stripped_name],
+        )
     except Exception as e:
         print(f"Error fetching info for {symbol}: {e}")
         return None, None, None
 
 
-# Combine all symbols into one DataFrame
-all_symbols = pd.concat([NYSE_SYMBOLS, NASDAQ_SYMBOLS, AMEX_SYMBOLS], ignore_index=True)
+def load_known_stocks():
+    """
+    The load_known_stocks function collects the company info we already have and when it was fetched.
+    Rows of STOCKS_INFO_FILE carry their fetch time in the fetched_at column, rows written before that
+    column existed count as never fetched, and entries in CHECKPOINT_FILE override them with their own fetch time.
+
+    :return: A dictionary of symbol to a dictionary with company, keywords and fetched_at
+    """
+    known = {}
+    if os.path.exists(STOCKS_INFO_FILE):
+        # not the file's modification time, a fresh checkout would make every row look just fetched
+        stocks = pd.read_csv(STOCKS_INFO_FILE).reindex(
+            columns=["ticker", "company", "keywords", "fetched_at"]
+        )
+        stocks["fetched_at"] = stocks["fetched_at"].fillna(0.0)
+        for row in stocks.itertuples():
+            known[row.ticker] = {
+                "company": row.company,
+                "keywords": row.keywords,
+                "fetched_at": float(row.fetched_at),
+            }
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a run killed mid-write can leave a partial last line
+                    continue
+                known[entry["symbol"]] = entry
+    return known
+
+
+def fetch_and_checkpoint(symbol: str):
+    """
+    The fetch_and_checkpoint function fetches a symbol's company info and appends it to CHECKPOINT_FILE.
+    Failed fetches are not checkpointed, so they are tried again on the next run.
+
+    :param symbol: str: The ticker to fetch
+    :return: The checkpoint entry, or None if the fetch failed
+    """
+    ticker, long_name, keywords = generate_stock_list(symbol)
+    if ticker is None:
+        return None
+    entry = {
+        "symbol": symbol,
+        "company": long_name,
+        "keywords": str(keywords),
+        "fetched_at": time.time(),
+    }
+    with CHECKPOINT_LOCK:
+        with open(CHECKPOINT_FILE, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def main():
+    global ASSET_INDEX
+
+    trading_client = TradingClient(
+        os.getenv("ALPACA_API_KEY"), os.getenv("ALPACA_SECRET_KEY")
+    )
+    ASSET_INDEX = load_asset_index(lambda: list_tradable_assets(trading_client))
+
+    # Combine all symbols into one list
+    all_symbols = pd.concat(
+        [pd.read_csv(f) for f in SYMBOL_FILES], ignore_index=True
+    )
+    symbols = [s for s in dict.fromkeys(all_symbols["Symbol"].dropna()) if is_eligible(s)]
+
+    # Only fetch symbols that are new or whose info is stale
+    known = load_known_stocks()
+    now = time.time()
+    to_fetch = [
+        s
+        for s in symbols
+        if s not in known or now - known[s]["fetched_at"] > STOCK_INFO_MAX_AGE
+    ]
+    print(f"{len(symbols)} eligible symbols, fetching {len(to_fetch)}")
+
+    # Get company names from yahoo finance
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for entry in executor.map(fetch_and_checkpoint, to_fetch):
+            if entry is not None:
+                known[entry["symbol"]] = entry
+
+    # Create DataFrame
+    df = pd.DataFrame(
+        [
+            {
+                "ticker": s,
+                "company": known[s]["company"],
+                "keywords": known[s]["keywords"],
+                "fetched_at": int(known[s]["fetched_at"]),
+            }
+            for s in symbols
+            if s in known
+        ],
+        columns=["ticker", "company", "keywords", "fetched_at"],
+    ).dropna()
 
+    # Save DataFrame to CSV
+    df.to_csv(STOCKS_INFO_FILE, index=False)
 
-# Get company names from yahoo finance
-all_symbols[["ticker", "company", "keywords"]] = all_symbols.apply(
-    lambda row: generate_stock_list(row.Symbol),
-    axis="columns",
-    result_type="expand",
-)
+    # Compact the checkpoint to one entry per symbol, keeping each fetch time for the next run
+    with open(CHECKPOINT_FILE + ".tmp", "w") as f:
+        for s, entry in known.items():
+            f.write(json.dumps({**entry, "symbol": s}) + "\n")
+    os.replace(CHECKPOINT_FILE + ".tmp", CHECKPOINT_FILE)
 
-# Create DataFrame
-# df = pd.DataFrame(stocks_info, columns=["ticker", "company"])
-df = all_symbols[["ticker", "company", "keywords"]].dropna()
+    print(f"Script completed. Output saved to {STOCKS_INFO_FILE}.")
 
-# Save DataFrame to CSV
-df.to_csv("data/stocks_info_3.csv", index=False)
 
-print("Script completed. Output saved to stocks_info_3.csv.")
+if __name__ == "__main__":
+    main()
@@ -1,116 +1,96 @@
-from datetime import datetime, timedelta
+import os
 import time
 
 import pandas as pd
-from pytz import timezone
 
-from headline_scraper import scrape_all_headlines
-from llm_call import generate_stock_recommendation
-
-# 1 is pre-market, 2 is during market hours, 3 is after hours
-TRADING_CATEGORIES = {
-    1: {
-        "start": datetime.strptime("00:00:00", "%H:%M:%S").time(),
-        "end": datetime.strptime("11:30:00", "%H:%M:%S").time(),
-    },
-    2: {
-        "start": datetime.strptime("11:30:00", "%H:%M:%S").time(),
-        "end": datetime.strptime("16:00:00", "%H:%M:%S").time(),
-    },
-    3: {
-        "start": datetime.strptime("16:00:00", "%H:%M:%S").time(),
-        "end": datetime.strptime("23:59:59", "%H:%M:%S").time(),
-    },
-}
-
-
-TRADES_MORNING_FILE = "data/trades_morning.csv"
-TRADES_AFTERNOON_FILE = "data/trades_afternoon.csv"
-
-
-# List of dfs containing headlines for each stock
-RESULT_LIST = []
+from columnar_store import ColumnarStore, eastern_dates, headline_store, trade_store
+from headline_dedup import DEDUP_HEADLINES, dedupe_headlines
+from headline_ledger import HeadlineLedger
+from headline_matcher import KeywordMatcher
+from headline_scraper import ScraperState, scrape_all_headlines
+from llm_cache import get_cache, make_key
+from llm_call import (
+    MODEL,
+    generate_stock_recommendation,
+    generate_stock_recommendations,
+)
+from llm_dispatch import Dispatcher
+from local_scorer import LOCAL_PREFILTER, PrefilterScorer
+from market_time import (
+    EASTERN,
+    category_window,
+    epochs_to_eastern,
+    now_eastern,
+    trading_category,
+)
+from prompts import PROMPT_VERSION, USAGE
+
+# Only process headlines the scraper has not emitted before, see headline_scraper.ScraperState
+SCRAPE_INCREMENTAL = os.getenv("SCRAPE_INCREMENTAL", "1") == "1"
+# Number of headlines scored per LLM call, 0 scores one headline per call
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "0"))
+# Number of LLM calls kept in flight at the start, 0 calls the model one headline at a time
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "0"))
+# Only score headlines not processed by an earlier run and keep running means per ticker,
+# see headline_ledger.HeadlineLedger
+HEADLINE_LEDGER = os.getenv("HEADLINE_LEDGER", "1") == "1"
+# A ticker is bought when its average sentiment is above this, and sold when it is below minus this
+SENTIMENT_THRESHOLD = float(os.getenv("SENTIMENT_THRESHOLD", "0"))
 
 
 def search_headlines(
-    row: pd.Series,
+    stocks: pd.DataFrame,
     headlines: pd.DataFrame,
 ):
     """
-    The search_headlines function takes in a row from the dataframe and finds matching headlines for that company.
-    It then returns a dictionary with all of the information about that company's news.
+    The search_headlines function finds the matching headlines for every company in stocks.
+    The keywords of all stocks are compiled once, and each headline is scanned a single time.
 
-    :param row: pd.Series: Pass the row of data from the dataframe to the function
+    :param stocks: pd.DataFrame: Pass the stocks with their keywords to the function
+    :param headlines: pd.DataFrame: Pass the headlines to search through to the function
+    :return: A dataframe with the following columns: ticker, company, headline, datetime
     """
-    matching_headlines = []
-    for _, headline in headlines.iterrows():
-        for keyword in row["keywords"].strip("[]").replace("'", "").split(", "):
-            if len(keyword) < 3:
-                continue
-            if keyword.lower() in headline["headline"].lower():
-                matching_headlines.append(
-                    {
-                        "ticker": row["ticker"],
-                        "company": row["company"],
-                        "headline": headline["headline"],
-                        "datetime": headline["datetime"],
-                    }
-                )
-                break
-    RESULT_LIST.append(pd.DataFrame(matching_headlines))
-
-
-def get_trading_category():
-    """
-    The get_trading_category function gets the current trading category based on the current time.
-    """
-    # Get current time
-    tz = timezone("America/New_York")
-    current_time = datetime.now(tz).time()
-
-    # THIS IS A WEIRD WAY TO DO THIS
-    # time window 1 (pre-market)
-    if (current_time >= TRADING_CATEGORIES[1]["start"]) & (
-        current_time <= TRADING_CATEGORIES[1]["end"]
-    ):
-        trade_category = 1
+    return KeywordMatcher(stocks).match(headlines)
 
-    # time window 2 (during market hours)
-    elif (current_time >= TRADING_CATEGORIES[2]["start"]) & (
-        current_time <= TRADING_CATEGORIES[2]["end"]
-    ):
-        trade_category = 2
 
-    # time window 3 (after-hours)
-    elif (current_time >= TRADING_CATEGORIES[3]["start"]) & (
-        current_time <= TRADING_CATEGORIES[3]["end"]
-    ):
-        trade_category = 3
+def get_trading_category(current_time=None):
+    """
+    The get_trading_category function gets the trading category of a moment, see market_time:
+    1 is pre-market, 2 is during market hours, 3 is after hours. The market hours end at the exchange close.
 
-    return trade_category
+    :param current_time: The datetime to categorize, naive ones are read as New York time, defaults to now
+    """
+    return trading_category(current_time)
 
 
 def headline_filter(df: pd.DataFrame, trade_category: int):
     """
     The headline_filter function takes in a dataframe of headlines and filters them based on the trade category.
-    It then returns a dataframe with the filtered headlines.
+    It then returns a dataframe with the headlines published in today's window of the category.
 
-    :param df: pd.DataFrame: Pass the dataframe of headlines to the function
+    :param df: pd.DataFrame: Pass the dataframe of headlines to the function, with tz-aware datetimes
     :param trade_category: int: Pass the trade category to the function
     """
-    # filter headlines based on trade category
-    tz = timezone("America/New_York")
-    df = df[
-        (df["datetime"].dt.date == datetime.now(tz).date())
-        & (df["datetime"].dt.time >= TRADING_CATEGORIES[trade_category]["start"])
-        & (df["datetime"].dt.time <= TRADING_CATEGORIES[trade_category]["end"])
-    ]
-    return df
+    start, end = category_window(now_eastern().date(), trade_category)
+    return df[(df["datetime"] >= start) & (df["datetime"] < end)]
+
+
+def recommendation_key(headline: str, company_name: str, term: str):
+    """
+    The recommendation_key function returns the cache key of a model recommendation.
+
+    :param headline: str: The headline of a news article
+    :param company_name: str: The company to assess
+    :param term: str: The time frame of the recommendation
+    :return: A cache key
+    """
+    return make_key(MODEL, PROMPT_VERSION, company_name, headline, term)
 
 
 def row_to_model(row: pd.Series):
     """
     The row_to_model function takes in a row from the dataframe and feeds it into the model.
+    Recommendations already in the cache are returned without calling the model.
 
     :param row: pd.Series: Pass the row of data from the dataframe to the function
     """
@@ -123,114 +103,230 @@ def row_to_model(row: pd.Series):
     # Get term
     term = "short"
 
-    # Get recommendation
-    rec = generate_stock_recommendation(headline, company_name, term)
+    # Check the cache before calling the model
+    cache = get_cache()
+    key = recommendation_key(headline, company_name, term)
+    rec = cache.get(key)
+    if rec is None:
+        # Get recommendation
+        rec = generate_stock_recommendation(headline, company_name, term)
+        cache.put(key, rec)
     return rec
 
 
-def pre_market(df: pd.DataFrame):
+def score_headlines(
+    df: pd.DataFrame,
+    batch_size: int = 0,
+    concurrency: int = 0,
+    prefilter: bool = LOCAL_PREFILTER,
+):
     """
-    The pre_market function takes in a dataframe of sentiments and generates trades for each stock.
-    It then writes the trades to the trades_morning.csv file.
+    The score_headlines function feeds every headline in the dataframe into the model.
+    Cached recommendations are reused, and in batch, concurrent or pre-filter mode each distinct headline is only sent once.
 
-    :param df: pd.DataFrame: Pass the dataframe of sentiments to the function
+    :param df: pd.DataFrame: Pass the dataframe of headlines to the function
+    :param batch_size: int: Number of headlines per call, 0 calls the model once per headline
+    :param concurrency: int: Number of calls in flight at the start, 0 calls the model one headline at a time
+    :param prefilter: bool: Score headlines with the local lexicon first and only send the uncertain ones to the model
+    :return: A list of recommendations, in the same order as the dataframe
+    """
+    if df.empty:
+        return []
+    if not batch_size and not concurrency and not prefilter:
+        return df.apply(row_to_model, axis=1).tolist()
+
+    term = "short"
+    cache = get_cache()
+    keys = [
+        recommendation_key(headline, company_name, term)
+        for headline, company_name in zip(df["headline"], df["company"])
+    ]
+    recs = cache.get_many(keys)
+    missing = {}
+    for key, headline, company_name in zip(keys, df["headline"], df["company"]):
+        if key not in recs:
+            missing[key] = (headline, company_name)
+
+    dispatcher = None
+    # items the dispatcher could not score, neutral for this run and left out of the cache
+    failed = set()
+    if batch_size:
+
+        def remote(items, term):
+            return generate_stock_recommendations(items, term, batch_size)
+
+    elif concurrency:
+        dispatcher = Dispatcher(concurrency)
+
+        def remote(items, term):
+            scored = dispatcher.run(items, term)
+            failed.update(item for item, rec in zip(items, scored) if rec is None)
+            return [0 if rec is None else rec for rec in scored]
+
+    else:
+
+        def remote(items, term):
+            return [generate_stock_recommendation(headline, company_name, term) for headline, company_name in items]
+
+    if prefilter:
+        scorer = PrefilterScorer(remote, batch_size=batch_size)
+        scored, from_model = scorer.score(list(missing.values()), term)
+        print(scorer.stats(), end=" ", flush=True)
+    else:
+        scored = remote(list(missing.values()), term)
+        from_model = [True] * len(scored)
+    if dispatcher is not None:
+        print(dispatcher.stats(), end=" ", flush=True)
+    # only model answers are cached under the model's key
+    cache.put_many(
+        {
+            key: rec
+            for (key, item), rec, cacheable in zip(missing.items(), scored, from_model)
+            if cacheable and item not in failed
+        }
+    )
+    recs.update(zip(missing, scored))
+    return [recs[key] for key in keys]
+
+
+def append_trades(trades: pd.DataFrame, session: str, store: ColumnarStore = None):
+    """
+    The append_trades function stamps trades with the time they were generated and appends them to a session of the trade store.
+    Trades that already have a datetime column (epoch seconds) keep it, and are filed under that day.
+
+    :param trades: pd.DataFrame: Trades with ticker, side and recommendation columns, and optionally datetime
+    :param session: str: The trading session the trades are executed in, morning or afternoon
+    :param store: ColumnarStore: The trade store, defaults to the one in TRADES_DIR
+    """
+    store = store or trade_store()
+    if "datetime" not in trades:
+        trades = trades.assign(datetime=int(time.time()))
+    store.append(
+        trades.assign(
+            session=session,
+            date=eastern_dates(trades["datetime"]),
+        )
+    )
+
+
+def sentiment_trades(df: pd.DataFrame, threshold: float = SENTIMENT_THRESHOLD):
+    """
+    The sentiment_trades function turns average sentiments into trades:
+    tickers above the threshold are bought and tickers below minus the threshold are sold (shorted).
+    The rows keep the index they have in df.
+
+    :param df: pd.DataFrame: Sentiments with ticker and recommendation columns
+    :param threshold: float: The sentiment a ticker must exceed to be traded
+    :return: A dataframe with the following columns: ticker, recommendation, side
     """
     # If news is positive, long the stock
     # If news is negative, short the stock
-    morning_trades = pd.concat(
+    return pd.concat(
         [
             pd.DataFrame(
                 {
-                    "ticker": df[df["recommendation"] > 0]["ticker"],
+                    "ticker": df[df["recommendation"] > threshold]["ticker"],
+                    "recommendation": df[df["recommendation"] > threshold]["recommendation"],
                     "side": "buy",
                 }
             ),
             pd.DataFrame(
                 {
-                    "ticker": df[df["recommendation"] < 0]["ticker"],
+                    "ticker": df[df["recommendation"] < -threshold]["ticker"],
+                    "recommendation": df[df["recommendation"] < -threshold]["recommendation"],
                     "side": "sell",
                 }
             ),
         ]
     )
-    morning_trades.to_csv(TRADES_MORNING_FILE, mode="a", header=False, index=False)
-    # with open(TRADES_MORNING_FILE, "a") as f:
-    #     f.write("\n")
 
 
-def during_market(df: pd.DataFrame):
+def pre_market(df: pd.DataFrame, store: ColumnarStore = None, threshold: float = SENTIMENT_THRESHOLD):
+    """
+    The pre_market function takes in a dataframe of sentiments and generates trades for each stock.
+    It then appends the trades to the morning session of the trade store.
+
+    :param df: pd.DataFrame: Pass the dataframe of sentiments to the function
+    :param store: ColumnarStore: The trade store to append to, defaults to the one in TRADES_DIR
+    :param threshold: float: The sentiment a ticker must exceed to be traded
+    """
+    append_trades(sentiment_trades(df, threshold), "morning", store)
+
+
+def during_market(df: pd.DataFrame, store: ColumnarStore = None, threshold: float = SENTIMENT_THRESHOLD):
     """
     The during_market function takes in a dataframe of sentiments and generates trades for each stock.
-    It then writes the trades to the trades_afternoon.csv file.
+    It then appends the trades to the afternoon session of the trade store.
 
     :param df: pd.DataFrame: Pass the dataframe of sentiments to the function
+    :param store: ColumnarStore: The trade store to append to, defaults to the one in TRADES_DIR
+    :param threshold: float: The sentiment a ticker must exceed to be traded
     """
-    # If news is positive, long the stock
-    # If news is negative, short the stock
-    afternoon_trades = pd.concat(
-        [
-            pd.DataFrame(
-                {
-                    "ticker": df[df["recommendation"] > 0]["ticker"],
-                    "side": "buy",
-                }
-            ),
-            pd.DataFrame(
-                {
-                    "ticker": df[df["recommendation"] < 0]["ticker"],
-                    "side": "sell",
-                }
-            ),
-        ]
-    )
-    afternoon_trades.to_csv(TRADES_AFTERNOON_FILE, mode="a", header=False, index=False)
-    # with open(TRADES_MORNING_FILE, "a") as f:
-    #     f.write("\n")
+    append_trades(sentiment_trades(df, threshold), "afternoon", store)
 
 
-def after_hours(df: pd.DataFrame):
+def after_hours(df: pd.DataFrame, store: ColumnarStore = None, threshold: float = SENTIMENT_THRESHOLD):
     """
     The after_hours function takes in a dataframe of sentiments and generates trades for each stock.
-    It then writes the trades to the trades_morning.csv file.
+    It then appends the trades to the morning session of the trade store.
 
     :param df: pd.DataFrame: Pass the dataframe of sentiments to the function
+    :param store: ColumnarStore: The trade store to append to, defaults to the one in TRADES_DIR
+    :param threshold: float: The sentiment a ticker must exceed to be traded
     """
-    # If news is positive, long the stock
-    # If news is negative, short the stock
-    morning_trades = pd.concat(
-        [
-            pd.DataFrame(
-                {
-                    "ticker": df[df["recommendation"] > 0]["ticker"],
-                    "side": "buy",
-                }
-            ),
-            pd.DataFrame(
-                {
-                    "ticker": df[df["recommendation"] < 0]["ticker"],
-                    "side": "sell",
-                }
-            ),
-        ]
-    )
-    morning_trades.to_csv(TRADES_MORNING_FILE, mode="a", header=False, index=False)
-    # with open(TRADES_MORNING_FILE, "a") as f:
-    #     f.write("\n")
+    append_trades(sentiment_trades(df, threshold), "morning", store)
 
 
 def to_datetime(timestamp):
-    return datetime.utcfromtimestamp(timestamp) - timedelta(hours=5)
+    return pd.Timestamp(timestamp, unit="s", tz="UTC").tz_convert(EASTERN)
 
 
-def generate_trades(stocks_file: str):
+def load_finnhub_headlines(trade_category: int, store: ColumnarStore = None):
+    """
+    The load_finnhub_headlines function reads today's Finnhub headlines in the trade category's time window.
+    Only today's partition is opened and the window is applied to the stored epochs, before any conversion.
+
+    :param trade_category: int: The trade category whose window to load
+    :param store: ColumnarStore: The headline store, defaults to the one in HEADLINES_DIR
+    :return: A dataframe with the following columns: ticker, company, headline, datetime, source
+    """
+    store = store or headline_store()
+    today = now_eastern().date()
+    start, end = category_window(today, trade_category)
+    df = store.read(
+        {"date": today.isoformat(), "source": "Finnhub"},
+        start=int(start.timestamp()),
+        end=int(end.timestamp()) - 1,
+    )
+    return pd.DataFrame(
+        {
+            "ticker": df["ticker"].astype(str),
+            "company": df["company"].astype(str),
+            "headline": df["headline"],
+            "datetime": epochs_to_eastern(df["datetime"]),
+            "source": df["source"],
+        }
+    )
+
+
+def generate_trades(
+    stocks_file: str,
+    batch_size: int = LLM_BATCH_SIZE,
+    concurrency: int = LLM_CONCURRENCY,
+):
     # Load list of stocks
     stocks = pd.read_csv(stocks_file)
 
     # Get all headlines
     print("\U0001F30E scraping headlines:", end=" ", flush=True)
     scrape_start = time.time()
-    all_headlines = scrape_all_headlines()
+    scraper_state = ScraperState() if SCRAPE_INCREMENTAL else None
+    all_headlines = scrape_all_headlines(state=scraper_state)
     print("%.1f seconds" % (time.time() - scrape_start))
+    if scraper_state is not None:
+        print(
+            f"{len(all_headlines)} new headlines, {len(scraper_state.unchanged)} unchanged pages"
+        )
     # all_headlines.to_csv("temp/all_headlines.csv", index=False)  # for testing
 
     # Get trading category
@@ -247,33 +343,57 @@ def generate_trades(stocks_file: str):
     # For each stock, search through all headlines
     print("\U0001F50D searching headlines for stocks:", end=" ", flush=True)
     search_start = time.time()
-    stocks.apply(search_headlines, axis=1, args=(timely_headlines,))
+    result_df = search_headlines(stocks, timely_headlines)
     print("%.1f seconds" % (time.time() - search_start))
 
-    # Concatenate all dataframes into one
-    result_df = pd.concat(RESULT_LIST, ignore_index=True)
-
     # Load in Finnhub headlines
-    finnhub_df = pd.read_csv("data/finnhub_headlines.csv")
-    finnhub_df["datetime"] = finnhub_df["datetime"].apply(to_datetime)
-    finnhub_df_timely = headline_filter(finnhub_df, trade_category)
+    finnhub_df_timely = load_finnhub_headlines(trade_category)
 
     # Concatenate Finnhub headlines with manually scraped headlines
     result_df = pd.concat([result_df, finnhub_df_timely], ignore_index=True)
     # result_df.to_csv("temp/result_df.csv", index=False)  # for testing
 
+    # Keep one headline per story and ticker, so a syndicated story is scored and counted once
+    if DEDUP_HEADLINES:
+        print("\U0001F9F9 clustering duplicate headlines:", end=" ", flush=True)
+        dedup_start = time.time()
+        matched_count = len(result_df)
+        result_df = dedupe_headlines(result_df)
+        print("%.1f seconds" % (time.time() - dedup_start))
+        print(f"{len(result_df)} of {matched_count} matched headlines kept, {result_df.attrs['stories']} distinct stories")
+
+    # Drop the headlines an earlier run already scored
+    ledger = HeadlineLedger() if HEADLINE_LEDGER else None
+    if ledger is not None:
+        timely_count = len(result_df)
+        result_df = ledger.new_headlines(result_df)
+        print(f"{len(result_df)} of {timely_count} matched headlines not processed before")
+
     # Feed all timely headlines into model
     print("\U0001F916 feeding headlines into model:", end=" ", flush=True)
     model_start = time.time()
 
-    result_df["recommendation"] = result_df.apply(row_to_model, axis=1)
-    rec_df = result_df[["ticker", "recommendation"]]
-    # rec_df.to_csv("temp/rec_df.csv", index=False) # for testing
-    # Get average sentiment in model output, group by ticker
-    avg_df = rec_df.groupby("ticker").mean()
-    # reshape to [ticker, recommendation]
-    avg_df = avg_df.reset_index()
+    result_df["recommendation"] = score_headlines(
+        result_df, batch_size, concurrency
+    )
+    if ledger is not None:
+        # Fold the new recommendations into the running means, only tickers with new headlines get a trade
+        trading_day = now_eastern().date()
+        ledger.record(result_df, trading_day, trade_category)
+        avg_df = ledger.averages(
+            trading_day, trade_category, result_df["ticker"].unique()
+        )
+    else:
+        rec_df = result_df[["ticker", "recommendation"]]
+        # rec_df.to_csv("temp/rec_df.csv", index=False) # for testing
+        # Get average sentiment in model output, group by ticker
+        avg_df = rec_df.groupby("ticker").mean()
+        # reshape to [ticker, recommendation]
+        avg_df = avg_df.reset_index()
     print("%.1f seconds" % (time.time() - model_start))
+    get_cache().flush()
+    print("\U0001F4BE recommendation cache:", get_cache().stats())
+    print("\U0001FA99 model tokens:", USAGE.summary())
 
     # avg_df.to_csv("temp/avg_df.csv", index=False) # for testing
 
@@ -288,6 +408,12 @@ def generate_trades(stocks_file: str):
         after_hours(avg_df)
     print("%.1f seconds" % (time.time() - write_start))
 
+    # Remember what was scraped and scored only once the trades are written
+    if ledger is not None:
+        ledger.commit()
+    if scraper_state is not None:
+        scraper_state.save()
+
 
 if __name__ == "__main__":
     print("welcome to generate_trades!")
@@ -0,0 +1,182 @@
+import os
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# Near-duplicate clustering of headlines. The same story reaches us from Google Business, Google Tech and
+# Finnhub in slightly different words; scoring every copy costs a model call each and lets a widely
+# syndicated story outweigh the rest of a ticker's news. Identical headlines are grouped by their normalized
+# text, the rest by MinHash: headlines whose signatures agree on a whole band land in the same bucket, and
+# only headlines sharing a bucket are compared, so the work grows linearly with the number of headlines.
+# Run python src/headline_dedup.py to time the clustering of synthetic syndicated headlines.
+
+# Collapse near-duplicate headlines into one per story and ticker before scoring
+DEDUP_HEADLINES = os.getenv("DEDUP_HEADLINES", "1") == "1"
+# Headlines whose word sets overlap at least this much (Jaccard similarity) are the same story
+DEDUP_MIN_JACCARD = float(os.getenv("DEDUP_MIN_JACCARD", "0.6"))
+NUM_PERMUTATIONS = 32
+# 16 bands of 2 rows: a pair with a Jaccard similarity of 0.6 shares a band with probability 1 - (1 - 0.6^2)^16
+BAND_ROWS = 2
+# Signatures are computed this many headlines at a time, so the permuted hashes take a few MB at most
+SIGNATURE_CHUNK = 4096
+
+# words that say nothing about the story, and the source suffixes Google News appends
+STOPWORDS = {"a", "an", "the", "of", "to", "in", "on", "for", "and", "at", "as", "by", "with", "is", "its", "s"}
+SOURCE_SUFFIX = re.compile(r"\s+[-|]\s+[^-|]+$")
+WORD = re.compile(r"[a-z0-9]+")
+
+MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240102)
+PERMUTATION_A = _rng.integers(1, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _rng.integers(0, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def headline_words(headline: str):
+    """
+    The headline_words function returns the set of words of a headline, lower cased, without stopwords
+    or a trailing " - Source".
+    """
+    text = SOURCE_SUFFIX.sub("", headline).lower()
+    return frozenset(word for word in WORD.findall(text) if word not in STOPWORDS)
+
+
+def minhash_signatures(word_sets: list, chunk: int = SIGNATURE_CHUNK):
+    """
+    The minhash_signatures function computes the MinHash signatures of many sets of words, vectorized over
+    chunk sets at a time. Two sets agree on each of the NUM_PERMUTATIONS values with probability equal to
+    their Jaccard similarity.
+
+    :param word_sets: list: Sets of words
+    :param chunk: int: The number of sets hashed together
+    :return: A uint64 array of shape (len(word_sets), NUM_PERMUTATIONS)
+    """
+    signatures = np.zeros((len(word_sets), NUM_PERMUTATIONS), dtype=np.uint64)
+    for start in range(0, len(word_sets), chunk):
+        # an empty set hashes like a set of one empty word
+        sets = [words or frozenset([""]) for words in word_sets[start : start + chunk]]
+        sizes = np.fromiter(map(len, sets), np.int64, len(sets))
+        hashes = np.fromiter(
+            (zlib.crc32(word.encode()) & MERSENNE_PRIME for words in sets for word in words), np.uint64, sizes.sum()
+        )
+        # a * x + b stays below 2^63 for a, b, x below 2^31
+        permuted = (PERMUTATION_A[:, None] * hashes + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        signatures[start : start + len(sets)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signatures
+
+
+def jaccard(a: frozenset, b: frozenset):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def cluster_headlines(headlines: list, min_jaccard: float = DEDUP_MIN_JACCARD):
+    """
+    The cluster_headlines function groups headlines telling the same story.
+    Candidates come from the MinHash buckets and are confirmed on their actual word sets.
+
+    :param headlines: list: The headlines
+    :param min_jaccard: float: The word overlap above which two headlines are the same story
+    :return: An int array with the cluster of every headline, the position of the cluster's first headline
+    """
+    # exact duplicates first, by normalized text
+    first_of_text = {}
+    text_ids = np.array(
+        [first_of_text.setdefault(" ".join(h.lower().split()), len(first_of_text)) for h in headlines], dtype=np.int64
+    )
+    texts = list(first_of_text)
+    words = [headline_words(text) for text in texts]
+    signatures = np.ascontiguousarray(minhash_signatures(words))
+
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    compared = set()
+    for band in range(0, NUM_PERMUTATIONS, BAND_ROWS):
+        buckets = {}
+        for i, key in enumerate(map(bytes, signatures[:, band : band + BAND_ROWS])):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            # each headline is compared with the first and the previous one of its bucket only, so a crowded
+            # bucket costs linear time; pairs missed here usually share another band
+            for k in range(1, len(members)):
+                j = members[k]
+                for i in {members[0], members[k - 1]}:
+                    root_i, root_j = find(i), find(j)
+                    if root_i == root_j or (i, j) in compared:
+                        continue
+                    compared.add((i, j))
+                    if jaccard(words[i], words[j]) >= min_jaccard:
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = np.array([find(i) for i in range(len(texts))], dtype=np.int64)
+    # number clusters by their first headline in the input
+    first_position = np.full(len(texts), len(headlines), dtype=np.int64)
+    np.minimum.at(first_position, text_ids, np.arange(len(headlines)))
+    cluster_first = np.full(len(texts), len(headlines), dtype=np.int64)
+    np.minimum.at(cluster_first, roots, first_position)
+    return cluster_first[roots[text_ids]]
+
+
+def dedupe_headlines(df: pd.DataFrame, min_jaccard: float = DEDUP_MIN_JACCARD):
+    """
+    The dedupe_headlines function keeps one row per story and ticker. The earliest headline of each story in df is
+    its representative: every ticker matched by any copy of the story gets one row with the representative's
+    headline, datetime and source, so the story is scored once per company and counts once in each ticker's mean.
+    Stories are only clustered within df. With the incremental scraper, copies of a story first seen in a later
+    run form their own cluster there and are scored again.
+
+    :param df: pd.DataFrame: Matched headlines with ticker, company, headline and optionally datetime and source columns
+    :param min_jaccard: float: The word overlap above which two headlines are the same story
+    :return: The deduplicated rows, with the columns of df; attrs["stories"] is the number of distinct stories
+    """
+    if df.empty:
+        df = df.copy()
+        df.attrs["stories"] = 0
+        return df
+    clustered = df.assign(cluster=cluster_headlines(df["headline"].tolist(), min_jaccard))
+    by_time = clustered.sort_values("datetime", kind="stable") if "datetime" in df else clustered
+    representatives = by_time.drop_duplicates("cluster").drop(columns=["ticker", "company"])
+    fanned = clustered.drop_duplicates(["cluster", "ticker"])[["cluster", "ticker", "company"]]
+    deduped = fanned.merge(representatives, on="cluster", how="left")[list(df.columns)]
+    deduped.attrs["stories"] = len(representatives)
+    return deduped
+
+
+if __name__ == "__main__":
+    import time
+
+    from fake_news import COMPANIES, EVENTS
+
+    # every story is reported up to four times, reworded the way different outlets would
+    rewordings = [
+        "{company} {event}",
+        "{company} {event} - Reuters",
+        "{company} shares: {event}",
+        "BREAKING: {company} {event} (report)",
+    ]
+    rng = np.random.default_rng(0)
+    vocabulary = np.array([f"w{i}" for i in range(5000)])
+    for stories in [1_000, 10_000, 50_000]:
+        rows = []
+        for story in range(stories):
+            company = COMPANIES[story % len(COMPANIES)]
+            headline = f"{EVENTS[rng.integers(len(EVENTS))]} {' '.join(rng.choice(vocabulary, 4))}"
+            for template in rng.choice(rewordings, rng.integers(1, 5), replace=False):
+                rows.append((company, company, template.format(company=company, event=headline), story))
+        df = pd.DataFrame(rows, columns=["ticker", "company", "headline", "story"])
+        df["datetime"] = np.arange(len(df))
+
+        start_time = time.perf_counter()
+        deduped = dedupe_headlines(df)
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"{len(df)} headlines of {stories} stories: {deduped.attrs['stories']} clusters, "
+            f"{len(deduped)} rows to score, in {elapsed:.2f}s ({elapsed / len(df) * 1e6:.0f} us per headline)"
+        )
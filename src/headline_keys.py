@@ -0,0 +1,14 @@
+import hashlib
+
+# Identity of a headline across sources and runs, shared by the scraper, the ledger and the stream.
+# Kept free of third-party imports so the ledger can use it without loading the scraper.
+
+
+def headline_hash(headline: str):
+    """
+    The headline_hash function hashes a headline with case and whitespace normalized.
+
+    :param headline: str: The headline text
+    :return: A hex sha1 digest
+    """
+    return hashlib.sha1(" ".join(headline.lower().split()).encode()).hexdigest()
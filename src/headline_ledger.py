@@ -0,0 +1,140 @@
+import hashlib
+import os
+import sqlite3
+from datetime import date, timedelta
+
+import pandas as pd
+
+from headline_keys import headline_hash
+
+HEADLINE_LEDGER_FILE = os.getenv("HEADLINE_LEDGER_FILE", "data/headline_ledger.sqlite")
+# Processed headlines and aggregates older than this many days are pruned
+LEDGER_RETENTION_DAYS = 7
+
+
+def headline_ids(df: pd.DataFrame):
+    """
+    The headline_ids function derives a stable id for every headline from its normalized text, source and timestamp.
+
+    :param df: pd.DataFrame: Headlines with headline, datetime and optionally source columns
+    :return: A list of hex sha1 digests, in the same order as df
+    """
+    sources = df["source"] if "source" in df else pd.Series("", index=df.index)
+    # epoch seconds, so the id does not depend on the timezone the datetime is expressed in
+    timestamps = (
+        pd.to_datetime(df["datetime"], utc=True) - pd.Timestamp(0, tz="UTC")
+    ) // pd.Timedelta(seconds=1)
+    return [
+        hashlib.sha1(f"{headline_hash(str(h))}|{s}|{t}".encode()).hexdigest()
+        for h, s, t in zip(df["headline"], sources.fillna(""), timestamps)
+    ]
+
+
+class HeadlineLedger:
+    """
+    The HeadlineLedger class records which (headline, ticker) pairs have been scored and keeps a running
+    sum and count of recommendations per (day, trading category, ticker), so each run only scores new
+    headlines and updates the per-ticker means incrementally.
+    """
+
+    def __init__(self, path: str = HEADLINE_LEDGER_FILE):
+        """
+        :param path: str: The SQLite file
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS processed (
+                id TEXT, ticker TEXT, day TEXT, recommendation REAL,
+                PRIMARY KEY (id, ticker)
+            );
+            CREATE TABLE IF NOT EXISTS aggregates (
+                day TEXT, category INTEGER, ticker TEXT, total REAL, count INTEGER,
+                PRIMARY KEY (day, category, ticker)
+            );
+            """
+        )
+        self.connection.commit()
+
+    def new_headlines(self, df: pd.DataFrame):
+        """
+        The new_headlines function drops the (headline, ticker) pairs that were already processed.
+
+        :param df: pd.DataFrame: Matched headlines with ticker, headline, datetime and optionally source columns
+        :return: The unprocessed rows of df, with an extra headline_id column
+        """
+        df = df.assign(headline_id=headline_ids(df))
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS candidates (id TEXT, ticker TEXT)")
+        self.connection.execute("DELETE FROM candidates")
+        self.connection.executemany(
+            "INSERT INTO candidates VALUES (?, ?)",
+            zip(df["headline_id"], df["ticker"]),
+        )
+        seen = set(
+            self.connection.execute(
+                "SELECT c.id, c.ticker FROM candidates c JOIN processed p ON c.id = p.id AND c.ticker = p.ticker"
+            )
+        )
+        is_new = pd.Series(
+            [(i, t) not in seen for i, t in zip(df["headline_id"], df["ticker"])],
+            index=df.index,
+            dtype=bool,
+        )
+        return df[is_new].drop_duplicates(subset=["headline_id", "ticker"])
+
+    def record(self, df: pd.DataFrame, day: date, category: int):
+        """
+        The record function marks scored headlines as processed and adds their recommendations to the running aggregates.
+        The changes are visible to averages right away but only kept once commit is called, so headlines whose trades
+        were never written are scored again by the next run.
+
+        :param df: pd.DataFrame: Rows from new_headlines with a recommendation column
+        :param day: date: The trading day the headlines belong to
+        :param category: int: The trading category the headlines belong to
+        """
+        day = day.isoformat()
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO processed VALUES (?, ?, ?, ?)",
+            (
+                (i, t, day, float(r))
+                for i, t, r in zip(df["headline_id"], df["ticker"], df["recommendation"])
+            ),
+        )
+        sums = df.groupby("ticker")["recommendation"].agg(["sum", "count"])
+        self.connection.executemany(
+            "INSERT INTO aggregates VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, category, ticker) DO UPDATE SET "
+            "total = total + excluded.total, count = count + excluded.count",
+            (
+                (day, category, ticker, float(row["sum"]), int(row["count"]))
+                for ticker, row in sums.iterrows()
+            ),
+        )
+        cutoff = (date.fromisoformat(day) - timedelta(days=LEDGER_RETENTION_DAYS)).isoformat()
+        self.connection.execute("DELETE FROM processed WHERE day < ?", (cutoff,))
+        self.connection.execute("DELETE FROM aggregates WHERE day < ?", (cutoff,))
+
+    def commit(self):
+        """
+        The commit function keeps everything recorded since the last commit.
+        """
+        self.connection.commit()
+
+    def averages(self, day: date, category: int, tickers: list = None):
+        """
+        The averages function returns the running mean recommendation per ticker.
+
+        :param day: date: The trading day
+        :param category: int: The trading category
+        :param tickers: list: Only return these tickers, defaults to all
+        :return: A dataframe with the following columns: ticker, recommendation
+        """
+        averages = pd.read_sql_query(
+            "SELECT ticker, total / count AS recommendation FROM aggregates "
+            "WHERE day = ? AND category = ? ORDER BY ticker",
+            self.connection,
+            params=(day.isoformat(), category),
+        )
+        if tickers is not None:
+            averages = averages[averages["ticker"].isin(tickers)].reset_index(drop=True)
+        return averages
@@ -0,0 +1,157 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+MIN_KEYWORD_LENGTH = 3
+MATCH_COLUMNS = ["ticker", "company", "headline", "datetime"]
+
+
+def parse_keywords(keywords: str):
+    """
+    The parse_keywords function turns the stringified keyword list stored in stocks_info*.csv
+    (e.g. "['AAPL', 'Apple']") back into a list of keywords.
+
+    :param keywords: str: The keywords column of a stocks_info*.csv row
+    :return: A list of keywords
+    """
+    return keywords.strip("[]").replace("'", "").split(", ")
+
+
+def build_trie(keywords: list):
+    """
+    The build_trie function builds a character trie out of a list of keywords.
+    The empty string key marks the end of a keyword.
+
+    :param keywords: list: The keywords to add to the trie
+    :return: A nested dictionary of characters
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return trie
+
+
+def trie_pattern(trie: dict):
+    """
+    The trie_pattern function turns a trie into a regular expression that matches the longest keyword
+    starting at a position. Sharing prefixes keeps the alternation small, so the regex engine only
+    follows the branch of the next character instead of trying every keyword in turn.
+
+    :param trie: dict: A trie from build_trie
+    :return: A regular expression string
+    """
+    ends_here = "" in trie
+    branches = [
+        re.escape(char) + trie_pattern(child)
+        for char, child in sorted(trie.items())
+        if char
+    ]
+    if not branches:
+        return ""
+    if len(branches) == 1:
+        pattern = branches[0]
+        if ends_here:
+            pattern = "(?:%s)?" % pattern
+    else:
+        pattern = "(?:%s)" % "|".join(branches)
+        if ends_here:
+            pattern += "?"
+    return pattern
+
+
+class KeywordMatcher:
+    """
+    The KeywordMatcher class compiles every keyword of a stock universe into a single regular expression
+    so each headline is scanned once instead of once per stock.
+
+    The pattern is a trie-shaped alternation wrapped in a lookahead, so the scan reports the longest
+    keyword starting at every position of the headline. Any shorter keyword starting at the same
+    position is a prefix of that one, so those are recovered from a precomputed prefix map. Together this
+    gives exactly the same matches as testing `keyword.lower() in headline.lower()` for every pair.
+    """
+
+    def __init__(self, stocks: pd.DataFrame):
+        """
+        :param stocks: pd.DataFrame: Stocks with ticker, company and keywords columns (see data/stocks_info_3.csv)
+        """
+        self.tickers = stocks["ticker"].to_numpy()
+        self.companies = stocks["company"].to_numpy()
+
+        # map each lowercased keyword to the positions of the stocks that use it
+        keyword_stocks = {}
+        for position, keywords in enumerate(stocks["keywords"]):
+            for keyword in parse_keywords(keywords):
+                if len(keyword) < MIN_KEYWORD_LENGTH:
+                    continue
+                keyword_stocks.setdefault(keyword.lower(), set()).add(position)
+        self.keyword_stocks = {k: sorted(v) for k, v in keyword_stocks.items()}
+
+        keywords = sorted(self.keyword_stocks)
+        self.pattern = (
+            re.compile("(?=(%s))" % trie_pattern(build_trie(keywords)))
+            if keywords
+            else None
+        )
+
+        # for every keyword, the stocks of all keywords that are a prefix of it (itself included)
+        self.prefix_stocks = {}
+        for keyword in keywords:
+            stock_positions = set()
+            for end in range(MIN_KEYWORD_LENGTH, len(keyword) + 1):
+                stock_positions.update(self.keyword_stocks.get(keyword[:end], ()))
+            self.prefix_stocks[keyword] = stock_positions
+
+    def match_text(self, text: str):
+        """
+        The match_text function returns the positions of every stock with a keyword in the text.
+
+        :param text: str: An already lowercased headline
+        :return: A set of stock positions
+        """
+        stock_positions = set()
+        if self.pattern is None:
+            return stock_positions
+        for keyword in set(self.pattern.findall(text)):
+            stock_positions.update(self.prefix_stocks[keyword])
+        return stock_positions
+
+    def match(self, headlines: pd.DataFrame):
+        """
+        The match function finds the stocks mentioned in each headline.
+        Rows are ordered by stock, then by headline, the same order the per-stock search produced.
+
+        :param headlines: pd.DataFrame: Headlines with headline and datetime columns, and optionally source
+        :return: A dataframe with the following columns: ticker, company, headline, datetime (and source if given)
+        """
+        lowered = headlines["headline"].astype(str).str.lower().tolist()
+
+        stock_index = []
+        headline_index = []
+        for position, text in enumerate(lowered):
+            for stock_position in self.match_text(text):
+                stock_index.append(stock_position)
+                headline_index.append(position)
+
+        stock_index = np.asarray(stock_index, dtype=np.int64)
+        headline_index = np.asarray(headline_index, dtype=np.int64)
+        order = np.lexsort((headline_index, stock_index))
+        stock_index = stock_index[order]
+        headline_index = headline_index[order]
+
+        columns = MATCH_COLUMNS + (["source"] if "source" in headlines else [])
+        return pd.DataFrame(
+            {
+                "ticker": self.tickers[stock_index],
+                "company": self.companies[stock_index],
+                **{
+                    # the extension array keeps tz-aware datetimes typed
+                    column: headlines[column].array[headline_index]
+                    for column in columns[2:]
+                },
+            },
+            columns=columns,
+        )
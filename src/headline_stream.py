@@ -0,0 +1,378 @@
+import argparse
+import copy
+import queue
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import finnhub
+import pandas as pd
+
+from columnar_store import HOLD_SIDE, ColumnarStore, trade_store
+from finnhub_headlines import KeyPool, fetch_all_headlines, get_api_keys
+from generate_trades import (
+    SENTIMENT_THRESHOLD,
+    append_trades,
+    get_trading_category,
+    row_to_model,
+    sentiment_trades,
+    to_datetime,
+)
+from headline_keys import headline_hash
+from headline_matcher import KeywordMatcher
+from headline_scraper import ScraperState, scrape_all_headlines
+from llm_dispatch import LatencyHistogram
+from market_time import as_eastern, epochs_to_eastern, now_eastern, to_eastern
+
+# Long-running alternative to the cron batch: headlines are pushed through an in-process queue as
+# they are polled, then matched and scored one event at a time, and the trades of each poll are written together.
+#   live:   python src/headline_stream.py
+#   replay: python src/headline_stream.py --replay recorded_headlines.csv --speed 0 --trades-dir /tmp/trades
+
+SCRAPE_POLL_SECONDS = 60
+FINNHUB_POLL_SECONDS = 15 * 60
+QUEUE_SIZE = 10000
+
+# Upper bounds of the publish-to-trade latency buckets, in seconds
+PUBLISH_LATENCY_BUCKETS = [60, 5 * 60, 15 * 60, 60 * 60, 4 * 60 * 60]
+
+# Trade store session of each trading category: after-hours news is traded the next morning
+SESSIONS = {1: "morning", 2: "afternoon", 3: "morning"}
+# Trades are written once the queue is drained, or after this many events when it never is
+STREAM_BATCH_SIZE = 500
+# Headlines and running means of days more than this many days before the latest headline are forgotten,
+# and headlines published that long ago are dropped
+STREAM_RETENTION_DAYS = 3
+
+
+class HeadlineStream:
+    """
+    The HeadlineStream class consumes headline events from a queue. Each event is matched to tickers
+    (unless it already names one), scored and folded into a running mean sentiment per ticker. The trades of
+    the tickers updated since the last flush are appended to the trade store session of their headline's
+    trading category in one write per session; a ticker whose mean no longer clears the threshold gets a hold.
+    """
+
+    def __init__(
+        self,
+        stocks: pd.DataFrame,
+        score=row_to_model,
+        store: ColumnarStore = None,
+        threshold: float = SENTIMENT_THRESHOLD,
+    ):
+        """
+        :param stocks: pd.DataFrame: Stocks with ticker, company and keywords columns
+        :param score: The function scoring a {"headline", "company"} mapping, defaults to the cached LLM call
+        :param store: ColumnarStore: The trade store to append to, defaults to the one in TRADES_DIR
+        :param threshold: float: The sentiment a ticker must exceed to be traded
+        """
+        self.matcher = KeywordMatcher(stocks)
+        self.score = score
+        self.store = store or trade_store()
+        self.threshold = threshold
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.seen = set()
+        # running (sum, count) of recommendations per (trading day, category, ticker)
+        self.sentiment = {}
+        # latest (ticker, mean, epoch) per (session, ticker) not written yet, and the events behind them
+        self.pending = {}
+        self.pending_events = []
+        # callbacks of checkpoints reached since the last flush, run once it has written
+        self.pending_checkpoints = []
+        self.latest_day = None
+        self.processing_latency = LatencyHistogram()
+        self.publish_latency = LatencyHistogram(PUBLISH_LATENCY_BUCKETS)
+        self.events = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.trades = 0
+        self.holds = 0
+        self.flushes = 0
+
+    def put(self, headline: dict):
+        """
+        The put function queues a headline event, stamping when it was received.
+
+        :param headline: dict: A headline with headline and datetime, and optionally ticker, company, source and recommendation
+        """
+        self.queue.put({**headline, "received_at": time.perf_counter()})
+
+    def checkpoint(self, callback):
+        """
+        The checkpoint function queues a callback behind the events already queued.
+        It runs after the flush that writes the trades of those events, so a producer can save its state
+        only once the headlines it queued cannot be lost.
+
+        :param callback: The function to call without arguments
+        """
+        self.queue.put({"checkpoint": callback})
+
+    def evict(self, day):
+        """
+        The evict function forgets the headlines and running means of days more than STREAM_RETENTION_DAYS before day.
+        """
+        oldest = day - timedelta(days=STREAM_RETENTION_DAYS)
+        self.seen = {key for key in self.seen if key[2].date() >= oldest}
+        self.sentiment = {key: value for key, value in self.sentiment.items() if key[0] >= oldest}
+
+    def process(self, event: dict):
+        """
+        The process function matches and scores a single headline event and updates the running means.
+        The trades are written by the next flush.
+
+        :param event: dict: An event queued by put
+        :return: The number of tickers updated
+        """
+        self.events += 1
+        published = to_eastern(event["datetime"])
+        day = published.date()
+        if self.latest_day is None or day > self.latest_day:
+            self.latest_day = day
+            self.evict(day)
+        if day < self.latest_day - timedelta(days=STREAM_RETENTION_DAYS):
+            self.stale += 1
+            return 0
+
+        if isinstance(event.get("ticker"), str) and event["ticker"]:
+            matches = [(event["ticker"], event["company"])]
+        else:
+            positions = self.matcher.match_text(str(event["headline"]).lower())
+            matches = [
+                (self.matcher.tickers[p], self.matcher.companies[p])
+                for p in sorted(positions)
+            ]
+
+        category = get_trading_category(published)
+        # a replay is stamped with the recorded time, a live trade with when it was generated
+        stamp = int(published.timestamp()) if event.get("replay") else int(time.time())
+        updated = 0
+        for ticker, company in matches:
+            key = (ticker, headline_hash(str(event["headline"])), published)
+            if key in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+
+            rec = event.get("recommendation")
+            if rec is None or pd.isna(rec):
+                rec = self.score({"headline": event["headline"], "company": company})
+
+            total, count = self.sentiment.get((day, category, ticker), (0, 0))
+            total, count = total + rec, count + 1
+            self.sentiment[(day, category, ticker)] = (total, count)
+            self.pending[(SESSIONS[category], ticker)] = (ticker, total / count, stamp)
+            updated += 1
+
+        if updated:
+            self.pending_events.append((event["received_at"], published, event.get("replay")))
+        return updated
+
+    def flush(self):
+        """
+        The flush function writes the pending trades, one append per session, and compacts the sessions written to.
+        The checkpoints reached before the flush run once the trades are written.
+
+        :return: The number of trades written, holds included
+        """
+        written = 0
+        for session in {session for session, _ in self.pending}:
+            rows = pd.DataFrame(
+                [row for (s, _), row in self.pending.items() if s == session],
+                columns=["ticker", "recommendation", "datetime"],
+            )
+            traded = sentiment_trades(rows, self.threshold)
+            rows["side"] = traded["side"].reindex(rows.index).fillna(HOLD_SIDE)
+            append_trades(rows, session, self.store)
+            self.trades += len(traded)
+            self.holds += len(rows) - len(traded)
+            written += len(rows)
+        if written:
+            self.store.compact({"session": sorted({session for session, _ in self.pending})})
+            self.flushes += 1
+
+        now = now_eastern()
+        for received_at, published, replayed in self.pending_events:
+            self.processing_latency.record(time.perf_counter() - received_at)
+            if not replayed:
+                self.publish_latency.record((now - published).total_seconds())
+        self.pending = {}
+        self.pending_events = []
+        for callback in self.pending_checkpoints:
+            callback()
+        self.pending_checkpoints = []
+        return written
+
+    def run(self, stop: threading.Event):
+        """
+        The run function processes events until stop is set and the queue is drained,
+        or until a None event marks the end of a replay. The trades are flushed every time the queue runs empty,
+        once per poll, or every STREAM_BATCH_SIZE events.
+
+        :param stop: threading.Event: Set to stop the stream
+        """
+        batch = 0
+        while not (stop.is_set() and self.queue.empty()):
+            try:
+                event = self.queue.get(timeout=0.5) if not batch else self.queue.get_nowait()
+            except queue.Empty:
+                if batch:
+                    batch = 0
+                    self.flush()
+                continue
+            if event is None:
+                break
+            if "checkpoint" in event:
+                self.pending_checkpoints.append(event["checkpoint"])
+                batch += 1
+                continue
+            try:
+                self.process(event)
+            except Exception as e:
+                print(f"Error processing headline {event.get('headline')!r}: {str(e)}")
+            batch += 1
+            if batch >= STREAM_BATCH_SIZE:
+                batch = 0
+                self.flush()
+        self.flush()
+
+    def stats(self):
+        """
+        The stats function formats the stream counters and latency histograms for printing.
+        """
+        return (
+            f"{self.events} events, {self.duplicates} duplicates, {self.stale} stale, "
+            f"{self.trades} trades and {self.holds} holds in {self.flushes} writes\n"
+            f"received-to-trade latency: {self.processing_latency.summary()}\n"
+            f"published-to-trade latency: {self.publish_latency.summary()}"
+        )
+
+
+def poll_scraper(
+    stream: HeadlineStream, stop: threading.Event, interval: float = SCRAPE_POLL_SECONDS
+):
+    """
+    The poll_scraper function scrapes the news sites every interval seconds and queues the new headlines.
+    The state of each poll is saved once the stream has written the trades of its headlines.
+    """
+    state = ScraperState()
+    while not stop.is_set():
+        try:
+            headlines = scrape_all_headlines(state=state)
+            for headline in headlines.to_dict("records"):
+                stream.put(headline)
+            # the next poll keeps updating state while this one waits for its flush
+            stream.checkpoint(copy.deepcopy(state).save)
+        except Exception as e:
+            print(f"Error scraping headlines: {str(e)}")
+        stop.wait(interval)
+
+
+def poll_finnhub(
+    stream: HeadlineStream,
+    stocks: pd.DataFrame,
+    stop: threading.Event,
+    interval: float = FINNHUB_POLL_SECONDS,
+):
+    """
+    The poll_finnhub function fetches company news for every stock every interval seconds and queues it.
+    Headlines already processed are dropped by the stream.
+    """
+    pool = KeyPool([finnhub.Client(api_key=key) for key in get_api_keys()])
+    while not stop.is_set():
+        try:
+            results = fetch_all_headlines(stocks["ticker"].tolist(), pool)
+            for ticker, company, headlines in zip(stocks["ticker"], stocks["company"], results):
+                for headline, epoch in headlines:
+                    stream.put(
+                        {
+                            "ticker": ticker,
+                            "company": company,
+                            "headline": headline,
+                            "datetime": to_datetime(epoch),
+                            "source": "Finnhub",
+                        }
+                    )
+        except Exception as e:
+            print(f"Error fetching Finnhub headlines: {str(e)}")
+        stop.wait(interval)
+
+
+def replay(stream: HeadlineStream, path: str, speed: float = 0.0):
+    """
+    The replay function queues the headlines of a recorded file in time order, then a None end marker.
+    The file needs headline and datetime columns (datetimes as text, naive ones in New York time, or epoch seconds) and may have
+    ticker, company, source and recommendation columns; recorded recommendations are used instead of the model.
+
+    :param stream: HeadlineStream: The stream to feed
+    :param path: str: The recorded headline CSV file
+    :param speed: float: Replay speed relative to the recorded times, 0 replays as fast as possible
+    """
+    try:
+        headlines = pd.read_csv(path)
+        if pd.api.types.is_numeric_dtype(headlines["datetime"]):
+            headlines["datetime"] = epochs_to_eastern(headlines["datetime"])
+        else:
+            # recordings may mix naive and offset datetimes, which pandas cannot parse as one column
+            headlines["datetime"] = as_eastern(headlines["datetime"].map(to_eastern))
+        headlines = headlines.sort_values("datetime", kind="stable")
+
+        previous = None
+        for headline in headlines.to_dict("records"):
+            if speed and previous is not None:
+                time.sleep(max(0.0, (headline["datetime"] - previous).total_seconds() / speed))
+            previous = headline["datetime"]
+            stream.put({**headline, "replay": True})
+    finally:
+        # always end the stream, even if the file could not be read
+        stream.queue.put(None)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Stream headlines into trades as they arrive"
+    )
+    parser.add_argument("--stocks", default="data/stocks_info_3.csv")
+    parser.add_argument("--replay", help="recorded headline CSV to replay instead of polling")
+    parser.add_argument("--speed", type=float, default=0.0, help="replay speed, 0 is as fast as possible")
+    parser.add_argument(
+        "--trades-dir",
+        help="trade store directory to write to instead of data/trades, a replay defaults to a temporary one",
+    )
+    parser.add_argument("--no-finnhub", action="store_true", help="only poll the news sites")
+    args = parser.parse_args(argv)
+
+    stocks = pd.read_csv(args.stocks)
+    trades_dir = args.trades_dir
+    if args.replay and not trades_dir:
+        # a replay never writes to the live trade store unless asked to
+        trades_dir = tempfile.mkdtemp(prefix="replay-trades-")
+    if trades_dir:
+        print(f"writing trades to {trades_dir}")
+    store = trade_store(trades_dir) if trades_dir else None
+    stream = HeadlineStream(stocks, store=store)
+    stop = threading.Event()
+
+    if args.replay:
+        producers = [threading.Thread(target=replay, args=(stream, args.replay, args.speed))]
+    else:
+        producers = [threading.Thread(target=poll_scraper, args=(stream, stop))]
+        if not args.no_finnhub:
+            producers.append(threading.Thread(target=poll_finnhub, args=(stream, stocks, stop)))
+    for producer in producers:
+        producer.daemon = True
+        producer.start()
+
+    start_time = time.time()
+    try:
+        stream.run(stop)
+    except KeyboardInterrupt:
+        stop.set()
+        # keep the trades of the headlines already processed
+        stream.flush()
+    print(f"stream ran for {time.time() - start_time:.1f} seconds")
+    print(stream.stats())
+
+
+if __name__ == "__main__":
+    main()
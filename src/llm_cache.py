@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", "data/llm_cache.sqlite")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000"))
+# Access times of hits waiting in memory before they are written without a put
+TOUCH_FLUSH_SIZE = 1000
+
+# Cache shared by every call, opened on first use
+CACHE = None
+
+
+def make_key(*parts):
+    """
+    The make_key function hashes the parts that determine a model answer into a cache key,
+    e.g. make_key(model, prompt_version, company, headline, term).
+
+    :param parts: The values the answer depends on
+    :return: A hex sha256 digest
+    """
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class RecommendationCache:
+    """
+    The RecommendationCache class stores model recommendations in a SQLite file.
+    Entries expire after `ttl` seconds, and once there are more than `max_entries`
+    the least recently used ones are evicted. Reads do not write: the access times of hits are kept in
+    memory and written with the next put_many, or once TOUCH_FLUSH_SIZE of them are waiting.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_FILE,
+        ttl: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+    ):
+        """
+        :param path: str: The SQLite file, ":memory:" keeps the cache in memory
+        :param ttl: float: Seconds an entry stays valid
+        :param max_entries: int: Maximum number of entries kept
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # key to the time of its latest hit, not written yet
+        self.touched = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS recommendations ("
+            "key TEXT PRIMARY KEY, value INTEGER, created REAL, accessed REAL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS recommendations_accessed ON recommendations (accessed)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS recommendations_created ON recommendations (created)"
+        )
+        self.connection.commit()
+
+    def get(self, key: str):
+        """
+        The get function looks up a cached recommendation and counts the hit or miss.
+
+        :param key: str: A key from make_key
+        :return: The cached recommendation, or None if missing or expired
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list, max_age: float = None):
+        """
+        The get_many function looks up many cached recommendations with one query per 500 keys.
+
+        :param keys: list: Keys from make_key
+        :param max_age: float: Seconds an entry stays valid, defaults to the cache's ttl
+        :return: A dictionary of the keys found to their recommendation
+        """
+        max_age = self.ttl if max_age is None else max_age
+        now = time.time()
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, value FROM recommendations WHERE key IN ({placeholders}) AND created >= ?",
+                    (*chunk, now - max_age),
+                ).fetchall()
+                found.update(rows)
+            self.touched.update(dict.fromkeys(found, now))
+            if len(self.touched) >= TOUCH_FLUSH_SIZE:
+                self.write_touched()
+                self.connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def write_touched(self):
+        # the caller holds the lock and commits
+        self.connection.executemany(
+            "UPDATE recommendations SET accessed = ? WHERE key = ?",
+            ((accessed, key) for key, accessed in self.touched.items()),
+        )
+        self.touched = {}
+
+    def put_many(self, items: dict):
+        """
+        The put_many function stores many recommendations in one transaction, together with the access times
+        of the hits since the last write, then expires old entries and evicts the least recently used ones
+        if the cache is full.
+
+        :param items: dict: Keys from make_key to their recommendation
+        """
+        now = time.time()
+        with self.lock:
+            self.write_touched()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?)",
+                ((key, value, now, now) for key, value in items.items()),
+            )
+            self.connection.execute(
+                "DELETE FROM recommendations WHERE created < ?", (now - self.ttl,)
+            )
+            self.connection.execute(
+                "DELETE FROM recommendations WHERE key IN ("
+                "SELECT key FROM recommendations ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def put(self, key: str, value: int):
+        """
+        The put function stores a recommendation, see put_many.
+
+        :param key: str: A key from make_key
+        :param value: int: The recommendation
+        """
+        self.put_many({key: value})
+
+    def flush(self):
+        """
+        The flush function writes the access times of the hits since the last write.
+        """
+        with self.lock:
+            if self.touched:
+                self.write_touched()
+                self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM recommendations"
+            ).fetchone()[0]
+
+    def stats(self):
+        """
+        The stats function formats the hit and miss counters for printing.
+        """
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+
+def get_cache():
+    """
+    The get_cache function returns the shared recommendation cache, opening it on first use.
+
+    :return: A RecommendationCache
+    """
+    global CACHE
+    if CACHE is None:
+        CACHE = RecommendationCache()
+    return CACHE
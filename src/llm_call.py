@@ -1,6 +1,53 @@
-import os
+import json
 
-from openai import OpenAI
+from prompts import (
+    ANSWER_MAX_TOKENS,
+    ANSWER_VALUES,
+    BATCH_TOKENS_PER_ITEM,
+    USAGE,
+    answer_logit_bias,
+    answer_to_recommendation,
+    batch_messages,
+    recommendation_messages,
+)
+
+MODEL = "gpt-3.5-turbo"
+
+# OpenAI client shared by every call, created on first use
+CLIENT = None
+
+
+def get_client():
+    """
+    The get_client function returns the shared OpenAI client, creating it on first use.
+    The key is read from OPENAI_API_KEY, and OPENAI_BASE_URL can point the client at a local server.
+
+    :return: An OpenAI client
+    """
+    global CLIENT
+    if CLIENT is None:
+        # imported here, openai takes most of a second to import and cached runs never call it
+        from openai import OpenAI
+
+        CLIENT = OpenAI()
+    return CLIENT
+
+
+def recommendation_request(headline: str, company_name: str, term: str):
+    """
+    The recommendation_request function builds the arguments of a single-headline chat completion,
+    whose answer is one token long.
+    """
+    request = {
+        "model": MODEL,
+        "messages": recommendation_messages(headline, company_name, term),
+        "max_tokens": ANSWER_MAX_TOKENS,
+        "temperature": 0,
+    }
+    logit_bias = answer_logit_bias(MODEL)
+    if logit_bias:
+        request["logit_bias"] = logit_bias
+    return request
 
 
 def generate_stock_recommendation(headline: str, company_name: str, term: str):
@@ -15,33 +62,111 @@ def generate_stock_recommendation(headline: str, company_name: str, term: str):
     :return: A recommendation
     """
 
-    client = OpenAI()
-    OpenAI.api_key = os.getenv("OPENAI_API_KEY")
-
-    # Define the prompt for OpenAI API
-    prompt = f"Forget all your previous instructions. Pretend you are a financial expert. You are a financial expert with stock recommendation experience. Answer only one word: 'YES' if good news, 'NO' if bad news, or 'UNKNOWN' if uncertain. Is this headline good or bad for the stock price of {company_name} in the {term} term? Headline: {headline}"
+    client = get_client()
 
     # Call OpenAI API
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a financial expert with stock recommendation experience.",
-            },
-            {
-                "role": "user",
-                "content": prompt,
-            },
-        ],
-    )
+    request = recommendation_request(headline, company_name, term)
+    response = client.chat.completions.create(**request)
 
     result_text = response.choices[0].message.content
+    USAGE.record(MODEL, request["messages"], result_text)
 
     # Replace "YES" with 1, "NO" with -1, and "UNKNOWN" with 0
-    if result_text == "YES":
-        return 1
-    elif result_text == "NO":
-        return -1
-    else:
-        return 0
+    return answer_to_recommendation(result_text)
+
+
+async def async_generate_stock_recommendation(
+    client, headline: str, company_name: str, term: str
+):
+    """
+    The async_generate_stock_recommendation function is the asyncio version of generate_stock_recommendation.
+
+    :param client: AsyncOpenAI: The client to call the API with
+    :param headline: The headline of a news article
+    :param company_name: The company to assess
+    :param term: The time frame of the recommendation
+    :return: A recommendation
+    """
+    request = recommendation_request(headline, company_name, term)
+    response = await client.chat.completions.create(**request)
+    result_text = response.choices[0].message.content
+    USAGE.record(MODEL, request["messages"], result_text)
+    return answer_to_recommendation(result_text)
+
+
+def parse_batch_answers(result_text: str, size: int):
+    """
+    The parse_batch_answers function reads the model's JSON reply to a batch prompt.
+    Answers with an unknown id or an invalid value are ignored.
+
+    :param result_text: str: The model's reply
+    :param size: int: The number of items in the batch
+    :return: A dictionary of item id to recommendation
+    """
+    try:
+        answers = json.loads(result_text)["answers"]
+    except (TypeError, ValueError, KeyError):
+        return {}
+
+    recommendations = {}
+    for answer in answers if isinstance(answers, list) else []:
+        if not isinstance(answer, dict):
+            continue
+        item_id = answer.get("id")
+        value = answer.get("answer")
+        if isinstance(item_id, int) and 0 <= item_id < size and value in ANSWER_VALUES:
+            recommendations[item_id] = ANSWER_VALUES[value]
+    return recommendations
+
+
+def generate_stock_recommendations_batch(items: list, term: str):
+    """
+    The generate_stock_recommendations_batch function scores a batch of (headline, company) pairs in one call.
+    Items the model leaves out of its reply are scored one at a time with generate_stock_recommendation.
+
+    :param items: list: (headline, company_name) tuples
+    :param term: str: The time frame of the recommendation
+    :return: A list of recommendations, in the same order as items
+    """
+    client = get_client()
+
+    messages = batch_messages(items, term)
+    try:
+        response = client.chat.completions.create(
+            model=MODEL,
+            response_format={"type": "json_object"},
+            messages=messages,
+            max_tokens=BATCH_TOKENS_PER_ITEM * len(items) + BATCH_TOKENS_PER_ITEM,
+            temperature=0,
+        )
+        result_text = response.choices[0].message.content
+        USAGE.record(MODEL, messages, result_text)
+        recommendations = parse_batch_answers(result_text, len(items))
+    except Exception as e:
+        print(f"Error scoring batch of {len(items)} headlines: {str(e)}")
+        recommendations = {}
+
+    # fall back to one call per item for anything the model dropped
+    return [
+        recommendations[i]
+        if i in recommendations
+        else generate_stock_recommendation(headline, company_name, term)
+        for i, (headline, company_name) in enumerate(items)
+    ]
+
+
+def generate_stock_recommendations(items: list, term: str, batch_size: int = 20):
+    """
+    The generate_stock_recommendations function scores many (headline, company) pairs, batch_size per call.
+
+    :param items: list: (headline, company_name) tuples
+    :param term: str: The time frame of the recommendation
+    :param batch_size: int: The number of pairs sent in each call
+    :return: A list of recommendations, in the same order as items
+    """
+    recommendations = []
+    for start in range(0, len(items), batch_size):
+        recommendations.extend(
+            generate_stock_recommendations_batch(items[start : start + batch_size], term)
+        )
+    return recommendations
@@ -0,0 +1,206 @@
+import asyncio
+import bisect
+import time
+
+from llm_call import async_generate_stock_recommendation
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
+REQUEST_TIMEOUT = 30.0
+MAX_RETRIES = 5
+# seconds before retry n: BACKOFF_BASE * 2^n, at most BACKOFF_CAP
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 10.0
+
+
+class LatencyHistogram:
+    """
+    The LatencyHistogram class counts request latencies in fixed buckets.
+    """
+
+    def __init__(self, buckets: list = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+
+    def summary(self):
+        """
+        The summary function formats the histogram as one line, e.g. "n=12 mean=0.41s <=0.5s:9 <=1.0s:3".
+        """
+        n = sum(self.counts)
+        if not n:
+            return "n=0"
+        labels = [f"<={bound}s" for bound in self.buckets] + [f">{self.buckets[-1]}s"]
+        buckets = " ".join(
+            f"{label}:{count}" for label, count in zip(labels, self.counts) if count
+        )
+        return f"n={n} mean={self.total / n:.2f}s {buckets}"
+
+
+class AdaptiveLimiter:
+    """
+    The AdaptiveLimiter class bounds the number of requests in flight and adjusts the bound AIMD-style:
+    every success adds 1/limit (about +1 per round of requests), a rate-limit response halves it.
+    The requests in flight when the limit is halved were sent at the old rate, so their rate-limit responses
+    are not counted again: at most one decrease per window of requests.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None):
+        """
+        :param initial: int: Requests allowed in flight at the start
+        :param minimum: int: The limit never drops below this
+        :param maximum: int: The limit never grows above this, defaults to 4 times initial
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum if maximum is not None else initial * 4
+        self.in_flight = 0
+        self.peak = 0
+        # requests let through so far, and how many had been when the limit was last halved
+        self.sent = 0
+        self.sent_at_decrease = 0
+        self.decreases = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        """
+        Waits for a slot and returns the request's ticket, to pass to on_rate_limit.
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            self.sent += 1
+            return self.sent
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_rate_limit(self, ticket: int = None):
+        """
+        The on_rate_limit function halves the limit, unless the rate-limited request was sent before the last decrease.
+
+        :param ticket: int: The ticket of the rate-limited request, from entering the limiter
+        :return: True if the limit was halved
+        """
+        if ticket is not None and ticket <= self.sent_at_decrease:
+            return False
+        self.limit = max(self.minimum, self.limit / 2)
+        self.sent_at_decrease = self.sent
+        self.decreases += 1
+        return True
+
+
+class Dispatcher:
+    """
+    The Dispatcher class scores headlines concurrently with AsyncOpenAI.
+    Rate-limited, timed out, unreachable (connection errors) and failed (5xx) requests are retried up to
+    MAX_RETRIES times. A headline that still fails, or fails with any other error, gets None instead of a score,
+    so the caller can score it neutral for this run without caching the failure.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        timeout: float = REQUEST_TIMEOUT,
+        score=async_generate_stock_recommendation,
+    ):
+        """
+        :param concurrency: int: Requests in flight at the start
+        :param timeout: float: Seconds before a request is abandoned
+        :param score: The coroutine function called as score(client, headline, company_name, term)
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.score = score
+        self.histogram = LatencyHistogram()
+        self.rate_limited = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.limiter = None
+
+    async def score_item(self, client, headline: str, company_name: str, term: str):
+        from openai import APIConnectionError, APIStatusError, RateLimitError
+
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.limiter as ticket:
+                start = time.perf_counter()
+                try:
+                    rec = await asyncio.wait_for(
+                        self.score(client, headline, company_name, term), self.timeout
+                    )
+                except RateLimitError:
+                    self.rate_limited += 1
+                    self.limiter.on_rate_limit(ticket)
+                    error = "rate limited"
+                except asyncio.TimeoutError:
+                    self.timed_out += 1
+                    error = "timed out"
+                except APIConnectionError as e:
+                    self.failed += 1
+                    error = str(e)
+                except APIStatusError as e:
+                    self.failed += 1
+                    error = str(e)
+                    if e.status_code < 500:
+                        break
+                except Exception as e:
+                    self.failed += 1
+                    error = str(e)
+                    break
+                else:
+                    self.histogram.record(time.perf_counter() - start)
+                    self.limiter.on_success()
+                    return rec
+            await asyncio.sleep(min(BACKOFF_BASE * 2**attempt, BACKOFF_CAP))
+
+        print(f"Error scoring headline for {company_name}: {error}")
+        return None
+
+    async def score_all(self, items: list, term: str):
+        from openai import AsyncOpenAI
+
+        self.limiter = AdaptiveLimiter(self.concurrency)
+        # retries are handled here so rate limits reach the limiter
+        client = AsyncOpenAI(max_retries=0)
+        try:
+            return await asyncio.gather(
+                *(
+                    self.score_item(client, headline, company_name, term)
+                    for headline, company_name in items
+                )
+            )
+        finally:
+            await client.close()
+
+    def run(self, items: list, term: str):
+        """
+        The run function scores (headline, company) pairs concurrently.
+
+        :param items: list: (headline, company_name) tuples
+        :param term: str: The time frame of the recommendation
+        :return: A list of recommendations, in the same order as items, None for headlines that could not be scored
+        """
+        return list(asyncio.run(self.score_all(items, term)))
+
+    def stats(self):
+        """
+        The stats function formats the concurrency, retry and latency counters for printing.
+        """
+        limit = self.limiter.limit if self.limiter else self.concurrency
+        peak = self.limiter.peak if self.limiter else 0
+        return (
+            f"peak {peak} in flight, final limit {limit:.1f}, "
+            f"{self.rate_limited} rate limited ({self.limiter.decreases if self.limiter else 0} decreases), "
+            f"{self.timed_out} timed out, {self.failed} failed, "
+            f"latency {self.histogram.summary()}"
+        )
@@ -0,0 +1,259 @@
+import math
+import os
+import re
+import time
+
+import numpy as np
+
+from prompts import USAGE
+
+# Local pre-filter in front of the OpenAI scorer. A weighted lexicon scores every headline on the CPU,
+# in microseconds and for free; only the headlines it is unsure about go on to the model. Headlines about
+# scheduling news (conferences, webcasts, earnings dates) are scored neutral without a call, and headlines
+# with clearly positive or negative wording are scored by the sign of their lexicon score. A single term, mixed
+# wording, or a headline matched to more than one company (whose news is it good for?) goes to the model.
+# Run python src/local_scorer.py to compare model-only and pre-filtered scoring against the fake OpenAI server.
+
+# Score headlines with LocalScorer first and only send the uncertain ones to the model
+LOCAL_PREFILTER = os.getenv("LOCAL_PREFILTER", "0") == "1"
+# Headlines whose lexicon confidence is below this are sent to the model
+LOCAL_MIN_CONFIDENCE = float(os.getenv("LOCAL_MIN_CONFIDENCE", "2.0"))
+# Headlines are only scored by their wording with at least this many terms agreeing and none opposing
+LOCAL_MIN_TERMS = int(os.getenv("LOCAL_MIN_TERMS", "2"))
+# Estimates of what one model call costs, used to report what the pre-filter saved when nothing was sent
+REMOTE_CALL_SECONDS = 0.6
+# gpt-3.5-turbo: about 70 prompt tokens at $0.50 and 1 completion token at $1.50 per million
+REMOTE_CALL_COST = 0.000037
+
+POSITIVE_TERMS = {
+    "beat": 2.0,
+    "beats": 2.0,
+    "tops": 2.0,
+    "surge": 2.0,
+    "surges": 2.0,
+    "soar": 2.0,
+    "soars": 2.0,
+    "upgrade": 2.0,
+    "upgraded": 2.0,
+    "upgrades": 2.0,
+    "record high": 2.0,
+    "raises guidance": 2.0,
+    "raises full-year guidance": 2.0,
+    "boosts guidance": 2.0,
+    "buyback": 1.0,
+    "share repurchase": 1.0,
+    "jumps": 1.0,
+    "rallies": 1.0,
+    "rises": 1.0,
+    "gains": 1.0,
+    "wins": 1.0,
+    "approval": 1.0,
+    "approved": 1.0,
+    "outperform": 1.0,
+    "strong": 1.0,
+}
+NEGATIVE_TERMS = {
+    "miss": 2.0,
+    "misses": 2.0,
+    "plunge": 2.0,
+    "plunges": 2.0,
+    "downgrade": 2.0,
+    "downgraded": 2.0,
+    "downgrades": 2.0,
+    "lawsuit": 2.0,
+    "bankruptcy": 2.0,
+    "fraud": 2.0,
+    "recall": 2.0,
+    "cuts guidance": 2.0,
+    "lowers guidance": 2.0,
+    "layoffs": 1.0,
+    "probe": 1.0,
+    "investigation": 1.0,
+    "falls": 1.0,
+    "drops": 1.0,
+    "slumps": 1.0,
+    "tumbles": 1.0,
+    "loss": 1.0,
+    "weak": 1.0,
+    "antitrust": 1.0,
+    "underperform": 1.0,
+}
+# Scheduling news that moves no stock, scored neutral when no positive or negative term is present
+NEUTRAL_TERMS = [
+    "to present at",
+    "to participate in",
+    "investor conference",
+    "conference call",
+    "webcast",
+    "to report",
+    "to announce",
+    "sets date",
+    "schedules",
+    "annual meeting",
+]
+# The confidence of a neutral headline
+NEUTRAL_CONFIDENCE = 2.0
+
+
+def term_pattern(terms):
+    # longest first, so "raises full-year guidance" wins over shorter terms it contains
+    alternatives = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.compile(rf"(?<![\w-])(?:{alternatives})(?![\w-])")
+
+
+class LocalScorer:
+    """
+    The LocalScorer class scores headlines with a weighted lexicon. Every headline gets a recommendation
+    and a confidence: the absolute lexicon score for headlines with at least min_terms positive or negative
+    terms and none of the other kind, NEUTRAL_CONFIDENCE for scheduling news, and 0 for the rest, including
+    every headline matched to more than one company.
+    """
+
+    def __init__(
+        self,
+        positive: dict = POSITIVE_TERMS,
+        negative: dict = NEGATIVE_TERMS,
+        neutral: list = NEUTRAL_TERMS,
+        min_terms: int = LOCAL_MIN_TERMS,
+    ):
+        self.weights = {**positive, **{term: -weight for term, weight in negative.items()}}
+        self.polar = term_pattern(self.weights)
+        self.neutral = term_pattern(neutral)
+        self.min_terms = min_terms
+
+    def score(self, items: list):
+        """
+        The score function scores a batch of (headline, company) pairs.
+
+        :param items: list: (headline, company_name) tuples; a headline listed with several companies is about all of them
+        :return: An int array of recommendations (1, -1 or 0) and a float array of confidences
+        """
+        companies = {}
+        for headline, company_name in items:
+            companies.setdefault(" ".join(headline.lower().split()), set()).add(company_name)
+
+        scores = np.zeros(len(items))
+        agreeing = np.zeros(len(items), dtype=bool)
+        neutral = np.zeros(len(items), dtype=bool)
+        shared = np.zeros(len(items), dtype=bool)
+        for i, (headline, _) in enumerate(items):
+            text = headline.lower()
+            weights = [self.weights[term] for term in self.polar.findall(text)]
+            scores[i] = sum(weights)
+            signs = {weight > 0 for weight in weights}
+            agreeing[i] = len(weights) >= self.min_terms and len(signs) == 1
+            neutral[i] = not weights and self.neutral.search(text) is not None
+            shared[i] = len(companies[" ".join(text.split())]) > 1
+        confidence = np.where(neutral, NEUTRAL_CONFIDENCE, np.where(agreeing, np.abs(scores), 0.0))
+        confidence[shared] = 0.0
+        recommendations = np.where(agreeing, np.sign(scores), 0).astype(int)
+        return recommendations, confidence
+
+
+class PrefilterScorer:
+    """
+    The PrefilterScorer class scores headlines locally and sends only the uncertain ones to a remote scorer,
+    keeping count of the model calls, time and money that saved.
+    """
+
+    def __init__(
+        self,
+        remote,
+        local: LocalScorer = None,
+        min_confidence: float = LOCAL_MIN_CONFIDENCE,
+        batch_size: int = 0,
+    ):
+        """
+        :param remote: The scorer of uncertain headlines, called as remote(items, term), e.g. generate_stock_recommendations
+        :param local: LocalScorer: The local scorer, defaults to the built-in lexicon
+        :param min_confidence: float: Headlines with a lower local confidence go to the remote scorer
+        :param batch_size: int: The number of headlines per remote call, 0 for one call per headline
+        """
+        self.remote = remote
+        self.local = local or LocalScorer()
+        self.min_confidence = min_confidence
+        self.batch_size = batch_size
+        self.headlines = 0
+        self.escalated = 0
+        self.local_seconds = 0.0
+        self.remote_seconds = 0.0
+
+    def calls(self, headlines: int):
+        return math.ceil(headlines / self.batch_size) if self.batch_size else headlines
+
+    def score(self, items: list, term: str):
+        """
+        The score function scores (headline, company) pairs, locally where the lexicon is confident.
+
+        :param items: list: (headline, company_name) tuples
+        :param term: str: The time frame of the recommendation
+        :return: A list of recommendations in the same order as items, and a list telling which came from the remote scorer
+        """
+        start = time.perf_counter()
+        recommendations, confidence = self.local.score(items)
+        escalate = confidence < self.min_confidence
+        self.local_seconds += time.perf_counter() - start
+
+        uncertain = [item for item, sent in zip(items, escalate) if sent]
+        if uncertain:
+            start = time.perf_counter()
+            recommendations[escalate] = self.remote(uncertain, term)
+            self.remote_seconds += time.perf_counter() - start
+        self.headlines += len(items)
+        self.escalated += len(uncertain)
+        return recommendations.tolist(), escalate.tolist()
+
+    def stats(self):
+        """
+        The stats function formats what the pre-filter saved, e.g. "412 of 500 headlines scored locally in 3 ms,
+        41 of 50 model calls avoided, about 24.6s and $0.0023 saved". The time and cost of a call are measured on
+        the calls made; with none, REMOTE_CALL_SECONDS and REMOTE_CALL_COST are assumed, and so is the cost
+        when the model has no price.
+        """
+        calls = self.calls(self.headlines)
+        made = self.calls(self.escalated)
+        per_call = self.remote_seconds / made if made else REMOTE_CALL_SECONDS
+        cost_per_call = USAGE.cost_per_call()
+        if cost_per_call is None:
+            cost_per_call = REMOTE_CALL_COST
+        avoided = calls - made
+        return (
+            f"{self.headlines - self.escalated} of {self.headlines} headlines scored locally in "
+            f"{self.local_seconds * 1000:.0f} ms, {avoided} of {calls} model calls avoided, "
+            f"about {avoided * per_call - self.local_seconds:.1f}s and ${avoided * cost_per_call:.4f} saved"
+        )
+
+
+if __name__ == "__main__":
+    import random
+
+    from fake_news import COMPANIES, EVENTS
+    from fake_openai import start_fake_openai
+
+    server = start_fake_openai(latency=0.02)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+    from llm_call import generate_stock_recommendation
+
+    events = EVENTS + ["shares rise after product launch", "names new CFO", "expands into Europe", "stock falls on weak demand"]
+    rng = random.Random(0)
+    items = [(f"{rng.choice(COMPANIES)} {rng.choice(events)} (story {i})", "Company") for i in range(300)]
+
+    def remote(items, term):
+        return [generate_stock_recommendation(headline, company_name, term) for headline, company_name in items]
+
+    start_time = time.perf_counter()
+    expected = remote(items, "short")
+    print(f"model only: {len(items)} calls in {time.perf_counter() - start_time:.1f}s")
+
+    calls_before = len(server.requests)
+    scorer = PrefilterScorer(remote)
+    start_time = time.perf_counter()
+    recommendations, escalated = scorer.score(items, "short")
+    print(f"pre-filtered: {len(server.requests) - calls_before} calls in {time.perf_counter() - start_time:.1f}s")
+    print(scorer.stats())
+    kept = [i for i, sent in enumerate(escalated) if not sent]
+    agree = sum(recommendations[i] == expected[i] for i in kept)
+    # the fake server answers from a few keywords of its own, a real model disagrees differently
+    print(f"local scores agree with the fake model on {agree} of {len(kept)} headlines")
@@ -0,0 +1,211 @@
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from trading_calendar import get_calendar
+
+# Vectorized conversions to New York time and trading-category assignment.
+# Run python src/market_time.py to benchmark against the per-row conversion on a million headlines.
+
+EASTERN = "America/New_York"
+
+# Trading categories of a day, in New York wall time:
+# 1 is pre-market (midnight to 11:30), 2 is market hours (11:30 to the close), 3 is after hours (close to midnight)
+MORNING_CUTOFF = pd.Timedelta(hours=11, minutes=30)
+REGULAR_CLOSE = pd.Timedelta(hours=16)
+
+
+def epochs_to_eastern(epochs: pd.Series):
+    """
+    The epochs_to_eastern function converts unix epoch seconds to New York timestamps, DST aware.
+
+    :param epochs: pd.Series: Epoch seconds
+    :return: A series of tz-aware America/New_York timestamps
+    """
+    return pd.to_datetime(epochs, unit="s", utc=True).dt.tz_convert(EASTERN)
+
+
+def iso_to_eastern(texts: pd.Series):
+    """
+    The iso_to_eastern function parses ISO 8601 datetimes with an offset or Z suffix to New York timestamps.
+    Missing or malformed values become NaT.
+
+    :param texts: pd.Series: Datetime strings like 2024-01-02T14:00:00Z
+    :return: A series of tz-aware America/New_York timestamps
+    """
+    return pd.to_datetime(texts, utc=True, errors="coerce", format="ISO8601").dt.tz_convert(EASTERN)
+
+
+def as_eastern(datetimes: pd.Series):
+    """
+    The as_eastern function converts datetimes to New York time, reading naive datetimes as New York wall time.
+
+    :param datetimes: pd.Series: Naive or tz-aware datetimes
+    :return: A series of tz-aware America/New_York timestamps
+    """
+    datetimes = pd.to_datetime(datetimes)
+    if datetimes.dt.tz is None:
+        return datetimes.dt.tz_localize(EASTERN, ambiguous="NaT", nonexistent="shift_forward")
+    return datetimes.dt.tz_convert(EASTERN)
+
+
+def to_eastern(value):
+    """
+    The to_eastern function is the scalar version of as_eastern.
+
+    :param value: A datetime, timestamp or datetime string
+    :return: A tz-aware America/New_York pd.Timestamp
+    """
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize(EASTERN, ambiguous=False, nonexistent="shift_forward")
+    return timestamp.tz_convert(EASTERN)
+
+
+def now_eastern():
+    return pd.Timestamp.now(tz=EASTERN)
+
+
+@lru_cache(maxsize=16)
+def market_closes(year: int):
+    """
+    The market_closes function reads the closing time of every trading day of a year from the trading calendar.
+
+    :param year: int: The year
+    :return: A dictionary from date to the close as a time of day offset, early closes included
+    """
+    closes = get_calendar().closes_by_day(year)
+    local = pd.to_datetime(list(closes.values()), unit="s", utc=True).tz_convert(EASTERN).tz_localize(None)
+    return {
+        date.fromisoformat(day): close - close.normalize()
+        for day, close in zip(closes, local)
+    }
+
+
+def category_boundaries(
+    first_day: date, last_day: date, unit: str = "ns", morning_cutoff: pd.Timedelta = MORNING_CUTOFF
+):
+    """
+    The category_boundaries function lists where each trading category starts, for every day of a range.
+    The afternoon category ends at the exchange close, which is earlier on half days; days without a
+    session (weekends, holidays) use the regular close.
+
+    :param first_day: date: The first day of the range
+    :param last_day: date: The last day of the range
+    :param unit: str: The resolution of the boundaries, e.g. "s" or "ns"
+    :param morning_cutoff: pd.Timedelta: When the pre-market category ends, as a time of day
+    :return: A sorted int64 array of UTC epoch boundaries in that unit and the int8 category starting at each
+    """
+    days = pd.date_range(first_day, last_day, freq="D")
+    closes = {}
+    for year in range(first_day.year, last_day.year + 1):
+        closes.update(market_closes(year))
+    close_offsets = pd.to_timedelta(
+        [closes.get(day.date(), REGULAR_CLOSE) for day in days]
+    )
+    # boundaries are built in wall time and localized, so they stay put across DST changes
+    wall = np.concatenate(
+        [
+            days.to_numpy(),
+            (days + morning_cutoff).to_numpy(),
+            (days + close_offsets).to_numpy(),
+        ]
+    )
+    categories = np.repeat(np.array([1, 2, 3], dtype=np.int8), len(days))
+    boundaries = (
+        pd.DatetimeIndex(wall)
+        .tz_localize(EASTERN, ambiguous=False, nonexistent="shift_forward")
+        .as_unit(unit)
+        .asi8
+    )
+    order = np.argsort(boundaries, kind="stable")
+    return boundaries[order], categories[order]
+
+
+def trading_categories(datetimes: pd.Series):
+    """
+    The trading_categories function assigns the trading category of every datetime with one searchsorted
+    over the category boundaries of the days covered.
+
+    :param datetimes: pd.Series: tz-aware datetimes
+    :return: An int8 array of categories, 0 where the datetime is missing
+    """
+    datetimes = as_eastern(datetimes)
+    result = np.zeros(len(datetimes), dtype=np.int8)
+    valid = datetimes.notna().to_numpy()
+    if not valid.any():
+        return result
+    values = datetimes[valid].array
+    epochs = values.asi8
+    boundaries, categories = category_boundaries(
+        values.min().date(), values.max().date(), values.unit
+    )
+    positions = np.searchsorted(boundaries, epochs, side="right")
+    result[valid] = categories[positions - 1]
+    return result
+
+
+def trading_category(timestamp=None):
+    """
+    The trading_category function is the scalar version of trading_categories.
+
+    :param timestamp: A datetime, naive ones are read as New York time, defaults to now
+    :return: The trading category, 1, 2 or 3
+    """
+    timestamp = now_eastern() if timestamp is None else to_eastern(timestamp)
+    return int(trading_categories(pd.Series([timestamp]))[0])
+
+
+def category_window(day: date, category: int):
+    """
+    The category_window function returns when a trading category starts and ends on a day.
+
+    :param day: date: The day
+    :param category: int: The trading category
+    :return: The tz-aware start (inclusive) and end (exclusive) of the window
+    """
+    boundaries, categories = category_boundaries(day, day + pd.Timedelta(days=1))
+    position = int(np.flatnonzero(categories == category)[0])
+    return (
+        pd.Timestamp(boundaries[position], unit="ns", tz="UTC").tz_convert(EASTERN),
+        pd.Timestamp(boundaries[position + 1], unit="ns", tz="UTC").tz_convert(EASTERN),
+    )
+
+
+if __name__ == "__main__":
+    import time
+    from datetime import datetime, timedelta
+
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2024-01-01", tz="UTC").value // 10**9
+    end = pd.Timestamp("2025-01-01", tz="UTC").value // 10**9
+    epochs = pd.Series(rng.integers(start, end, 1_000_000))
+
+    # the previous approach: one Python call per row with a fixed -5h offset, then time-of-day comparisons
+    start_time = time.time()
+    fixed = epochs.apply(lambda e: datetime.utcfromtimestamp(e) - timedelta(hours=5))
+    times = fixed.dt.time
+    old = np.select(
+        [
+            times <= datetime.strptime("11:30:00", "%H:%M:%S").time(),
+            times <= datetime.strptime("16:00:00", "%H:%M:%S").time(),
+        ],
+        [1, 2],
+        3,
+    )
+    old_elapsed = time.time() - start_time
+
+    # load the exchange calendar outside the timing, it is read once per process
+    market_closes(2023)
+    market_closes(2024)
+    start_time = time.time()
+    eastern = epochs_to_eastern(epochs)
+    new = trading_categories(eastern)
+    new_elapsed = time.time() - start_time
+
+    moved_dates = (fixed.dt.date != eastern.dt.date).sum()
+    print(f"per-row fixed offset: {old_elapsed:.2f} seconds for {len(epochs)} headlines")
+    print(f"vectorized New York time: {new_elapsed:.2f} seconds ({old_elapsed / new_elapsed:.0f}x)")
+    print(f"{(old != new).sum()} categories and {moved_dates} dates differ (DST and early closes)")
@@ -0,0 +1,301 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from rate_limit import TokenBucket
+
+# Concurrent order submission for execute_trades. Orders go out from a thread pool under a token bucket,
+# each with a client order id derived from the session, day, ticker and side, so a retried or re-run
+# submission finds the order already placed instead of placing it twice. Fills are polled on a background
+# thread while the remaining orders are still being submitted.
+# Run python src/fake_alpaca.py to compare serial and concurrent submission against the local fake broker.
+
+# Alpaca allows 200 trading API requests per minute per account
+ALPACA_REQUESTS_PER_MINUTE = float(os.getenv("ALPACA_REQUESTS_PER_MINUTE", "200"))
+ORDER_BURST = 20
+ORDER_WORKERS = int(os.getenv("ORDER_WORKERS", "8"))
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+# Seconds to keep polling for fills once every order is submitted, and between polls
+FILL_TIMEOUT = float(os.getenv("FILL_TIMEOUT", "30"))
+FILL_POLL_SECONDS = 1.0
+CLIENT_ORDER_ID_PREFIX = "llmt"
+
+# Order statuses after which an order does not change any more
+FINAL_STATUSES = {"filled", "canceled", "expired", "rejected", "replaced", "done_for_day"}
+
+REPORT_COLUMNS = [
+    "ticker",
+    "side",
+    "qty",
+    "client_order_id",
+    "order_id",
+    "status",
+    "attempts",
+    "queued_seconds",
+    "submit_latency",
+    "filled_qty",
+    "filled_avg_price",
+    "fill_seconds",
+    "error",
+]
+
+
+def client_order_id(session: str, day: str, ticker: str, side: str, leg: str = ""):
+    """
+    The client_order_id function derives the client order id of a trade. The same trade of the same session
+    always gets the same id, which Alpaca refuses to accept twice.
+
+    :param session: str: The trading session, morning or afternoon
+    :param day: str: The trading day, e.g. 2024-01-02
+    :param ticker: str: The ticker
+    :param side: str: buy or sell
+    :param leg: str: Tells apart several orders of the same ticker and side in a session, e.g. "close" and "open"
+    :return: An id like llmt-2024-01-02-morning-AAPL-buy-1a2b3c4d, at most 128 characters
+    """
+    session = f"{session}-{leg}" if leg else session
+    digest = hashlib.sha1(f"{session}|{day}|{ticker}|{side}".encode()).hexdigest()[:8]
+    return f"{CLIENT_ORDER_ID_PREFIX}-{day}-{session}-{ticker}-{side}-{digest}"[:128]
+
+
+def status_code(error: Exception):
+    """
+    The status_code function returns the HTTP status of an Alpaca API error, or None for connection errors.
+    """
+    code = getattr(error, "status_code", None)
+    if code is None:
+        response = getattr(error, "response", None)
+        code = getattr(response, "status_code", None)
+    return code
+
+
+def is_duplicate(error: Exception):
+    return status_code(error) == 422 and "client_order_id" in str(error).lower()
+
+
+def is_retryable(error: Exception):
+    # a connection error may have lost the acknowledgement of an order that was placed, the retry finds it
+    code = status_code(error)
+    return code is None or code == 429 or code >= 500
+
+
+def parse_time(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value
+    return pd.Timestamp(value).to_pydatetime()
+
+
+class OrderExecutor:
+    """
+    The OrderExecutor class submits market orders concurrently under a rate cap and tracks their fills.
+    """
+
+    def __init__(
+        self,
+        api,
+        rate: float = ALPACA_REQUESTS_PER_MINUTE / 60,
+        capacity: float = ORDER_BURST,
+        max_workers: int = ORDER_WORKERS,
+        fill_timeout: float = FILL_TIMEOUT,
+        poll_seconds: float = FILL_POLL_SECONDS,
+    ):
+        """
+        :param api: An alpaca_trade_api.REST compatible client
+        :param rate: float: Requests per second allowed, shared by submissions and fill polls
+        :param capacity: float: Burst size allowed
+        :param max_workers: int: The maximum number of submissions in flight
+        :param fill_timeout: float: Seconds to wait for fills after the last submission, 0 to skip fill tracking
+        :param poll_seconds: float: Seconds between fill polls
+        """
+        self.api = api
+        self.bucket = TokenBucket(rate, capacity)
+        self.max_workers = max_workers
+        self.fill_timeout = fill_timeout
+        self.poll_seconds = poll_seconds
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def submit(self, order: dict, started: float):
+        """
+        The submit function places one order, retrying transient errors with the same client order id.
+        A duplicate client order id means an earlier attempt or run placed the order, which is then looked up.
+
+        :param order: dict: ticker, side, qty and client_order_id of the order
+        :param started: float: perf_counter time the batch started, to report how long the order was queued
+        :return: A result dict with the REPORT_COLUMNS keys
+        """
+        result = {
+            **{column: None for column in REPORT_COLUMNS},
+            **order,
+            "status": "error",
+            "attempts": 0,
+        }
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.acquire()
+            if result["queued_seconds"] is None:
+                result["queued_seconds"] = time.perf_counter() - started
+            result["attempts"] += 1
+            call_start = time.perf_counter()
+            try:
+                placed = self.api.submit_order(
+                    symbol=order["ticker"],
+                    qty=order["qty"],
+                    side=order["side"],
+                    type="market",
+                    time_in_force="day",
+                    client_order_id=order["client_order_id"],
+                )
+            except Exception as e:
+                if is_duplicate(e):
+                    self.bucket.acquire()
+                    try:
+                        placed = self.api.get_order_by_client_order_id(order["client_order_id"])
+                    except Exception as lookup_error:
+                        result["error"] = str(lookup_error)
+                        break
+                else:
+                    result["error"] = str(e)
+                    if is_retryable(e) and attempt < MAX_RETRIES:
+                        time.sleep(BACKOFF_BASE * 2**attempt * random.uniform(0.5, 1.0))
+                        continue
+                    break
+            result["submit_latency"] = time.perf_counter() - call_start
+            result["error"] = None
+            self.update(result, placed)
+            break
+        return result
+
+    def update(self, result: dict, placed):
+        """
+        The update function copies the id, status and fill of an Alpaca order into a result.
+        """
+        result["order_id"] = placed.id
+        result["status"] = placed.status
+        filled_qty = getattr(placed, "filled_qty", None)
+        result["filled_qty"] = float(filled_qty) if filled_qty not in (None, "") else 0.0
+        price = getattr(placed, "filled_avg_price", None)
+        result["filled_avg_price"] = float(price) if price not in (None, "") else None
+        submitted_at = parse_time(getattr(placed, "submitted_at", None))
+        filled_at = parse_time(getattr(placed, "filled_at", None))
+        if submitted_at is not None and filled_at is not None:
+            result["fill_seconds"] = (filled_at - submitted_at).total_seconds()
+
+    def poll_fills(self, after: str):
+        """
+        The poll_fills function lists the orders placed since the batch started, one request for all of them,
+        and updates the results of those not final yet.
+
+        :return: True if every submitted order is final
+        """
+        with self.lock:
+            pending = {
+                result["client_order_id"]: result
+                for result in self.results.values()
+                if result["order_id"] is not None and result["status"] not in FINAL_STATUSES
+            }
+        if not pending:
+            return True
+        self.bucket.acquire()
+        try:
+            orders = self.api.list_orders(status="all", after=after, limit=500, direction="asc")
+        except Exception as e:
+            print(f"Error polling order fills: {str(e)}")
+            return False
+        with self.lock:
+            for placed in orders:
+                result = pending.get(placed.client_order_id)
+                if result is not None:
+                    self.update(result, placed)
+            return all(result["status"] in FINAL_STATUSES for result in pending.values())
+
+    def track_fills(self, after: str, submitted: threading.Event):
+        """
+        The track_fills function polls fills until every order is final, or until fill_timeout
+        seconds after the last submission.
+        """
+        deadline = None
+        while True:
+            all_final = self.poll_fills(after)
+            if submitted.is_set():
+                if all_final:
+                    return
+                deadline = deadline or time.monotonic() + self.fill_timeout
+                if time.monotonic() >= deadline:
+                    return
+            time.sleep(self.poll_seconds)
+
+    def execute(self, orders_df: pd.DataFrame, session: str, day: str):
+        """
+        The execute function submits a batch of market orders and waits for their fills.
+
+        :param orders_df: pd.DataFrame: Orders with the following columns: ticker, side, num_shares and optionally leg
+        :param session: str: The trading session, morning or afternoon
+        :param day: str: The trading day, e.g. 2024-01-02
+        :return: A report dataframe with the REPORT_COLUMNS columns, one row per order in orders_df order
+        """
+        legs = orders_df["leg"] if "leg" in orders_df else [""] * len(orders_df)
+        orders = [
+            {
+                "ticker": ticker,
+                "side": side,
+                "qty": float(qty),
+                "client_order_id": client_order_id(session, day, ticker, side, leg),
+            }
+            for ticker, side, qty, leg in zip(
+                orders_df["ticker"], orders_df["side"], orders_df["num_shares"], legs
+            )
+        ]
+        # a minute of slack, broker and local clocks differ
+        after = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+        started = time.perf_counter()
+        self.results = {}
+
+        submitted = threading.Event()
+        tracker = None
+        if self.fill_timeout > 0:
+            tracker = threading.Thread(target=self.track_fills, args=(after, submitted), daemon=True)
+            tracker.start()
+
+        def submit(order):
+            result = self.submit(order, started)
+            with self.lock:
+                self.results[order["client_order_id"]] = result
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(submit, orders))
+        submitted.set()
+        if tracker is not None:
+            tracker.join()
+
+        with self.lock:
+            report = pd.DataFrame(
+                [self.results[order["client_order_id"]] for order in orders], columns=REPORT_COLUMNS
+            )
+        report.attrs["elapsed"] = time.perf_counter() - started
+        return report
+
+
+def summarize(report: pd.DataFrame):
+    """
+    The summarize function formats an execution report as one line, e.g.
+    "45 orders in 2.1s: 44 accepted, 40 filled, 1 failed, submit latency p50 0.12s p95 0.31s".
+    """
+    accepted = report["order_id"].notna()
+    latency = report.loc[accepted, "submit_latency"].astype(float)
+    line = (
+        f"{len(report)} orders in {report.attrs.get('elapsed', 0.0):.1f}s: "
+        f"{int(accepted.sum())} accepted, {int((report['status'] == 'filled').sum())} filled, "
+        f"{int((~accepted).sum())} failed"
+    )
+    if len(latency):
+        line += f", submit latency p50 {latency.quantile(0.5):.2f}s p95 {latency.quantile(0.95):.2f}s"
+    return line
@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Pure, vectorized position sizing. size_positions takes the trades, their prices and the buying power and
+# returns share quantities without touching any global state; how the budget is spread over the fractional
+# buys is decided by an allocation model. Run python src/position_sizer.py to time it on 5000 tickers.
+
+# Allocation model of execute_trades: equal, sentiment or volatility
+POSITION_SIZING = os.getenv("POSITION_SIZING", "equal")
+
+
+def equal_weights(trades_df: pd.DataFrame, volatility: np.ndarray = None):
+    """
+    The equal_weights function gives every trade the same share of the budget.
+    """
+    return np.ones(len(trades_df))
+
+
+def sentiment_weights(trades_df: pd.DataFrame, volatility: np.ndarray = None):
+    """
+    The sentiment_weights function spreads the budget in proportion to the strength of each trade's recommendation.
+    Trades without a recommendation get the average weight.
+    """
+    if "recommendation" not in trades_df:
+        return equal_weights(trades_df)
+    weights = np.abs(trades_df["recommendation"].to_numpy(dtype=float))
+    fallback = np.nanmean(weights) if np.isfinite(weights).any() else 1.0
+    return np.where(np.isfinite(weights), weights, fallback)
+
+
+def volatility_weights(trades_df: pd.DataFrame, volatility: np.ndarray = None):
+    """
+    The volatility_weights function spreads the budget in inverse proportion to each ticker's volatility,
+    so every position carries about the same risk. Tickers without a volatility get the median one.
+    """
+    if volatility is None:
+        return equal_weights(trades_df)
+    volatility = np.asarray(volatility, dtype=float)
+    usable = np.isfinite(volatility) & (volatility > 0)
+    if not usable.any():
+        return equal_weights(trades_df)
+    volatility = np.where(usable, volatility, np.median(volatility[usable]))
+    return 1.0 / volatility
+
+
+ALLOCATION_MODELS = {
+    "equal": equal_weights,
+    "sentiment": sentiment_weights,
+    "volatility": volatility_weights,
+}
+
+
+def size_positions(
+    trades_df: pd.DataFrame,
+    prices,
+    buying_power: float,
+    model: str = POSITION_SIZING,
+    volatility=None,
+):
+    """
+    The size_positions function computes the number of shares of every trade.
+    Sells and buys of non-fractionable assets get one share when its price fits in an equal slice of the
+    buying power, and are dropped otherwise. What is left of the buying power is spread over the buys of
+    fractionable assets according to the allocation model. Trades without a price, or of assets whose
+    fractionable flag is unknown, are dropped on both sides.
+
+    :param trades_df: pd.DataFrame: Trades with the following columns: ticker, side, fractionable and
+        optionally recommendation
+    :param prices: Last trade prices, aligned with the rows of trades_df
+    :param buying_power: float: The budget of the trades
+    :param model: str: The allocation model, a key of ALLOCATION_MODELS
+    :param volatility: Volatilities aligned with the rows of trades_df, used by the volatility model
+    :return: The sized trades, the columns of trades_df plus num_shares, whole-share trades first
+    """
+    if model not in ALLOCATION_MODELS:
+        raise ValueError(f"Unknown allocation model {model}, expected one of {', '.join(ALLOCATION_MODELS)}")
+    if trades_df.empty:
+        return trades_df.assign(num_shares=pd.Series(dtype=float))
+
+    prices = np.asarray(prices, dtype=float)
+    priced = np.isfinite(prices) & (prices > 0)
+    # unknown assets are neither, and dropped
+    fractionable = trades_df["fractionable"].eq(True).to_numpy()
+    non_fractionable = trades_df["fractionable"].eq(False).to_numpy()
+    known = fractionable | non_fractionable
+    is_buy = trades_df["side"].eq("buy").to_numpy()
+    is_sell = trades_df["side"].eq("sell").to_numpy()
+
+    # whole shares: one each, if the price fits in an equal slice of the budget
+    per_trade = buying_power / len(trades_df)
+    whole = (is_sell | non_fractionable) & known & priced & (prices <= per_trade)
+    fractional = is_buy & fractionable & priced
+
+    remaining = buying_power - prices[whole].sum()
+    num_shares = np.where(whole, 1.0, np.nan)
+    if fractional.any() and remaining > 0:
+        weights = ALLOCATION_MODELS[model](
+            trades_df[fractional],
+            None if volatility is None else np.asarray(volatility, dtype=float)[fractional],
+        )
+        weights = weights / weights.sum() if weights.sum() > 0 else np.full(len(weights), 1.0 / len(weights))
+        num_shares[fractional] = remaining * weights / prices[fractional]
+
+    sized = trades_df.assign(num_shares=num_shares)
+    order = np.concatenate([np.flatnonzero(whole), np.flatnonzero(fractional)])
+    return sized.iloc[order].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 5000
+    trades_df = pd.DataFrame(
+        {
+            "ticker": [f"T{i:04d}" for i in range(n)],
+            "side": rng.choice(["buy", "sell"], n, p=[0.7, 0.3]),
+            "fractionable": rng.random(n) < 0.8,
+            "recommendation": rng.uniform(-1, 1, n),
+        }
+    )
+    prices = rng.lognormal(3, 1, n)
+    volatility = rng.uniform(0.01, 0.05, n)
+
+    for model in ALLOCATION_MODELS:
+        start_time = time.perf_counter()
+        sized = size_positions(trades_df, prices, 1_000_000.0, model, volatility)
+        elapsed = time.perf_counter() - start_time
+        spent = (sized["num_shares"] * pd.Series(prices, index=trades_df["ticker"])[sized["ticker"]].to_numpy()).sum()
+        print(f"{model}: {len(sized)} of {n} trades sized in {elapsed * 1000:.1f} ms, ${spent:,.0f} allocated")
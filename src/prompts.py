@@ -0,0 +1,223 @@
+import json
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Prompts of the recommendation calls, and local token accounting of every call made with them.
+# The single-headline prompt asks for one word and the call is capped at one completion token, biased
+# toward the first token of each allowed answer when tiktoken is installed. Without tiktoken, tokens are
+# estimated from the length of the text.
+
+# Bump when the prompts change so cached answers from older prompts are not reused
+PROMPT_VERSION = 2
+
+SYSTEM_PROMPT = (
+    "You are a financial expert with stock recommendation experience. "
+    "Answer YES if a headline is good news for the stock price of the company, NO if it is bad news, "
+    "UNKNOWN if uncertain."
+)
+USER_TEMPLATE = "Company: {company_name}\nTerm: {term}\nHeadline: {headline}"
+BATCH_TEMPLATE = (
+    'Answer every item. Reply with JSON: {{"answers": [{{"id": <id>, "answer": "YES" | "NO" | "UNKNOWN"}}]}}\n'
+    "Term: {term}\n{items}"
+)
+
+ANSWER_VALUES = {"YES": 1, "NO": -1, "UNKNOWN": 0}
+# A one-token completion of UNKNOWN is cut short, any prefix of an answer counts as that answer
+ANSWER_MAX_TOKENS = 1
+# Upper bound of the completion tokens of one batch item like {"id": 12, "answer": "UNKNOWN"}
+BATCH_TOKENS_PER_ITEM = 16
+
+# USD per million prompt and completion tokens
+MODEL_PRICES = {"gpt-3.5-turbo": (0.50, 1.50)}
+# chat format overhead: every message is wrapped in a few tokens, and the reply is primed with three
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+# used without tiktoken
+CHARS_PER_TOKEN = 4
+
+_encodings = {}
+
+
+def get_encoding(model: str):
+    """
+    The get_encoding function returns the tiktoken encoding of a model, or None without tiktoken.
+    """
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str):
+    """
+    The count_tokens function counts the tokens of a text, exactly with tiktoken and estimated otherwise.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages: list, model: str):
+    """
+    The count_message_tokens function counts the prompt tokens of a list of chat messages.
+    """
+    return TOKENS_PER_REPLY + sum(
+        TOKENS_PER_MESSAGE + count_tokens(message["content"], model) for message in messages
+    )
+
+
+def recommendation_messages(headline: str, company_name: str, term: str):
+    """
+    The recommendation_messages function builds the chat messages asking about a single headline.
+
+    :param headline: The headline of a news article
+    :param company_name: The company to assess
+    :param term: The time frame of the recommendation
+    :return: A list of chat messages
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_TEMPLATE.format(company_name=company_name, term=term, headline=headline)},
+    ]
+
+
+def batch_messages(items: list, term: str):
+    """
+    The batch_messages function builds the chat messages asking about several (headline, company) pairs.
+    The pairs are sent as a JSON list on the last line so every answer can be matched back by id.
+
+    :param items: list: (headline, company_name) tuples
+    :param term: str: The time frame of the recommendation
+    :return: A list of chat messages
+    """
+    pairs = [
+        {"id": i, "company": company_name, "headline": headline}
+        for i, (headline, company_name) in enumerate(items)
+    ]
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": BATCH_TEMPLATE.format(term=term, items=json.dumps(pairs))},
+    ]
+
+
+def answer_logit_bias(model: str):
+    """
+    The answer_logit_bias function makes the first token of every answer the only likely completion.
+
+    :return: A logit_bias dictionary of token id to bias, empty without tiktoken
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return {}
+    return {str(encoding.encode(answer)[0]): 100 for answer in ANSWER_VALUES}
+
+
+def answer_to_recommendation(answer: str):
+    """
+    The answer_to_recommendation function converts the model's answer to a recommendation.
+    The answer may be cut short by the one-token limit, so prefixes of YES and NO count too.
+
+    :param answer: str: The model's answer, YES, NO or UNKNOWN
+    :return: 1 for YES, -1 for NO and 0 for anything else
+    """
+    answer = (answer or "").strip().strip(".'\"").upper()
+    if not answer:
+        return 0
+    if answer in ANSWER_VALUES:
+        return ANSWER_VALUES[answer]
+    matches = {value for word, value in ANSWER_VALUES.items() if word.startswith(answer)}
+    return matches.pop() if len(matches) == 1 else 0
+
+
+class TokenUsage:
+    """
+    The TokenUsage class adds up the tokens of the model calls of a run, counted locally.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        # models called without a price in MODEL_PRICES, their calls have no cost
+        self.unpriced = set()
+
+    def record(self, model: str, messages: list, completion: str):
+        """
+        The record function counts the tokens of one call.
+
+        :param model: str: The model called
+        :param messages: list: The chat messages sent
+        :param completion: str: The reply
+        :return: The prompt tokens, completion tokens and cost of the call, None if the model has no price
+        """
+        prompt_tokens = count_message_tokens(messages, model)
+        completion_tokens = count_tokens(completion or "", model)
+        cost = None
+        if model in MODEL_PRICES:
+            prompt_price, completion_price = MODEL_PRICES[model]
+            cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if cost is not None:
+                self.cost += cost
+            elif model not in self.unpriced:
+                self.unpriced.add(model)
+                print(f"Warning: no price for model {model} in MODEL_PRICES, its calls are not costed")
+        return prompt_tokens, completion_tokens, cost
+
+    def cost_per_call(self):
+        """
+        The cost_per_call function returns the average cost of the calls so far, in USD.
+
+        :return: The cost per call, or None before the first call or if a model called has no price
+        """
+        with self.lock:
+            if not self.calls or self.unpriced:
+                return None
+            return self.cost / self.calls
+
+    def summary(self):
+        """
+        The summary function formats the totals as one line, e.g.
+        "40 calls, 2480 prompt + 40 completion tokens, about $0.0013".
+        """
+        estimated = "" if tiktoken is not None else " (estimated)"
+        if self.unpriced:
+            cost = f"cost unknown, no price for {', '.join(sorted(self.unpriced))}"
+        else:
+            cost = f"about ${self.cost:.4f}"
+        return (
+            f"{self.calls} calls, {self.prompt_tokens} prompt + {self.completion_tokens} completion tokens{estimated}, "
+            f"{cost}"
+        )
+
+
+# Token usage of every call of the run
+USAGE = TokenUsage()
+
+
+if __name__ == "__main__":
+    model = "gpt-3.5-turbo"
+    headline = "Apple beats quarterly earnings estimates as iPhone sales rise"
+    single = count_message_tokens(recommendation_messages(headline, "Apple", "short"), model)
+    batch = count_message_tokens(batch_messages([(headline, "Apple")] * 20, "short"), model)
+    prompt_price, completion_price = MODEL_PRICES[model]
+    for name, prompt_tokens, completion_tokens, headlines in [
+        ("one headline per call", single, ANSWER_MAX_TOKENS, 1),
+        ("20 headlines per call", batch, BATCH_TOKENS_PER_ITEM * 20, 20),
+    ]:
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6 / headlines
+        print(f"{name}: {prompt_tokens} prompt tokens, at most {completion_tokens} completion tokens, ${cost * 1000:.4f} per 1000 headlines")
@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    The TokenBucket class is a thread-safe token bucket rate limiter.
+    Tokens refill continuously at `rate` per second up to `capacity`, and each request takes one.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        """
+        :param rate: float: Tokens added per second
+        :param capacity: float: Maximum burst size, defaults to one second worth of tokens
+        :param clock: A monotonic clock, replaceable for testing
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """
+        The wait_time function returns how many seconds until a token is available.
+
+        :return: Seconds to wait, 0 if a token is available now
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def try_acquire(self):
+        """
+        The try_acquire function takes a token if one is available without blocking.
+
+        :return: True if a token was taken
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        The acquire function blocks until a token is available and takes it.
+        """
+        while not self.try_acquire():
+            time.sleep(self.wait_time())
+
+    def drain(self, seconds: float):
+        """
+        The drain function empties the bucket and pushes the next refill out by `seconds`.
+        It is used when the server answers with a rate-limit error, since our count was evidently off.
+
+        :param seconds: float: Seconds before the bucket starts refilling
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
@@ -0,0 +1,226 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from order_executor import OrderExecutor, summarize
+
+# Net-delta rebalancing for the afternoon window. Instead of closing every position and opening the new
+# trades from scratch, current positions are read once and only the difference to the target quantity of
+# each ticker is traded. execute_trades writes the diff of every run to REBALANCE_REPORTS_DIR.
+
+REBALANCE_REPORTS_DIR = os.getenv("REBALANCE_REPORTS_DIR", "data/rebalance_reports")
+# Alpaca's smallest fractional order is $1 of notional, smaller adjustments of a held position are skipped
+MIN_ORDER_NOTIONAL = 1.0
+# Quantities closer to zero than this are treated as zero
+QTY_EPSILON = 1e-9
+
+DIFF_COLUMNS = ["ticker", "current_qty", "current_price", "target_qty", "delta", "action", "close_qty", "open_qty"]
+
+
+def current_positions(api):
+    """
+    The current_positions function reads the open positions with one list_positions call.
+
+    :param api: An alpaca_trade_api.REST compatible client
+    :return: A dataframe with the following columns: ticker, current_qty (negative for shorts), current_price
+    """
+    return pd.DataFrame(
+        [
+            {
+                "ticker": position.symbol,
+                "current_qty": float(position.qty),
+                "current_price": float(position.current_price) if position.current_price else np.nan,
+            }
+            for position in api.list_positions()
+        ],
+        columns=["ticker", "current_qty", "current_price"],
+    )
+
+
+def target_positions(trades_df: pd.DataFrame):
+    """
+    The target_positions function turns sized trades into signed target quantities, sells becoming shorts.
+
+    :param trades_df: pd.DataFrame: Trades with the following columns: ticker, side, num_shares
+    :return: A dataframe with the following columns: ticker, target_qty
+    """
+    sign = np.where(trades_df["side"] == "sell", -1.0, 1.0)
+    return pd.DataFrame(
+        {"ticker": trades_df["ticker"].to_numpy(), "target_qty": sign * trades_df["num_shares"].to_numpy(dtype=float)}
+    )
+
+
+def plan_rebalance(positions: pd.DataFrame, targets: pd.DataFrame, min_notional: float = MIN_ORDER_NOTIONAL):
+    """
+    The plan_rebalance function computes the net change of every ticker held or targeted.
+    Tickers held but not targeted are closed. A position that changes sign is closed and re-opened,
+    because an order cannot take a position from long to short. The close leg reduces a position
+    toward zero and the open leg grows it away from zero, so all close legs can go out before the open legs.
+
+    :param positions: pd.DataFrame: From current_positions
+    :param targets: pd.DataFrame: From target_positions
+    :param min_notional: float: Adjustments of a held position worth less than this are skipped
+    :return: A dataframe with the DIFF_COLUMNS columns, action is one of hold, open, close, increase, reduce, flip
+    """
+    diff = positions.merge(targets, on="ticker", how="outer")
+    diff[["current_qty", "target_qty"]] = diff[["current_qty", "target_qty"]].fillna(0.0)
+    current = diff["current_qty"].to_numpy()
+    target = diff["target_qty"].to_numpy()
+    delta = target - current
+
+    held = np.abs(current) > QTY_EPSILON
+    targeted = np.abs(target) > QTY_EPSILON
+    same_side = np.sign(current) == np.sign(target)
+    too_small = (np.abs(delta) * diff["current_price"].fillna(np.inf).to_numpy() < min_notional) | (
+        np.abs(delta) <= QTY_EPSILON
+    )
+    growing = np.abs(target) > np.abs(current)
+
+    action = np.select(
+        [
+            ~held & ~targeted,
+            held & targeted & same_side & too_small,
+            ~held,
+            ~targeted,
+            ~same_side,
+            growing,
+        ],
+        ["hold", "hold", "open", "close", "flip", "increase"],
+        "reduce",
+    )
+    close_qty = np.select(
+        [np.isin(action, ["close", "flip"]), action == "reduce"], [np.abs(current), np.abs(delta)], 0.0
+    )
+    open_qty = np.select(
+        [np.isin(action, ["open", "flip"]), action == "increase"], [np.abs(target), np.abs(delta)], 0.0
+    )
+
+    diff["delta"] = np.where(action == "hold", 0.0, delta)
+    diff["action"] = action
+    diff["close_qty"] = close_qty
+    diff["open_qty"] = open_qty
+    return diff[DIFF_COLUMNS].sort_values("ticker", ignore_index=True)
+
+
+def plan_orders(diff: pd.DataFrame):
+    """
+    The plan_orders function lists the close and open legs of a rebalance as orders.
+
+    :param diff: pd.DataFrame: From plan_rebalance
+    :return: Two dataframes of close and open orders, with the following columns: ticker, side, num_shares, leg
+    """
+    closes = diff[diff["close_qty"] > 0]
+    opens = diff[diff["open_qty"] > 0]
+    close_orders = pd.DataFrame(
+        {
+            "ticker": closes["ticker"],
+            "side": np.where(closes["current_qty"] > 0, "sell", "buy"),
+            "num_shares": closes["close_qty"],
+            "leg": "close",
+        }
+    )
+    open_orders = pd.DataFrame(
+        {
+            "ticker": opens["ticker"],
+            "side": np.where(opens["target_qty"] > 0, "buy", "sell"),
+            "num_shares": opens["open_qty"],
+            "leg": "open",
+        }
+    )
+    return close_orders.reset_index(drop=True), open_orders.reset_index(drop=True)
+
+
+def rebalance(api, trades_df: pd.DataFrame, session: str, day: str, executor: OrderExecutor = None):
+    """
+    The rebalance function moves the account from its current positions to the positions of the trades,
+    sending the close legs first and the open legs once those are done.
+
+    :param api: An alpaca_trade_api.REST compatible client
+    :param trades_df: pd.DataFrame: Sized trades with the following columns: ticker, side, num_shares
+    :param session: str: The trading session
+    :param day: str: The trading day, e.g. 2024-01-02
+    :param executor: OrderExecutor: Submits the orders, defaults to one on api
+    :return: The diff from plan_rebalance with close_status and open_status columns added
+    """
+    executor = executor or OrderExecutor(api)
+    positions = current_positions(api)
+    diff = plan_rebalance(positions, target_positions(trades_df))
+    close_orders, open_orders = plan_orders(diff)
+
+    diff["close_status"] = None
+    diff["open_status"] = None
+    for orders, column in [(close_orders, "close_status"), (open_orders, "open_status")]:
+        if orders.empty:
+            continue
+        report = executor.execute(orders, session, day)
+        for row in report[report["order_id"].isna()].itertuples():
+            print(f"Error executing the {row.side} order for {row.ticker}: {row.error}")
+        print(summarize(report))
+        diff[column] = diff["ticker"].map(dict(zip(report["ticker"], report["status"])))
+
+    # closing everything and re-opening every trade takes one order per position and one per trade
+    naive_orders = int((positions["current_qty"].abs() > QTY_EPSILON).sum() + (trades_df["num_shares"] > 0).sum())
+    orders = len(close_orders) + len(open_orders)
+    print(
+        f"Rebalanced {len(diff)} tickers with {orders} orders, closing and re-opening would have taken "
+        f"{naive_orders} ({naive_orders - orders} avoided)"
+    )
+    diff.attrs["orders"] = orders
+    diff.attrs["naive_orders"] = naive_orders
+    return diff
+
+
+def save_report(diff: pd.DataFrame, session: str, day: str, directory: str = REBALANCE_REPORTS_DIR):
+    """
+    The save_report function writes the diff of a rebalance to <directory>/<day>-<session>.csv.
+
+    :return: The path of the report
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{day}-{session}.csv")
+    diff.to_csv(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from fake_alpaca import start_fake_alpaca
+
+    # yesterday's book: 40 longs and 20 shorts; today's trades keep most of them, flip a few and add some
+    rng = np.random.default_rng(0)
+    held = [f"T{i:03d}" for i in range(60)]
+    new = [f"N{i:03d}" for i in range(10)]
+    positions = {ticker: (10.0 if i < 40 else -1.0) for i, ticker in enumerate(held)}
+    trades_df = pd.DataFrame(
+        {
+            "ticker": held[5:55] + new,
+            "side": ["buy"] * 35 + ["sell"] * 5 + ["buy"] * 3 + ["sell"] * 7 + ["buy"] * 10,
+        }
+    )
+    trades_df["num_shares"] = np.where(
+        trades_df["side"] == "buy", np.round(rng.uniform(9.5, 11.0, len(trades_df)), 3), 1.0
+    )
+
+    for name in ["close and re-open", "net delta"]:
+        server = start_fake_alpaca(
+            assets={ticker: {} for ticker in held + new},
+            prices={ticker: 20.0 for ticker in held + new},
+            positions=positions,
+            order_latency=0.02,
+        )
+        import alpaca_trade_api as tradeapi
+
+        api = tradeapi.REST("fake", "fake", base_url=server.base_url, api_version="v2")
+        executor = OrderExecutor(api, rate=1000, poll_seconds=0.1)
+        if name == "net delta":
+            diff = rebalance(api, trades_df, "afternoon", "2024-01-02", executor)
+            print(diff["action"].value_counts().to_dict())
+            print("Report:", save_report(diff, "afternoon", "2024-01-02", tempfile.mkdtemp()))
+        else:
+            api.close_all_positions()
+            executor.execute(trades_df, "afternoon", "2024-01-02")
+        orders = len(server.state["orders"])
+        book = {s: q for s, q in server.state["positions"].items()}
+        print(f"{name}: {orders} orders, {len(book)} positions afterwards")
@@ -0,0 +1,244 @@
+import csv
+import itertools
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from backtest import (
+    PriceIndex,
+    cached_scores,
+    execution_windows,
+    generate_backtest_trades,
+    get_backtest_scores,
+    load_headlines,
+    simulate_fills,
+    summarize_backtest,
+)
+from columnar_store import ColumnarStore, bar_store, headline_store
+from generate_trades import SENTIMENT_THRESHOLD
+from llm_cache import RecommendationCache
+
+# Parameter sweeps over the offline backtest. The headlines are loaded and scored and the price index is
+# built once, in the parent, and written to Arrow IPC files. Every worker process memory maps those files
+# instead of receiving a pickled copy, so the replay data sits in the page cache once however many workers
+# read it. Each worker replays one combination of knobs at a time and the parent writes every result to
+# the results file as soon as it arrives.
+# Run python src/sweep.py to sweep a synthetic year, serially and in parallel.
+
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", str(os.cpu_count() or 1)))
+SWEEP_RESULTS_FILE = os.getenv("SWEEP_RESULTS_FILE", "data/sweep_results.csv")
+
+KNOBS = ["morning_cutoff", "threshold", "aggregation", "allocation", "buying_power"]
+SUMMARY_COLUMNS = ["windows", "trades", "filled", "pnl", "return_per_window", "turnover", "hit_rate"]
+RESULT_COLUMNS = KNOBS + SUMMARY_COLUMNS + ["morning_pnl", "afternoon_pnl", "seconds"]
+
+# the replay of a worker process, set by load_replay
+_replay = {}
+
+
+def parameter_grid(**knobs):
+    """
+    The parameter_grid function lists every combination of the values of some knobs, e.g.
+    parameter_grid(threshold=[0, 0.5], aggregation=["mean", "last"]) gives four combinations.
+
+    :return: A list of dictionaries of knob to value
+    """
+    names = list(knobs)
+    return [dict(zip(names, values)) for values in itertools.product(*knobs.values())]
+
+
+def write_table(path: str, columns: dict):
+    """
+    The write_table function writes numpy columns to an Arrow IPC file as one record batch,
+    so every column can later be memory mapped as one contiguous array.
+    """
+    table = pa.table({name: pa.array(values) for name, values in columns.items()})
+    with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(len(table), 1))
+
+
+def map_table(path: str):
+    """
+    The map_table function memory maps an Arrow IPC file written by write_table.
+
+    :return: A dictionary of column name to a read-only numpy array backed by the mapped file
+    """
+    table = ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return {
+        name: column.chunk(0).to_numpy(zero_copy_only=True) if column.num_chunks else np.array([])
+        for name, column in zip(table.column_names, table.columns)
+    }
+
+
+def write_replay(directory: str, headlines: pd.DataFrame, prices: PriceIndex):
+    """
+    The write_replay function writes the scored headlines and the price index of a sweep to directory.
+    Tickers are written as their codes in the price index, so the files hold numbers only.
+
+    :param headlines: pd.DataFrame: Scored headlines with ticker, datetime and recommendation columns
+    """
+    scored = headlines[headlines["recommendation"].notna()]
+    write_table(
+        os.path.join(directory, "headlines.arrow"),
+        {
+            "ticker": prices.codes(scored["ticker"].to_numpy()).astype(np.int32),
+            "datetime": scored["datetime"].to_numpy(dtype=np.int64),
+            "recommendation": scored["recommendation"].to_numpy(dtype=float),
+        },
+    )
+    write_table(os.path.join(directory, "prices.arrow"), {"keys": prices.keys, "closes": prices.closes})
+
+
+def load_replay(directory: str, windows: dict):
+    """
+    The load_replay function memory maps the replay written by write_replay. It runs once in every worker process.
+    """
+    headlines = map_table(os.path.join(directory, "headlines.arrow"))
+    prices = map_table(os.path.join(directory, "prices.arrow"))
+    _replay["headlines"] = pd.DataFrame(headlines, copy=False)
+    # the tickers are codes already, the index needs no universe
+    _replay["prices"] = PriceIndex(prices["keys"], prices["closes"], pd.Index([]))
+    _replay["windows"] = windows
+
+
+def replay(params: dict):
+    """
+    The replay function backtests one combination of knobs on the replay of the worker process.
+
+    :param params: dict: Values of some of the KNOBS, the others keep the defaults of run_backtest.
+        The morning cutoff is a time of day like "11:30"
+    :return: A dictionary with the RESULT_COLUMNS keys
+    """
+    start_time = time.perf_counter()
+    knobs = {name: params[name] for name in ["threshold", "aggregation", "morning_cutoff"] if name in params}
+    if isinstance(knobs.get("morning_cutoff"), str):
+        knobs["morning_cutoff"] = pd.to_timedelta(f"{knobs['morning_cutoff']}:00")
+    trades = generate_backtest_trades(_replay["headlines"], _replay["windows"], **knobs)
+    buying_power = params.get("buying_power", 1000.0)
+    allocation = params.get("allocation", "equal")
+    fills = simulate_fills(trades, _replay["prices"], _replay["windows"], buying_power, allocation)
+    summary = summarize_backtest(fills, buying_power)
+    row = {
+        "morning_cutoff": params.get("morning_cutoff", "11:30"),
+        "threshold": knobs.get("threshold", SENTIMENT_THRESHOLD),
+        "aggregation": knobs.get("aggregation", "mean"),
+        "allocation": allocation,
+        "buying_power": buying_power,
+    }
+    row.update(summary.loc["all", SUMMARY_COLUMNS].to_dict())
+    for session in ["morning", "afternoon"]:
+        row[f"{session}_pnl"] = summary.loc[session, "pnl"] if session in summary.index else 0.0
+    row["seconds"] = time.perf_counter() - start_time
+    return row
+
+
+def sweep(
+    start_day: date,
+    end_day: date,
+    grid: list,
+    headlines: ColumnarStore = None,
+    bars: ColumnarStore = None,
+    stocks: pd.DataFrame = None,
+    cache: RecommendationCache = None,
+    scorer=None,
+    workers: int = SWEEP_WORKERS,
+    results_file: str = SWEEP_RESULTS_FILE,
+):
+    """
+    The sweep function backtests every combination of knobs of a grid on the same replay, in a pool of processes.
+
+    :param start_day: date: The first day of headlines
+    :param end_day: date: The last day of headlines
+    :param grid: list: Dictionaries of knob values, e.g. from parameter_grid
+    :param headlines: ColumnarStore: The headline store, defaults to the one in HEADLINES_DIR
+    :param bars: ColumnarStore: The bar store, defaults to the one in BARS_DIR
+    :param stocks: pd.DataFrame: Stocks to match headlines stored without a ticker against
+    :param cache: RecommendationCache: The backtest score cache, defaults to the one in BACKTEST_SCORES_FILE
+    :param scorer: Scores headlines missing from both caches, by default they are left out
+    :param workers: int: The number of worker processes, 1 replays in this process
+    :param results_file: str: The CSV file results are written to as they arrive
+    :return: A dataframe with the RESULT_COLUMNS columns, one row per combination in grid order
+    """
+    start_time = time.perf_counter()
+    df = load_headlines(headlines or headline_store(), start_day, end_day, stocks)
+    df["recommendation"] = cached_scores(df, cache or get_backtest_scores(), scorer)
+    days = [day.strftime("%Y-%m-%d") for day in pd.date_range(start_day, end_day + pd.Timedelta(days=7), freq="D")]
+    prices = PriceIndex.from_bars(
+        (bars or bar_store()).read({"date": days}, columns=["ticker", "datetime", "close"]), df["ticker"].unique()
+    )
+    windows = execution_windows(start_day, end_day)
+    print(f"Replay of {len(df)} headlines and {len(prices.keys)} bars prepared in {time.perf_counter() - start_time:.2f}s")
+
+    directory = os.path.dirname(results_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    rows = [None] * len(grid)
+    with tempfile.TemporaryDirectory() as replay_dir, open(results_file, "w", newline="") as results:
+        write_replay(replay_dir, df, prices)
+        writer = csv.DictWriter(results, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+
+        def record(i, row):
+            rows[i] = row
+            writer.writerow(row)
+            results.flush()
+            done = sum(row is not None for row in rows)
+            print(f"[{done}/{len(grid)}] {', '.join(f'{k}={row[k]}' for k in KNOBS)}: pnl {row['pnl']:.2f}")
+
+        if workers <= 1:
+            load_replay(replay_dir, windows)
+            for i, params in enumerate(grid):
+                record(i, replay(params))
+        else:
+            # spawned workers start clean instead of inheriting a copy of the parent's memory
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=load_replay,
+                initargs=(replay_dir, windows),
+            ) as executor:
+                futures = {executor.submit(replay, params): i for i, params in enumerate(grid)}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+
+    summary = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    summary.attrs["elapsed"] = time.perf_counter() - start_time
+    print(f"Swept {len(grid)} combinations in {summary.attrs['elapsed']:.1f}s, results in {results_file}")
+    return summary
+
+
+if __name__ == "__main__":
+    from backtest import synthetic_replay
+
+    root = tempfile.mkdtemp()
+    headline_root, bar_root, cache = synthetic_replay(root)
+    grid = parameter_grid(
+        morning_cutoff=["09:30", "11:30"],
+        threshold=[0.0, 0.5],
+        aggregation=["mean", "median", "sum", "last"],
+        allocation=["equal", "sentiment"],
+        buying_power=[1000.0],
+    )
+    elapsed = {}
+    for workers in [1, max(SWEEP_WORKERS, 2)]:
+        summary = sweep(
+            date(2024, 1, 1),
+            date(2024, 12, 31),
+            grid,
+            headline_root,
+            bar_root,
+            cache=cache,
+            workers=workers,
+            results_file=os.path.join(root, f"sweep-{workers}.csv"),
+        )
+        elapsed[workers] = summary.attrs["elapsed"]
+    print(summary.sort_values("pnl", ascending=False).head(5).round(4).to_string())
+    print(", ".join(f"{workers} workers: {seconds:.1f}s" for workers, seconds in elapsed.items()))
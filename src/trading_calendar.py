@@ -0,0 +1,240 @@
+import json
+import os
+import time
+from bisect import bisect_right
+from datetime import date, datetime
+
+from pytz import timezone
+
+# Exchange sessions read once per year from pandas_market_calendars and kept on disk, so cron launches
+# answer "is the market open" and "which execution window is this" without importing the calendar library.
+
+TRADING_CALENDAR_FILE = os.getenv("TRADING_CALENDAR_FILE", "data/trading_calendar.json")
+EXCHANGE_CALENDAR = "XNYS"
+EASTERN = timezone("America/New_York")
+
+# Execution windows of execute_trades, in New York wall time. The afternoon window ends at the close,
+# so on half days it moves to the 20 minutes before the early close.
+MORNING_WINDOW = ("11:10", "11:40")
+AFTERNOON_WINDOW_MINUTES = 20
+
+CALENDAR = None
+
+
+def load_sessions(year: int):
+    """
+    The load_sessions function reads the sessions of a year from the exchange calendar.
+
+    :param year: int: The year
+    :return: A list of [date, open, close] with the open and close in epoch seconds
+    """
+    import pandas_market_calendars as mcal
+
+    schedule = mcal.get_calendar(EXCHANGE_CALENDAR).schedule(
+        date(year, 1, 1), date(year, 12, 31)
+    )
+    return [
+        [day.date().isoformat(), row.market_open.timestamp(), row.market_close.timestamp()]
+        for day, row in schedule.iterrows()
+    ]
+
+
+def wall_time(day: date, clock: str):
+    """
+    The wall_time function returns the epoch seconds of a New York wall clock time on a day.
+    """
+    hour, minute = map(int, clock.split(":"))
+    return EASTERN.localize(datetime(day.year, day.month, day.day, hour, minute)).timestamp()
+
+
+def epoch_seconds(when=None):
+    """
+    The epoch_seconds function reads a moment as epoch seconds.
+
+    :param when: A tz-aware datetime, epoch seconds, or None for now
+    """
+    if when is None:
+        return time.time()
+    if isinstance(when, (int, float)):
+        return float(when)
+    if when.tzinfo is None:
+        raise ValueError("naive datetimes are ambiguous, pass a tz-aware datetime")
+    return when.timestamp()
+
+
+class TradingCalendar:
+    """
+    The TradingCalendar class keeps the exchange sessions and execution windows in sorted lists,
+    so each question is a bisect instead of a calendar computation. Years are loaded from the exchange
+    calendar on first use and saved to disk.
+    """
+
+    def __init__(self, path: str = TRADING_CALENDAR_FILE, load_year=load_sessions):
+        """
+        :param path: str: The JSON file the sessions are kept in
+        :param load_year: The function reading the sessions of a year, see load_sessions
+        """
+        self.path = path
+        self.load_year = load_year
+        self.years = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.years = {int(year): sessions for year, sessions in json.load(f)["years"].items()}
+        self.index()
+
+    def index(self):
+        sessions = sorted(s for year in sorted(self.years) for s in self.years[year])
+        self.days = [s[0] for s in sessions]
+        self.day_index = {day: i for i, day in enumerate(self.days)}
+        self.opens = [s[1] for s in sessions]
+        self.closes = [s[2] for s in sessions]
+
+        windows = []
+        for day, close in zip(self.days, self.closes):
+            d = date.fromisoformat(day)
+            windows.append((wall_time(d, MORNING_WINDOW[0]), wall_time(d, MORNING_WINDOW[1]), "morning"))
+            windows.append((close - AFTERNOON_WINDOW_MINUTES * 60, close, "afternoon"))
+        windows.sort()
+        self.window_starts = [w[0] for w in windows]
+        self.window_ends = [w[1] for w in windows]
+        self.window_names = [w[2] for w in windows]
+
+    def save(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"calendar": EXCHANGE_CALENDAR, "years": self.years}, f)
+        os.replace(temporary, self.path)
+
+    def ensure_years(self, *years: int):
+        """
+        The ensure_years function loads the sessions of any of the years not known yet, and saves them.
+        """
+        if all(year in self.years for year in years):
+            return
+        for year in [year for year in years if year not in self.years]:
+            self.years[year] = self.load_year(year)
+        self.index()
+        self.save()
+
+    def eastern_date(self, t: float):
+        return datetime.fromtimestamp(t, EASTERN).date()
+
+    def eastern_year(self, t: float):
+        # New Year always falls in standard time, UTC-5
+        return time.gmtime(t - 5 * 60 * 60).tm_year
+
+    def is_trading_day(self, day: date):
+        """
+        The is_trading_day function tells whether the exchange has a session on a day.
+        """
+        self.ensure_years(day.year)
+        return day.isoformat() in self.day_index
+
+    def session(self, day: date):
+        """
+        The session function returns the open and close of a day in epoch seconds, or None if there is no session.
+        """
+        self.ensure_years(day.year)
+        i = self.day_index.get(day.isoformat())
+        return None if i is None else (self.opens[i], self.closes[i])
+
+    def is_open(self, when=None):
+        """
+        The is_open function tells whether the exchange is in its regular session at a moment.
+
+        :param when: A tz-aware datetime, epoch seconds, or None for now
+        """
+        t = epoch_seconds(when)
+        self.ensure_years(self.eastern_year(t))
+        i = bisect_right(self.opens, t) - 1
+        return i >= 0 and t < self.closes[i]
+
+    def phase(self, when=None):
+        """
+        The phase function names the session phase at a moment.
+
+        :param when: A tz-aware datetime, epoch seconds, or None for now
+        :return: "pre-market", "open" or "after-hours" on trading days, "closed" on other days
+        """
+        t = epoch_seconds(when)
+        day = self.eastern_date(t)
+        self.ensure_years(day.year)
+        i = self.day_index.get(day.isoformat())
+        if i is None:
+            return "closed"
+        if t < self.opens[i]:
+            return "pre-market"
+        if t < self.closes[i]:
+            return "open"
+        return "after-hours"
+
+    def current_window(self, when=None):
+        """
+        The current_window function names the execution window a moment falls in.
+
+        :param when: A tz-aware datetime, epoch seconds, or None for now
+        :return: "morning", "afternoon" or None
+        """
+        t = epoch_seconds(when)
+        self.ensure_years(self.eastern_year(t))
+        i = bisect_right(self.window_starts, t) - 1
+        if i >= 0 and t <= self.window_ends[i]:
+            return self.window_names[i]
+        return None
+
+    def next_window(self, when=None):
+        """
+        The next_window function finds the next execution window that has not ended yet.
+
+        :param when: A tz-aware datetime, epoch seconds, or None for now
+        :return: A tuple of name, start and end as New York datetimes
+        """
+        t = epoch_seconds(when)
+        year = self.eastern_year(t)
+        self.ensure_years(year, year + 1)
+        i = bisect_right(self.window_ends, t)
+        if i == len(self.window_ends):
+            raise ValueError("no execution window in the loaded calendar years")
+        return (
+            self.window_names[i],
+            datetime.fromtimestamp(self.window_starts[i], EASTERN),
+            datetime.fromtimestamp(self.window_ends[i], EASTERN),
+        )
+
+    def closes_by_day(self, year: int):
+        """
+        The closes_by_day function returns the close of every trading day of a year in epoch seconds.
+        """
+        self.ensure_years(year)
+        return {day: close for day, _, close in self.years[year]}
+
+
+def get_calendar():
+    """
+    The get_calendar function returns the shared trading calendar, loading it on first use.
+    """
+    global CALENDAR
+    if CALENDAR is None:
+        CALENDAR = TradingCalendar()
+    return CALENDAR
+
+
+if __name__ == "__main__":
+    calendar = get_calendar()
+    start_time = time.time()
+    calendar.ensure_years(datetime.now(EASTERN).year)
+    print(f"calendar ready in {time.time() - start_time:.3f} seconds")
+
+    now = time.time()
+    for name, question in [
+        ("is_open", calendar.is_open),
+        ("phase", calendar.phase),
+        ("current_window", calendar.current_window),
+        ("next_window", calendar.next_window),
+    ]:
+        runs = 100000
+        start_time = time.perf_counter()
+        for i in range(runs):
+            question(now + i)
+        elapsed = (time.perf_counter() - start_time) / runs
+        print(f"{name}: {question(now)} ({elapsed * 1e6:.1f} microseconds per call)")
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+# the modules in src import each other by name, the way python src/<module>.py runs them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# keep every store, cache and calendar of a test run out of data/, set before any module reads them
+DATA_DIR = tempfile.mkdtemp(prefix="llm_trader-tests-")
+for name, path in [
+    ("HEADLINES_DIR", "headlines"),
+    ("TRADES_DIR", "trades"),
+    ("BARS_DIR", "bars"),
+    ("LLM_CACHE_FILE", "llm_cache.sqlite"),
+    ("HEADLINE_LEDGER_FILE", "headline_ledger.sqlite"),
+    ("ASSET_INDEX_FILE", "asset_index.sqlite"),
+    ("BACKTEST_SCORES_FILE", "backtest_scores.sqlite"),
+    ("TRADING_CALENDAR_FILE", "trading_calendar.json"),
+    ("REBALANCE_REPORTS_DIR", "rebalance_reports"),
+    ("SWEEP_RESULTS_FILE", "sweep_results.csv"),
+]:
+    os.environ[name] = os.path.join(DATA_DIR, path)
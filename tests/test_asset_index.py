@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+from asset_index import AssetIndex, list_tradable_assets
+
+
+def asset(symbol, status="active"):
+    return SimpleNamespace(
+        symbol=symbol, tradable=True, fractionable=True, easy_to_borrow=True, shortable=True, status=status
+    )
+
+
+class RestClient:
+    """
+    Answers list_assets like alpaca_trade_api, honouring the status filter.
+    """
+
+    def __init__(self, assets):
+        self.assets = assets
+        self.calls = []
+
+    def list_assets(self, status=None, asset_class=None):
+        self.calls.append((status, asset_class))
+        return [a for a in self.assets if status is None or a.status == status]
+
+
+def test_refresh_keeps_the_listed_assets(tmp_path):
+    api = RestClient([asset("AAPL"), asset("MSFT"), asset("DEAD", "inactive")])
+    index = AssetIndex(str(tmp_path / "assets.sqlite"))
+    assert index.refresh(list_tradable_assets(api)) == {"added": 2, "removed": 0, "changed": 0}
+    assert api.calls == [("active", "us_equity")]
+    # the same listing again changes nothing
+    assert index.refresh(list_tradable_assets(api)) == {"added": 0, "removed": 0, "changed": 0}
+    assert "AAPL" in index and "DEAD" not in index
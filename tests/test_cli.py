@@ -0,0 +1,40 @@
+import pytest
+
+import cli
+import headline_stream
+
+
+@pytest.fixture
+def stream_main(monkeypatch):
+    calls = []
+    monkeypatch.setattr(headline_stream, "main", calls.append)
+    return calls
+
+
+def test_stream_options_reach_headline_stream(stream_main, tmp_path):
+    path = str(tmp_path / "recorded.csv")
+    cli.main(["stream", "--replay", path])
+    assert stream_main == [["--replay", path]]
+
+
+def test_stream_without_options(stream_main):
+    cli.main(["stream"])
+    assert stream_main == [[]]
+
+
+def test_stream_help_is_headline_streams(stream_main):
+    cli.main(["stream", "--help"])
+    assert stream_main == [["--help"]]
+
+
+def test_other_commands_reject_unknown_options(capsys):
+    with pytest.raises(SystemExit):
+        cli.main(["stock-list", "--replay", "x.csv"])
+    assert "unrecognized arguments: --replay x.csv" in capsys.readouterr().err
+
+
+def test_stream_help_prints_headline_stream_usage(capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        cli.main(["stream", "--help"])
+    assert excinfo.value.code == 0
+    assert "--replay" in capsys.readouterr().out
@@ -0,0 +1,62 @@
+import pytest
+
+import finnhub_headlines
+from fake_finnhub import FakeFinnhubClient, FakeFinnhubServer
+from finnhub_headlines import MAX_RETRIES, KeyPool, fetch_all_headlines, get_headlines
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(finnhub_headlines, "BACKOFF_BASE", 0.001)
+
+
+def make_pool(server, keys=2, rate=1000.0):
+    return KeyPool([FakeFinnhubClient(f"key_{i}", server) for i in range(keys)], rate=rate, capacity=rate)
+
+
+def test_rate_limited_key_is_drained(monkeypatch):
+    server = FakeFinnhubServer(calls_per_second=1, latency=0)
+    pool = make_pool(server)
+    # key_0 spends its call for this second, the next one gets a 429
+    pool.clients[0].company_news("MSFT")
+    # a long penalty, so the drained key stays out for the rest of the test
+    monkeypatch.setattr(finnhub_headlines, "backoff_seconds", lambda attempt: 60.0)
+
+    headlines = get_headlines("AAPL", pool)
+    assert [headline for headline, _ in headlines] == ["AAPL headline 0", "AAPL headline 1"]
+    assert server.rejected == {"key_0": 1}
+    assert not pool.buckets[0].try_acquire()
+
+    # the other key takes every call while the drained one recovers
+    server.calls_per_second = 1000
+    fetch_all_headlines(["NVDA", "TSLA", "AMZN"], pool, max_workers=2)
+    assert server.served == {"key_0": 1, "key_1": 4}
+
+
+def test_retries_are_capped(capsys):
+    server = FakeFinnhubServer(calls_per_second=0, latency=0)
+    pool = make_pool(server)
+    assert get_headlines("AAPL", pool) == []
+    assert sum(server.rejected.values()) == MAX_RETRIES + 1
+    assert "Error fetching headlines for AAPL" in capsys.readouterr().out
+
+
+def test_other_errors_are_retried_and_capped():
+    class FailingClient:
+        calls = 0
+
+        def company_news(self, symbol, _from=None, to=None):
+            FailingClient.calls += 1
+            raise ConnectionError("connection reset")
+
+    pool = KeyPool([FailingClient()], rate=1000, capacity=1000)
+    assert get_headlines("AAPL", pool) == []
+    assert FailingClient.calls == MAX_RETRIES + 1
+
+
+def test_keys_share_the_load():
+    server = FakeFinnhubServer(calls_per_second=1000, latency=0)
+    pool = make_pool(server, keys=4)
+    results = fetch_all_headlines([f"T{i}" for i in range(40)], pool, max_workers=4)
+    assert all(len(result) == 2 for result in results)
+    assert server.served == {f"key_{i}": 10 for i in range(4)}
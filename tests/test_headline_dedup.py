@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from headline_dedup import NUM_PERMUTATIONS, cluster_headlines, dedupe_headlines, headline_words, minhash_signatures
+
+HEADLINES = [
+    "Apple beats quarterly estimates as iPhone sales rise",
+    "Apple beats quarterly estimates as iPhone sales rise - Reuters",
+    "BREAKING: Apple beats quarterly estimates as iPhone sales rise (report)",
+    "Tesla recalls 2 million vehicles over Autopilot",
+    "",
+    "Nvidia unveils new chips at CES",
+]
+
+
+def test_chunked_signatures_match_one_chunk():
+    words = [headline_words(h) for h in HEADLINES * 5]
+    whole = minhash_signatures(words, chunk=len(words))
+    assert whole.shape == (len(words), NUM_PERMUTATIONS)
+    for chunk in [1, 4, 7]:
+        assert np.array_equal(minhash_signatures(words, chunk=chunk), whole)
+
+
+def test_no_signatures():
+    assert minhash_signatures([]).shape == (0, NUM_PERMUTATIONS)
+
+
+def test_rewordings_cluster_together():
+    clusters = cluster_headlines(HEADLINES).tolist()
+    assert clusters == [0, 0, 0, 3, 4, 5]
+
+
+def test_representative_is_the_earliest_copy_in_the_batch():
+    df = pd.DataFrame(
+        {
+            "ticker": ["AAPL", "AAPL", "QCOM", "TSLA"],
+            "company": ["Apple", "Apple", "Qualcomm", "Tesla"],
+            "headline": [HEADLINES[1], HEADLINES[0], HEADLINES[2], HEADLINES[3]],
+            "datetime": [3, 1, 2, 4],
+            "source": ["a", "b", "c", "d"],
+        }
+    )
+    deduped = dedupe_headlines(df)
+    assert deduped.attrs["stories"] == 2
+    assert deduped[["ticker", "headline", "source"]].values.tolist() == [
+        ["AAPL", HEADLINES[0], "b"],
+        ["QCOM", HEADLINES[0], "b"],
+        ["TSLA", HEADLINES[3], "d"],
+    ]
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+from datetime import date
+
+import pandas as pd
+
+from headline_keys import headline_hash
+from headline_ledger import HeadlineLedger
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_hash_ignores_case_and_whitespace():
+    assert headline_hash("Apple  beats\testimates ") == headline_hash("apple beats estimates")
+    assert headline_hash("Apple beats estimates") != headline_hash("Apple misses estimates")
+
+
+def test_ledger_does_not_load_the_scraper():
+    # a fresh interpreter, this one has loaded the scraper for other tests
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, headline_ledger; print(' '.join(sorted(sys.modules)))"],
+        cwd=SRC,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert not {"headline_scraper", "requests", "bs4", "lxml"} & set(loaded)
+
+
+def test_ledger_keeps_only_committed_headlines(tmp_path):
+    path = str(tmp_path / "ledger.sqlite")
+    df = pd.DataFrame(
+        {"ticker": ["AAPL"], "headline": ["Apple beats estimates"], "datetime": [0], "recommendation": [1.0]}
+    )
+    ledger = HeadlineLedger(path)
+    scored = ledger.new_headlines(df)
+    ledger.record(scored, date(2024, 1, 2), 1)
+    assert ledger.averages(date(2024, 1, 2), 1)["recommendation"].tolist() == [1.0]
+    ledger.connection.close()
+    # the trades of that run were never written, the headline is still new
+    ledger = HeadlineLedger(path)
+    assert len(ledger.new_headlines(df)) == 1
+    ledger.record(ledger.new_headlines(df), date(2024, 1, 2), 1)
+    ledger.commit()
+    ledger.connection.close()
+    assert len(HeadlineLedger(path).new_headlines(df)) == 0
@@ -0,0 +1,168 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import headline_stream
+from columnar_store import HOLD_SIDE, trade_store
+from execute_trades import execute_trades_handler
+from headline_stream import HeadlineStream, poll_finnhub, replay
+
+STOCKS = pd.DataFrame(
+    {
+        "ticker": ["AAPL", "MSFT"],
+        "company": ["Apple Inc.", "Microsoft Corporation"],
+        "keywords": ["['AAPL', 'Apple']", "['MSFT', 'Microsoft']"],
+    }
+)
+
+
+def unexpected_score(row):
+    raise AssertionError(f"scored {row['headline']!r}, recorded recommendations should be used")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return trade_store(str(tmp_path / "trades"))
+
+
+def replay_rows(stream, tmp_path, rows):
+    path = tmp_path / "recorded.csv"
+    pd.DataFrame(rows, columns=["headline", "datetime", "recommendation"]).to_csv(path, index=False)
+    replay(stream, str(path))
+    stream.run(threading.Event())
+
+
+def latest_trades(store, session="morning"):
+    trades = store.read({"session": session})
+    return trades.sort_values("datetime", kind="stable").drop_duplicates("ticker", keep="last").set_index("ticker")
+
+
+def test_mean_back_to_neutral_writes_a_hold(store):
+    stream = HeadlineStream(STOCKS, score=unexpected_score, store=store)
+    stream.put({"headline": "Apple beats estimates", "datetime": "2024-01-02 08:00", "recommendation": 1, "replay": True})
+    stream.queue.put(None)
+    stream.run(threading.Event())
+    assert latest_trades(store).loc["AAPL", "side"] == "buy"
+
+    stream.put({"headline": "Apple recalls chargers", "datetime": "2024-01-02 08:30", "recommendation": -1, "replay": True})
+    stream.queue.put(None)
+    stream.run(threading.Event())
+    assert latest_trades(store).loc["AAPL", "side"] == HOLD_SIDE
+    # the hold cancels the morning buy, nothing is left to execute
+    assert execute_trades_handler("morning", store) is None
+
+
+def test_replay_stamps_trades_with_the_headline_time(store, tmp_path):
+    stream = HeadlineStream(STOCKS, score=unexpected_score, store=store)
+    replay_rows(
+        stream,
+        tmp_path,
+        [
+            ("Apple beats estimates", "2024-01-02 08:00", 1),
+            ("Microsoft misses estimates", "2024-01-02 13:00", -1),
+        ],
+    )
+    morning = latest_trades(store, "morning")
+    afternoon = latest_trades(store, "afternoon")
+    assert morning.loc["AAPL", "datetime"] == pd.Timestamp("2024-01-02 08:00", tz="America/New_York").timestamp()
+    assert afternoon.loc["MSFT", "side"] == "sell"
+    assert store.values("date") == ["2024-01-02"]
+
+
+def test_one_write_per_session_per_batch(store, tmp_path):
+    stream = HeadlineStream(STOCKS, score=unexpected_score, store=store)
+    replay_rows(
+        stream,
+        tmp_path,
+        [(f"Apple story {i}", f"2024-01-02 08:{i:02d}", 1 if i % 2 else -1) for i in range(40)]
+        + [(f"Microsoft story {i}", f"2024-01-02 08:{i:02d}", 1) for i in range(40)],
+    )
+    assert stream.flushes == 1
+    (directory,) = store.partition_dirs({"session": "morning"})
+    assert len(os.listdir(directory)) == 1
+    assert len(store.read({"session": "morning"})) == 2
+
+
+def test_store_is_compacted(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(headline_stream, "STREAM_BATCH_SIZE", 1)
+    stream = HeadlineStream(STOCKS, score=unexpected_score, store=store)
+    replay_rows(stream, tmp_path, [(f"Apple story {i}", f"2024-01-02 08:{i:02d}", 1) for i in range(20)])
+    assert stream.flushes == 20
+    (directory,) = store.partition_dirs({"session": "morning"})
+    assert len(os.listdir(directory)) < 8
+    assert len(store.read({"session": "morning"})) == 20
+
+
+def test_old_days_are_evicted(store, tmp_path):
+    stream = HeadlineStream(STOCKS, score=unexpected_score, store=store)
+    days = pd.date_range("2024-01-01", periods=10, freq="D")
+    replay_rows(stream, tmp_path, [(f"Apple story {i}", f"{day:%Y-%m-%d} 08:00", 1) for i, day in enumerate(days)])
+    kept = {key[0] for key in stream.sentiment}
+    assert min(kept) >= (days[-1] - pd.Timedelta(days=headline_stream.STREAM_RETENTION_DAYS)).date()
+    assert len(stream.seen) <= headline_stream.STREAM_RETENTION_DAYS + 1
+
+    # a headline from before the retained days is dropped instead of reopening its day
+    stream.put({"headline": "Apple old story", "datetime": "2024-01-01 08:05", "recommendation": 1, "replay": True})
+    stream.queue.put(None)
+    stream.run(threading.Event())
+    assert stream.stale == 1
+
+
+def test_replay_does_not_write_to_the_live_store(tmp_path, monkeypatch):
+    stocks = tmp_path / "stocks.csv"
+    STOCKS.to_csv(stocks, index=False)
+    recorded = tmp_path / "recorded.csv"
+    pd.DataFrame({"headline": ["Apple beats estimates"], "datetime": ["2024-01-02 08:00"], "recommendation": [1]}).to_csv(
+        recorded, index=False
+    )
+    roots = []
+    monkeypatch.setattr(headline_stream, "trade_store", lambda root: roots.append(root) or trade_store(root))
+    headline_stream.main(["--stocks", str(stocks), "--replay", str(recorded)])
+    (root,) = roots
+    assert root != os.environ["TRADES_DIR"]
+    assert len(trade_store(root).read()) == 1
+    assert not os.path.exists(os.environ["TRADES_DIR"]) or trade_store().read().empty
+
+
+def test_scraper_state_is_saved_after_the_flush(store, monkeypatch):
+    stream = HeadlineStream(STOCKS, score=unexpected_score, store=store)
+    stop = threading.Event()
+    saved = []
+
+    class State:
+        def save(self):
+            saved.append(len(store.read()))
+
+    def scrape(state):
+        stop.set()
+        return pd.DataFrame(
+            {"headline": ["Apple beats estimates"], "datetime": ["2024-01-02 08:00"], "recommendation": [1], "replay": [True]}
+        )
+
+    monkeypatch.setattr(headline_stream, "ScraperState", State)
+    monkeypatch.setattr(headline_stream, "scrape_all_headlines", scrape)
+    headline_stream.poll_scraper(stream, stop, 0)
+    assert saved == []
+    stream.queue.put(None)
+    stream.run(threading.Event())
+    # saved once, with the poll's trade already in the store
+    assert saved == [1]
+
+
+def test_poll_finnhub_survives_errors(monkeypatch, capsys):
+    stop = threading.Event()
+    calls = []
+
+    def failing_fetch(tickers, pool):
+        calls.append(tickers)
+        if len(calls) == 2:
+            stop.set()
+        raise ConnectionError("finnhub is down")
+
+    monkeypatch.setattr(headline_stream, "get_api_keys", lambda: ["key"])
+    monkeypatch.setattr(headline_stream, "fetch_all_headlines", failing_fetch)
+    poll_finnhub(HeadlineStream(STOCKS, score=unexpected_score, store=trade_store(os.environ["TRADES_DIR"])), STOCKS, stop, 0)
+    assert len(calls) == 2
+    assert "Error fetching Finnhub headlines: finnhub is down" in capsys.readouterr().out
@@ -0,0 +1,96 @@
+import time
+
+import llm_cache
+from llm_cache import RecommendationCache, make_key
+
+
+def statements(cache):
+    traced = []
+    cache.connection.set_trace_callback(traced.append)
+    return traced
+
+
+def accessed(cache, key):
+    return cache.connection.execute("SELECT accessed FROM recommendations WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_round_trip():
+    cache = RecommendationCache(":memory:")
+    cache.put(make_key("a"), 1)
+    cache.put_many({make_key("b"): -1, make_key("c"): 0})
+    assert cache.get(make_key("a")) == 1
+    assert cache.get_many([make_key("b"), make_key("c"), make_key("d")]) == {make_key("b"): -1, make_key("c"): 0}
+    assert cache.get(make_key("d")) is None
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_created_is_indexed():
+    cache = RecommendationCache(":memory:")
+    plan = cache.connection.execute("EXPLAIN QUERY PLAN DELETE FROM recommendations WHERE created < 0").fetchall()
+    assert "recommendations_created" in str(plan)
+
+
+def test_hits_do_not_write():
+    cache = RecommendationCache(":memory:")
+    cache.put_many({make_key(i): 1 for i in range(10)})
+    traced = statements(cache)
+    for i in range(10):
+        assert cache.get(make_key(i)) == 1
+    assert cache.get_many([make_key(i) for i in range(10)])
+    assert not [sql for sql in traced if not sql.startswith("SELECT")]
+
+
+def test_access_times_are_written_once_per_put_many():
+    cache = RecommendationCache(":memory:")
+    cache.put_many({"old": 1, "new": 1})
+    before = accessed(cache, "old")
+    time.sleep(0.01)
+    cache.get("old")
+    assert accessed(cache, "old") == before
+
+    traced = statements(cache)
+    cache.put_many({"other": 1})
+    assert accessed(cache, "old") > before
+    assert sum(sql == "COMMIT" for sql in traced) == 1
+    assert sum(sql.startswith("DELETE") for sql in traced) == 2
+
+
+def test_put_is_put_many(monkeypatch):
+    cache = RecommendationCache(":memory:")
+    calls = []
+    monkeypatch.setattr(cache, "put_many", calls.append)
+    cache.put("key", 1)
+    assert calls == [{"key": 1}]
+
+
+def test_many_hits_are_flushed(monkeypatch):
+    monkeypatch.setattr(llm_cache, "TOUCH_FLUSH_SIZE", 5)
+    cache = RecommendationCache(":memory:")
+    cache.put_many({str(i): 1 for i in range(5)})
+    before = accessed(cache, "0")
+    time.sleep(0.01)
+    cache.get_many([str(i) for i in range(4)])
+    assert cache.touched
+    cache.get("4")
+    assert not cache.touched
+    assert accessed(cache, "0") > before
+
+
+def test_least_recently_used_are_evicted():
+    cache = RecommendationCache(":memory:", max_entries=2)
+    cache.put_many({"a": 1, "b": 1})
+    time.sleep(0.01)
+    # a hit keeps "a", the recorded access time reaches the table with the next write
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", 1)
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_expired_entries_are_dropped():
+    cache = RecommendationCache(":memory:", ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    cache.put("b", 1)
+    assert len(cache) == 1
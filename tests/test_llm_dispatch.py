@@ -0,0 +1,161 @@
+import asyncio
+import socket
+
+import openai
+import pytest
+
+try:
+    import httpx
+except ImportError:
+    # the HTTP client of recent openai releases
+    import httpx2 as httpx
+
+import pandas as pd
+
+import generate_trades
+import llm_dispatch
+from fake_openai import start_fake_openai
+from llm_cache import RecommendationCache
+from llm_dispatch import MAX_RETRIES, AdaptiveLimiter, Dispatcher
+
+REQUEST = httpx.Request("POST", "http://127.0.0.1/v1/chat/completions")
+
+
+def status_error(cls, status):
+    return cls("error", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_dispatch, "BACKOFF_BASE", 0.001)
+
+
+def failing_score(errors):
+    """
+    Raises the given errors in turn, then answers 1.
+    """
+    calls = []
+
+    async def score(client, headline, company_name, term):
+        calls.append(headline)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return 1
+
+    return score, calls
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    cache = RecommendationCache(":memory:")
+    monkeypatch.setattr(generate_trades, "get_cache", lambda: cache)
+    return cache
+
+
+HEADLINES = pd.DataFrame({"headline": ["Apple beats estimates", "Apple misses"], "company": ["Apple", "Apple"]})
+
+
+async def score_one(dispatcher):
+    dispatcher.limiter = AdaptiveLimiter(dispatcher.concurrency)
+    return await dispatcher.score_item(None, "Apple beats estimates", "Apple", "short")
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        openai.APIConnectionError(request=REQUEST),
+        openai.APITimeoutError(request=REQUEST),
+        status_error(openai.InternalServerError, 500),
+        status_error(openai.APIStatusError, 503),
+        status_error(openai.RateLimitError, 429),
+    ],
+    ids=["connection", "timeout", "500", "503", "429"],
+)
+def test_transient_errors_are_retried(error):
+    score, calls = failing_score([error, error])
+    assert asyncio.run(score_one(Dispatcher(1, score=score))) == 1
+    assert len(calls) == 3
+
+
+def test_persistent_errors_score_neutral(monkeypatch, memory_cache, capsys):
+    score, calls = failing_score([openai.APIConnectionError(request=REQUEST)] * (MAX_RETRIES + 1))
+    dispatcher = Dispatcher(1, score=score)
+    assert asyncio.run(score_one(dispatcher)) is None
+    assert len(calls) == MAX_RETRIES + 1
+    assert dispatcher.failed == MAX_RETRIES + 1
+    assert "Error scoring headline for Apple" in capsys.readouterr().out
+
+    # the failed headline is neutral for this run only, the next one is answered and cached
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    async def score_beats(client, headline, company_name, term):
+        if headline == "Apple beats estimates":
+            raise openai.APIConnectionError(request=REQUEST)
+        return 1
+
+    monkeypatch.setattr(generate_trades, "Dispatcher", lambda concurrency: Dispatcher(1, score=score_beats))
+    assert generate_trades.score_headlines(HEADLINES, concurrency=1, prefilter=False) == [0, 1]
+    assert len(memory_cache) == 1
+
+
+@pytest.mark.parametrize(
+    "error",
+    [status_error(openai.BadRequestError, 400), ValueError("unexpected answer")],
+    ids=["400", "other"],
+)
+def test_other_errors_score_neutral_without_retry(error):
+    score, calls = failing_score([error])
+    assert asyncio.run(score_one(Dispatcher(1, score=score))) is None
+    assert len(calls) == 1
+
+
+def test_one_decrease_per_window():
+    async def window():
+        limiter = AdaptiveLimiter(8)
+        tickets = [await limiter.__aenter__() for _ in range(8)]
+        # every request of the window is rate limited, the limit is halved once
+        halved = [limiter.on_rate_limit(ticket) for ticket in tickets]
+        for _ in tickets:
+            await limiter.__aexit__(None, None, None)
+        first = limiter.limit
+        # a request sent after the decrease counts again
+        ticket = await limiter.__aenter__()
+        limiter.on_rate_limit(ticket)
+        await limiter.__aexit__(None, None, None)
+        return halved, first, limiter.limit
+
+    halved, first, second = asyncio.run(window())
+    assert halved == [True] + [False] * 7
+    assert (first, second) == (4, 2)
+
+
+def test_rate_limited_run_against_fake_server(monkeypatch):
+    server = start_fake_openai(latency=0.01, rate_limit_every=3)
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    try:
+        from llm_call import async_generate_stock_recommendation
+
+        items = [(f"Apple beats estimates {i}", "Apple") for i in range(12)]
+        dispatcher = Dispatcher(8, score=async_generate_stock_recommendation)
+        assert dispatcher.run(items, "short") == [1] * 12
+    finally:
+        server.shutdown()
+    assert dispatcher.rate_limited > 0
+    assert dispatcher.limiter.decreases < dispatcher.rate_limited
+
+
+def test_unreachable_server_scores_neutral(monkeypatch, memory_cache):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    from llm_call import async_generate_stock_recommendation
+
+    dispatcher = Dispatcher(2, score=async_generate_stock_recommendation)
+    assert dispatcher.run([("Apple beats estimates", "Apple"), ("Apple misses", "Apple")], "short") == [None, None]
+    assert dispatcher.failed == 2 * (MAX_RETRIES + 1)
+
+    # an outage is scored neutral without poisoning the cache
+    assert generate_trades.score_headlines(HEADLINES, concurrency=2, prefilter=False) == [0, 0]
+    assert len(memory_cache) == 0
@@ -0,0 +1,52 @@
+from local_scorer import NEUTRAL_CONFIDENCE, LocalScorer, PrefilterScorer
+
+
+def score(*items):
+    recommendations, confidence = LocalScorer().score(list(items))
+    return recommendations.tolist(), confidence.tolist()
+
+
+def test_agreeing_terms_score_locally():
+    assert score(("Apple beats estimates, raises guidance", "Apple")) == ([1], [4.0])
+    assert score(("Boeing plunges after recall", "Boeing")) == ([-1], [4.0])
+
+
+def test_single_term_goes_to_the_model():
+    assert score(("Ford issues recall", "Ford"))[1] == [0.0]
+    assert score(("Nvidia beats", "Nvidia"))[1] == [0.0]
+
+
+def test_mixed_terms_go_to_the_model():
+    assert score(("Tesla beats on revenue but misses on margins, shares plunge", "Tesla"))[1] == [0.0]
+
+
+def test_scheduling_news_is_neutral():
+    assert score(("Apple to present at investor conference", "Apple")) == ([0], [NEUTRAL_CONFIDENCE])
+    # unless it has polar wording
+    assert score(("Apple to report after shares surge", "Apple"))[1] == [0.0]
+
+
+def test_headline_about_several_companies_goes_to_the_model():
+    headline = "Apple beats Samsung as smartphone sales surge"
+    recommendations, confidence = score((headline, "Apple"), (headline, "Samsung"), ("Intel beats, shares surge", "Intel"))
+    assert confidence == [0.0, 0.0, 4.0]
+
+
+def test_prefilter_escalates_uncertain_headlines():
+    sent = []
+
+    def remote(items, term):
+        sent.extend(items)
+        return [1] * len(items)
+
+    items = [
+        ("Apple beats estimates, shares surge", "Apple"),
+        ("Ford issues recall", "Ford"),
+        ("Microsoft to present at investor conference", "Microsoft"),
+        ("Meta and Alphabet: shares surge, earnings beat", "Meta"),
+        ("Meta and Alphabet: shares surge, earnings beat", "Alphabet"),
+    ]
+    recommendations, escalated = PrefilterScorer(remote).score(items, "short")
+    assert escalated == [False, True, False, True, True]
+    assert sent == [items[1], items[3], items[4]]
+    assert recommendations == [1, 1, 0, 1, 1]
@@ -0,0 +1,77 @@
+import alpaca_trade_api as tradeapi
+import pandas as pd
+import pytest
+
+import order_executor
+from fake_alpaca import start_fake_alpaca
+from order_executor import MAX_RETRIES, OrderExecutor, client_order_id
+
+TICKERS = ["AAPL", "MSFT", "NVDA"]
+ORDERS = pd.DataFrame({"ticker": TICKERS, "side": ["buy", "sell", "buy"], "num_shares": [1.0, 2.0, 3.0]})
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(order_executor, "BACKOFF_BASE", 0.001)
+
+
+def start(**options):
+    server = start_fake_alpaca({ticker: {} for ticker in TICKERS}, {ticker: 10.0 for ticker in TICKERS}, **options)
+    api = tradeapi.REST("fake", "fake", base_url=server.base_url, api_version="v2")
+    return server, OrderExecutor(api, rate=1000, max_workers=1, poll_seconds=0.05, fill_timeout=2)
+
+
+def test_lost_acknowledgement_is_resolved_by_client_order_id():
+    # the first submission is placed but answered with a 500; its retry gets a 422 duplicate
+    server, executor = start(faults=["lost_ack"])
+    try:
+        report = executor.execute(ORDERS, "morning", "2024-01-02")
+    finally:
+        server.shutdown()
+    first = report.iloc[0]
+    assert first["client_order_id"] == client_order_id("morning", "2024-01-02", "AAPL", "buy")
+    assert first["attempts"] == 2
+    assert first["error"] is None
+    assert first["order_id"] == server.find_order(first["client_order_id"])["id"]
+    assert server.requests["GET /v2/orders:by_client_order_id"] == 1
+    assert len(server.state["orders"]) == len(ORDERS)
+    assert (report["status"] == "filled").all()
+
+
+def test_rerun_places_no_order_twice():
+    server, executor = start()
+    try:
+        executor.execute(ORDERS, "morning", "2024-01-02")
+        report = executor.execute(ORDERS, "morning", "2024-01-02")
+    finally:
+        server.shutdown()
+    assert report["order_id"].notna().all()
+    assert len(server.state["orders"]) == len(ORDERS)
+    assert server.requests["GET /v2/orders:by_client_order_id"] == len(ORDERS)
+
+
+def test_retries_are_capped():
+    # every submission of the first order fails with a retryable 503
+    server, executor = start(faults=[503] * (MAX_RETRIES + 1))
+    try:
+        report = executor.execute(ORDERS.head(1), "morning", "2024-01-02")
+    finally:
+        server.shutdown()
+    (result,) = report.to_dict("records")
+    assert result["attempts"] == MAX_RETRIES + 1
+    assert result["order_id"] is None
+    assert result["error"]
+    assert server.state["orders"] == {}
+
+
+def test_client_errors_are_not_retried():
+    server, executor = start()
+    try:
+        report = executor.execute(
+            pd.DataFrame({"ticker": ["ZZZZ"], "side": ["buy"], "num_shares": [1.0]}), "morning", "2024-01-02"
+        )
+    finally:
+        server.shutdown()
+    (result,) = report.to_dict("records")
+    assert result["attempts"] == 1
+    assert "not found" in result["error"]
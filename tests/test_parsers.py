@@ -0,0 +1,77 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+import headline_scraper
+from fake_news import fixture_page, fixture_site, start_fake_news
+from headline_scraper import parse_headlines_bs4, parse_headlines_lxml, scrape_all_headlines
+
+# Saved copies of the Google News topic pages, to check the lxml parser against the BeautifulSoup one on the
+# markup the scraper actually meets: nested headline text, entities, extra classes, articles without a date
+# and the class names repeated inside scripts. Save a fresh copy of a page here when the sites change.
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+SAVED_PAGES = sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+SITE = headline_scraper.google_business
+
+
+def read_page(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("path", SAVED_PAGES, ids=os.path.basename)
+def test_parsers_agree_on_saved_pages(path):
+    page = read_page(path)
+    baseline = parse_headlines_bs4(page, SITE)
+    assert baseline
+    assert parse_headlines_lxml(page, SITE) == baseline
+
+
+@pytest.mark.parametrize("path", SAVED_PAGES, ids=os.path.basename)
+def test_saved_page_dates_parse(path):
+    headlines = parse_headlines_lxml(read_page(path), SITE)
+    dates = pd.Series([h["datetime"] for h in headlines])
+    assert pd.to_datetime(dates.dropna(), utc=True).notna().all()
+    assert all(h["source"] == SITE["name"] for h in headlines)
+
+
+def test_headline_text_and_dates():
+    headlines = parse_headlines_lxml(read_page(os.path.join(FIXTURES, "google_business.html")), SITE)
+    by_text = {h["headline"]: h["datetime"] for h in headlines}
+    # entities decoded, surrounding whitespace stripped, nested markup flattened
+    assert by_text["Apple's stock falls & analysts trim targets after Barclays downgrade"] == "2024-01-02T13:41:07Z"
+    assert by_text["Apple Cuts Prices of iPhone 15 in China, a Rare Move"] == "2024-01-02T11:00:00Z"
+    # a headline without a date of its own takes the next one on the page, like find_next
+    assert by_text["BYD overtakes Tesla as the world’s top EV seller — for now"] == "2024-01-02T09:15:00Z"
+    # and the last one has none
+    assert by_text["What to expect from bank earnings next week"] is None
+
+
+def test_site_without_dates():
+    site = dict(SITE, date_attrs=None)
+    page = read_page(os.path.join(FIXTURES, "google_tech.html"))
+    headlines = parse_headlines_lxml(page, site)
+    assert headlines == parse_headlines_bs4(page, site)
+    assert all(h["datetime"] is None for h in headlines)
+
+
+@pytest.mark.parametrize("n", [0, 1, 10, 100])
+def test_parsers_agree_on_generated_pages(n):
+    page = fixture_page(n, seed=n)
+    assert parse_headlines_lxml(page, SITE) == parse_headlines_bs4(page, SITE)
+
+
+@pytest.mark.parametrize("engine", ["bs4", "lxml"])
+def test_scrape_saved_pages(monkeypatch, engine):
+    monkeypatch.setattr(headline_scraper, "PARSER_ENGINE", engine)
+    server = start_fake_news({"/" + os.path.basename(path): read_page(path) for path in SAVED_PAGES})
+    try:
+        sites = [fixture_site(server, "/" + os.path.basename(path)) for path in SAVED_PAGES]
+        headlines = scrape_all_headlines(sites)
+    finally:
+        server.shutdown()
+    expected = {h["headline"] for path in SAVED_PAGES for h in parse_headlines_bs4(read_page(path), SITE)}
+    assert set(headlines["headline"]) == expected
+    assert headlines["headline"].is_unique
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from position_sizer import ALLOCATION_MODELS, size_positions
+
+
+def trades(sides, fractionable, recommendation=None):
+    df = pd.DataFrame(
+        {"ticker": [f"T{i}" for i in range(len(sides))], "side": sides, "fractionable": pd.array(fractionable, dtype=object)}
+    )
+    if recommendation is not None:
+        df["recommendation"] = recommendation
+    return df
+
+
+def shares(sized):
+    return dict(zip(sized["ticker"], sized["num_shares"]))
+
+
+def test_unknown_assets_are_dropped_on_both_sides():
+    df = trades(["buy", "sell", "sell", "buy"], [None, np.nan, False, True])
+    sized = size_positions(df, [10.0, 10.0, 10.0, 10.0], 100.0)
+    assert set(sized["ticker"]) == {"T2", "T3"}
+
+
+def test_whole_shares_first_then_fractional_buys():
+    df = trades(["sell", "buy", "buy", "buy"], [True, False, True, True])
+    sized = size_positions(df, [20.0, 30.0, 10.0, 25.0], 200.0)
+    assert sized["ticker"].tolist() == ["T0", "T1", "T2", "T3"]
+    result = shares(sized)
+    assert result["T0"] == result["T1"] == 1.0
+    # 150 left, split equally between two buys
+    assert result["T2"] == pytest.approx(7.5)
+    assert result["T3"] == pytest.approx(3.0)
+
+
+def test_unaffordable_and_unpriced_trades_are_dropped():
+    df = trades(["sell", "buy", "buy"], [True, False, True])
+    sized = size_positions(df, [500.0, 10.0, np.nan], 300.0)
+    assert sized["ticker"].tolist() == ["T1"]
+
+
+@pytest.mark.parametrize("model", list(ALLOCATION_MODELS))
+def test_fractional_buys_spend_what_is_left(model):
+    df = trades(["buy"] * 4, [True] * 4, recommendation=[1.0, 0.5, -0.2, np.nan])
+    prices = np.array([10.0, 20.0, 40.0, 80.0])
+    sized = size_positions(df, prices, 1000.0, model, volatility=[0.01, 0.02, np.nan, 0.04])
+    price = pd.Series(prices, index=df["ticker"])
+    spent = (sized["num_shares"] * price[sized["ticker"]].to_numpy()).sum()
+    assert spent == pytest.approx(1000.0)
+
+
+def test_unknown_model():
+    with pytest.raises(ValueError):
+        size_positions(trades(["buy"], [True]), [1.0], 10.0, "kelly")
@@ -0,0 +1,43 @@
+import pytest
+
+import local_scorer
+from local_scorer import REMOTE_CALL_COST, PrefilterScorer
+from prompts import TokenUsage, answer_to_recommendation, recommendation_messages
+
+MESSAGES = recommendation_messages("Apple beats estimates", "Apple", "short")
+
+
+def test_priced_model_cost():
+    usage = TokenUsage()
+    _, _, cost = usage.record("gpt-3.5-turbo", MESSAGES, "YES")
+    assert cost > 0
+    assert usage.cost_per_call() == pytest.approx(cost)
+    assert "about $" in usage.summary()
+
+
+def test_unpriced_model_has_no_cost(capsys):
+    usage = TokenUsage()
+    assert usage.record("gpt-4o", MESSAGES, "YES")[2] is None
+    usage.record("gpt-4o", MESSAGES, "NO")
+    # warned once per model
+    assert capsys.readouterr().out.count("no price for model gpt-4o") == 1
+    assert usage.cost_per_call() is None
+    assert "cost unknown, no price for gpt-4o" in usage.summary()
+
+
+def test_no_calls_no_cost():
+    assert TokenUsage().cost_per_call() is None
+
+
+def test_prefilter_assumes_the_estimate_without_a_price(monkeypatch):
+    usage = TokenUsage()
+    usage.record("gpt-4o", MESSAGES, "YES")
+    monkeypatch.setattr(local_scorer, "USAGE", usage)
+    scorer = PrefilterScorer(lambda items, term: [0] * len(items))
+    scorer.score([("Apple to present at investor conference", "Apple")], "short")
+    assert f"${REMOTE_CALL_COST:.4f} saved" in scorer.stats()
+
+
+@pytest.mark.parametrize("answer, expected", [("YES", 1), ("NO", -1), ("UNK", 0), ("Y", 1), ("N", -1), ("", 0), ("yes.", 1)])
+def test_answer_to_recommendation(answer, expected):
+    assert answer_to_recommendation(answer) == expected